@@ -0,0 +1,112 @@
+"""Benchmark de arranque: tiempo hasta la primera solicitud y memoria de un proceso nuevo.
+
+Cada medición se hace en un intérprete nuevo (como un worker recién creado) y registra:
+    importar         `import main` (configuración, caché, cola de trabajos)
+    primer_health    importar + primera respuesta de GET /health
+    primer_upload    importar + /health + primer POST /upload de un lote de pares con su descarga
+    rss_import_mb    memoria residente después de importar (lo que hereda un worker pre-fork)
+    rss_max_mb       RSS máximo del proceso al terminar
+
+con los backends cargados en el primer uso (WARMUP=0) y precargados al importar (WARMUP=1).
+
+Uso:
+    python benchmarks/bench_arranque.py --repeticiones 5 --salida arranque.json
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+ESCENARIOS = {
+    "perezoso": {"WARMUP": "0"},
+    "precalentado": {"WARMUP": "1"},
+}
+
+METRICAS = ("importar_s", "primer_health_s", "primer_upload_s", "rss_import_mb", "rss_max_mb")
+
+
+def medir_hijo(directorio):
+    """Se ejecuta en el proceso nuevo: importa la app y atiende las dos primeras solicitudes"""
+    inicio = time.perf_counter()
+    import main
+    importar = time.perf_counter() - inicio
+    from utils.metrics import rss_actual_mb, rss_maximo_mb
+    rss_import = rss_actual_mb()
+
+    cliente = main.app.test_client()
+    if cliente.get("/health").status_code != 200:
+        raise RuntimeError("/health no respondió OK")
+    primer_health = time.perf_counter() - inicio
+
+    handles = [open(os.path.join(directorio, nombre), "rb") for nombre in sorted(os.listdir(directorio))]
+    try:
+        datos = {"modo": "pares", "color_mode": "grayscale",
+                 "files": [(h, os.path.basename(h.name)) for h in handles]}
+        respuesta = cliente.post("/upload", data=datos, content_type="multipart/form-data")
+        if respuesta.status_code != 200:
+            raise RuntimeError(respuesta.get_json())
+        len(cliente.get(respuesta.get_json()["download_url"]).data)
+    finally:
+        for h in handles:
+            h.close()
+    primer_upload = time.perf_counter() - inicio
+
+    return {"importar_s": importar, "primer_health_s": primer_health, "primer_upload_s": primer_upload,
+            "rss_import_mb": rss_import, "rss_max_mb": rss_maximo_mb()}
+
+
+def _ejecutar(escenario, directorio):
+    entorno = dict(os.environ, CACHE_DIR="", BUNDLE_DIR="", MAX_WORKERS="1", **ESCENARIOS[escenario])
+    salida = subprocess.run([sys.executable, os.path.abspath(__file__), "--hijo", directorio],
+                            cwd=RAIZ, env=entorno, capture_output=True, text=True, check=True).stdout
+    # La medición es la última línea; antes puede haber mensajes de la app
+    return json.loads(salida.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--pares", type=int, default=2)
+    parser.add_argument("--salida", default=None, help="Archivo JSON con los resultados")
+    parser.add_argument("--hijo", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.hijo:
+        print(json.dumps(medir_hijo(args.hijo)))
+        return
+
+    from bench_pares import generar_lote
+
+    directorio = tempfile.mkdtemp(prefix="bench_arranque_")
+    try:
+        generar_lote(directorio, args.pares, paginas=1, conceptos=50)
+        resultados = []
+        print(f"{'escenario':<14} " + " ".join(f"{m:>16}" for m in METRICAS))
+        for escenario in ESCENARIOS:
+            mediciones = [_ejecutar(escenario, directorio) for _ in range(args.repeticiones)]
+            # Mediana de las repeticiones: el primer intérprete suele pagar la caché de disco fría
+            resultado = {"escenario": escenario, "repeticiones": args.repeticiones}
+            resultado.update({m: statistics.median(x[m] for x in mediciones) for m in METRICAS})
+            resultados.append(resultado)
+            print(f"{escenario:<14} " + " ".join(f"{resultado[m]:>16.3f}" for m in METRICAS))
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "cpus": os.cpu_count(), "resultados": resultados},
+                      f, indent=2)
+        print(f"\nResultados en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Comparación de tamaño y tiempo entre los modos de escala de grises "raster" y "vector".
+
+Genera facturas de ejemplo (solo texto, con logotipo y fotografía, y escaneada) y las
+optimiza con optimize_pdf_size(grayscale=True) en ambos modos.
+
+Uso:
+    python benchmarks/bench_grayscale.py --paginas 5
+"""
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageDraw
+from converters.pdf_optimizer import optimize_pdf_size
+
+
+def _imagen(ancho, alto, formato, escaneo=False):
+    """Imagen sintética: degradado de color con texto (o página escaneada en tonos cálidos)"""
+    img = Image.new("RGB", (ancho, alto), (250, 246, 235) if escaneo else (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    if escaneo:
+        for y in range(40, alto - 40, 28):
+            draw.text((60, y), "Concepto escaneado  cantidad 1  importe 123.45  " * 2, fill=(40, 40, 60))
+    else:
+        for x in range(0, ancho, 4):
+            draw.line([(x, 0), (x, alto)], fill=(x * 255 // ancho, 120, 255 - x * 255 // ancho), width=4)
+        draw.ellipse([ancho // 4, alto // 4, ancho * 3 // 4, alto * 3 // 4], fill=(200, 30, 30))
+    data = io.BytesIO()
+    img.save(data, format=formato, quality=90)
+    return data.getvalue()
+
+
+def generar_muestras(directorio, paginas):
+    """Crea las facturas de ejemplo y devuelve {nombre: ruta}"""
+    logo = _imagen(300, 120, "PNG")
+    foto = _imagen(1200, 800, "JPEG")
+    escaneo = _imagen(1700, 2200, "JPEG", escaneo=True)
+    muestras = {}
+
+    for nombre in ("texto", "imagenes", "escaneada"):
+        doc = fitz.open()
+        for p in range(paginas):
+            page = doc.new_page()
+            if nombre == "escaneada":
+                page.insert_image(page.rect, stream=escaneo)
+                continue
+            page.insert_text((50, 60), f"Factura de ejemplo - página {p + 1}", fontsize=16, color=(0.1, 0.2, 0.6))
+            for linea in range(35):
+                page.insert_text((50, 200 + linea * 16), f"Concepto {linea:03d}  cantidad 1  importe {linea * 10.5:.2f}",
+                                 color=(0.6, 0, 0) if linea % 5 == 0 else (0, 0, 0))
+            page.draw_rect(fitz.Rect(40, 180, 560, 770), color=(0, 0.4, 0.2), width=1.5)
+            if nombre == "imagenes":
+                page.insert_image(fitz.Rect(400, 30, 560, 94), stream=logo)
+                page.insert_image(fitz.Rect(300, 600, 560, 770), stream=foto)
+        ruta = os.path.join(directorio, f"{nombre}.pdf")
+        doc.save(ruta, garbage=4, deflate=True)
+        doc.close()
+        muestras[nombre] = ruta
+    return muestras
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paginas", type=int, default=5)
+    args = parser.parse_args()
+
+    base_dir = tempfile.mkdtemp()
+    try:
+        muestras = generar_muestras(base_dir, args.paginas)
+        print(f"{'muestra':<10} {'original':>10} {'modo':>7} {'bytes':>10} {'segundos':>9}")
+        for nombre, ruta in muestras.items():
+            original = os.path.getsize(ruta)
+            for modo in ("raster", "vector"):
+                output_dir = os.path.join(base_dir, modo)
+                inicio = time.perf_counter()
+                salida = optimize_pdf_size(ruta, output_dir=output_dir, grayscale=True, grayscale_mode=modo)
+                duracion = time.perf_counter() - inicio
+                print(f"{nombre:<10} {original:>10} {modo:>7} {os.path.getsize(salida):>10} {duracion:>9.3f}")
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
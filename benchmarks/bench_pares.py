@@ -0,0 +1,91 @@
+"""Benchmark de escalamiento del procesamiento por pares (modo=pares).
+
+Genera un lote sintético de facturas PDF+XML y mide el rendimiento de
+PDFProcessor.procesar_pares con 1..N workers.
+
+Uso:
+    python benchmarks/bench_pares.py --pares 40 --max-workers 8
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # PyMuPDF
+from converters.pdf_processor import PDFProcessor
+
+
+def generar_lote(directorio, pares, paginas=2, conceptos=200):
+    """Crea `pares` facturas sintéticas (PDF con texto + XML tipo CFDI)"""
+    grupos = {}
+    for i in range(pares):
+        base = f"factura_{i:05d}"
+        pdf_path = os.path.join(directorio, f"{base}.pdf")
+        xml_path = os.path.join(directorio, f"{base}.xml")
+
+        doc = fitz.open()
+        for p in range(paginas):
+            page = doc.new_page()
+            page.insert_text((50, 60), f"Factura {base} - página {p + 1}", fontsize=16)
+            for linea in range(40):
+                page.insert_text((50, 90 + linea * 17), f"Concepto {linea:03d}  cantidad 1  importe {linea * 10.5:.2f}")
+            page.draw_rect(fitz.Rect(400, 40, 560, 80), color=(0.8, 0.1, 0.1), fill=(0.9, 0.9, 1))
+        doc.save(pdf_path)
+        doc.close()
+
+        conceptos_xml = "\n".join(
+            f'    <cfdi:Concepto ClaveProdServ="01010101" Cantidad="1" Descripcion="Producto {c}" '
+            f'ValorUnitario="{c}.00" Importe="{c}.00"/>'
+            for c in range(conceptos)
+        )
+        with open(xml_path, "w", encoding="utf-8") as f:
+            f.write(
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<cfdi:Comprobante xmlns:cfdi="http://www.sat.gob.mx/cfd/4" Version="4.0" '
+                f'Folio="{i}" Fecha="2024-01-01T00:00:00" Total="100.00">\n'
+                '  <cfdi:Emisor Rfc="AAA010101AAA" Nombre="EMISOR DE PRUEBA"/>\n'
+                '  <cfdi:Conceptos>\n'
+                f'{conceptos_xml}\n'
+                '  </cfdi:Conceptos>\n'
+                '</cfdi:Comprobante>\n'
+            )
+        grupos[base] = [pdf_path, xml_path]
+    return grupos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pares", type=int, default=40)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--grayscale", action="store_true")
+    args = parser.parse_args()
+
+    base_dir = tempfile.mkdtemp()
+    try:
+        entrada = os.path.join(base_dir, "entrada")
+        os.makedirs(entrada)
+        grupos = generar_lote(entrada, args.pares)
+        workers = 1
+        base = None
+        print(f"{'workers':>8} {'segundos':>10} {'pares/s':>10} {'speedup':>8}")
+        while workers <= args.max_workers:
+            output_dir = os.path.join(base_dir, f"salida_{workers}")
+            processor = PDFProcessor(temp_dir=os.path.join(base_dir, "tmp"), max_workers=workers)
+            inicio = time.perf_counter()
+            resultados = processor.procesar_pares(grupos, output_dir, grayscale=args.grayscale)
+            duracion = time.perf_counter() - inicio
+            errores = sum(1 for r in resultados if r['error'])
+            base = base or duracion
+            print(f"{workers:>8} {duracion:>10.2f} {args.pares / duracion:>10.1f} {base / duracion:>7.2f}x"
+                  + (f"  ({errores} errores)" if errores else ""))
+            workers *= 2
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
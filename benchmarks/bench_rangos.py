@@ -0,0 +1,122 @@
+"""Punto de equilibrio del reparto de un PDF por rangos de páginas entre procesos.
+
+Optimiza en escala de grises documentos de distinto número de páginas en serie y
+repartidos entre 2 procesos (forzando el reparto aunque el documento sea chico) y estima:
+    por_pagina_s     costo en serie de una página
+    reparto_s        costo fijo del reparto: pool, temporal, rangos y reensamblado
+    equilibrio       páginas a partir de las que 2 procesos terminan antes que uno
+
+Se miden páginas de solo texto, con logotipo y foto propios, y escaneadas; cada página
+lleva sus propias imágenes (como un lote de facturas distintas ya deduplicado). Con una
+sola CPU el reparto no acelera nada y la diferencia entre ambos tiempos es su costo fijo;
+el equilibrio se estima como reparto_s / (por_pagina_s * (1 - 1/2)).
+
+Resultados que fijan PAGINAS_MIN_RANGO y BYTES_IMAGENES_MIN_RANGO (1 CPU, PyMuPDF 1.28,
+mediana de 3 ejecuciones, segundos):
+    muestra    páginas  MB img  serie   2 proc  por página  reparto
+    texto           16    0.00  0.030    0.120      0.0019    0.090
+    texto           64    0.00  0.113    0.226      0.0018    0.114
+    imagenes        16    1.02  0.812    1.012      0.0508    0.200
+    imagenes        64    4.05  3.425    3.858      0.0535    0.432
+    escaneada        4    1.59  1.179    1.432      0.2946    0.254
+    escaneada       32   12.99  8.674    9.554      0.2711    0.880
+
+Uso:
+    python benchmarks/bench_rangos.py --paginas 8 16 32
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageDraw
+from converters import pdf_optimizer
+
+
+def _imagen(ancho, alto, semilla, escaneo=False):
+    """JPEG sintético distinto por `semilla` (escaneo de una hoja o foto en color)"""
+    img = Image.new("RGB", (ancho, alto), (250, 246, 235) if escaneo else (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    if escaneo:
+        for y in range(40, alto - 40, 28):
+            draw.text((60, y), f"Concepto {semilla} escaneado  cantidad 1  importe {y * 1.5:.2f}  " * 2,
+                      fill=(40, 40, 60))
+    else:
+        for x in range(0, ancho, 4):
+            draw.line([(x, 0), (x, alto)], fill=((x + semilla * 7) % 255, 120, 255 - x * 255 // ancho), width=4)
+        draw.text((20, 20), f"Foto {semilla}", fill=(0, 0, 0))
+    data = io.BytesIO()
+    img.save(data, format="JPEG", quality=90)
+    return data.getvalue()
+
+
+def generar(ruta, tipo, paginas):
+    doc = fitz.open()
+    for p in range(paginas):
+        page = doc.new_page()
+        if tipo == "escaneada":
+            page.insert_image(page.rect, stream=_imagen(1700, 2200, p, escaneo=True))
+            continue
+        page.insert_text((50, 60), f"Factura de ejemplo - página {p + 1}", fontsize=16)
+        for linea in range(35):
+            page.insert_text((50, 200 + linea * 16), f"Concepto {linea:03d}  cantidad 1  importe {linea * 10.5:.2f}")
+        if tipo == "imagenes":
+            page.insert_image(fitz.Rect(400, 30, 560, 94), stream=_imagen(300, 120, p))
+            page.insert_image(fitz.Rect(300, 600, 560, 770), stream=_imagen(1200, 800, p + 1000))
+    doc.save(ruta, garbage=4, deflate=True)
+    doc.close()
+    return ruta
+
+
+def _medir(ruta, workers, repeticiones, directorio):
+    tiempos = []
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            pdf_optimizer.optimize_pdf_size(ruta, output_dir=directorio, grayscale=True, workers=workers)
+            tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paginas", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    # Se fuerza el reparto en 2 procesos aunque el documento tenga pocas páginas
+    pdf_optimizer.PAGINAS_MIN_RANGO = 1
+    base_dir = tempfile.mkdtemp()
+    try:
+        print(f"CPUs: {os.cpu_count()}")
+        print(f"{'muestra':<10} {'páginas':>7} {'MB img':>7} {'serie_s':>8} {'2 proc_s':>8} "
+              f"{'por_pagina_s':>12} {'reparto_s':>9} {'equilibrio':>10}")
+        for tipo in ("texto", "imagenes", "escaneada"):
+            for paginas in args.paginas:
+                ruta = generar(os.path.join(base_dir, f"{tipo}_{paginas}.pdf"), tipo, paginas)
+                with fitz.open(ruta) as doc:
+                    mb_imagenes = pdf_optimizer.bytes_imagenes(doc) / (1024 * 1024)
+                salida = os.path.join(base_dir, "salida")
+                # Una pasada previa carga los backends y el servidor de procesos
+                _medir(ruta, 2, 1, salida)
+                serie = _medir(ruta, 1, args.repeticiones, salida)
+                repartido = _medir(ruta, 2, args.repeticiones, salida)
+                por_pagina = serie / paginas
+                reparto = max(0.0, repartido - serie) if (os.cpu_count() or 1) == 1 else None
+                equilibrio = f"{reparto / (por_pagina * 0.5):>10.0f}" if reparto is not None else f"{'-':>10}"
+                print(f"{tipo:<10} {paginas:>7} {mb_imagenes:>7.2f} {serie:>8.3f} {repartido:>8.3f} "
+                      f"{por_pagina:>12.4f} {reparto if reparto is not None else 0:>9.3f} {equilibrio}")
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
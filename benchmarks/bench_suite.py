@@ -0,0 +1,247 @@
+"""Suite de benchmarks con corpus sintético y resultados en JSON comparables entre versiones.
+
+Mide rendimiento, latencia p50/p99 y RSS máximo de:
+    XMLtoPDFConverter.convert               XML pequeño, mediano y grande
+    PDFProcessor.combinar_archivos          lote de pares (cadena PyPDF2)
+    PDFProcessor.combinar_y_optimizar       lote de pares (fitz), color y grises
+    optimize_pdf_size                       PDF pequeño, grande, con imágenes y escaneado; color y grises
+    POST /upload + descarga                 lote de pares con el cliente de prueba de Flask
+
+Cada caso se ejecuta en un proceso nuevo para que el RSS máximo sea solo el suyo. La
+caché de resultados se desactiva para medir siempre el trabajo completo.
+
+Uso:
+    python benchmarks/bench_suite.py --escala rapida --salida base.json
+    python benchmarks/bench_suite.py --salida nuevo.json --comparar base.json --umbral 15
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import math
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import ESCALAS, generar_corpus
+from utils.metrics import rss_maximo_mb
+
+
+def _percentil(valores, q):
+    """Percentil por rango más cercano sobre valores ordenados"""
+    return valores[max(0, min(len(valores) - 1, math.ceil(q * len(valores)) - 1))]
+
+
+def _tamano(rutas):
+    return sum(os.path.getsize(r) for r in rutas)
+
+
+def _preparar(caso, trabajo):
+    """Devuelve (operación sin argumentos, bytes de entrada) para el caso"""
+    tipo = caso["tipo"]
+
+    if tipo == "convert":
+        from converters.xml_to_pdf import XMLtoPDFConverter
+        converter = XMLtoPDFConverter()
+        salida = os.path.join(trabajo, "salida.pdf")
+        return (lambda: converter.convert(caso["entrada"], salida)), _tamano([caso["entrada"]])
+
+    if tipo in ("combinar_archivos", "combinar_y_optimizar"):
+        from converters.pdf_processor import PDFProcessor
+        archivos = [f for grupo in caso["entrada"].values() for f in grupo]
+        salida = os.path.join(trabajo, "salida", "combinado.pdf")
+        if tipo == "combinar_archivos":
+            processor = PDFProcessor(temp_dir=os.path.join(trabajo, "tmp"), backend="pypdf2")
+            operacion = lambda: processor.combinar_archivos(archivos, salida, modo="pares")
+        else:
+            processor = PDFProcessor(temp_dir=os.path.join(trabajo, "tmp"), backend="fitz")
+            operacion = lambda: processor.combinar_y_optimizar(archivos, salida, modo="pares",
+                                                               grayscale=caso["grayscale"])
+        return operacion, _tamano(archivos)
+
+    if tipo == "optimize_pdf_size":
+        from converters.pdf_optimizer import optimize_pdf_size
+        return (lambda: optimize_pdf_size(caso["entrada"], output_dir=trabajo, grayscale=caso["grayscale"])), \
+            _tamano([caso["entrada"]])
+
+    if tipo == "upload":
+        import main
+        cliente = main.app.test_client()
+        archivos = sorted(f for grupo in caso["entrada"].values() for f in grupo)
+
+        def operacion():
+            handles = [open(f, "rb") for f in archivos]
+            try:
+                datos = {"modo": caso["modo"], "color_mode": caso["color_mode"],
+                         "files": [(h, os.path.basename(h.name)) for h in handles]}
+                respuesta = cliente.post("/upload", data=datos, content_type="multipart/form-data")
+                if respuesta.status_code != 200:
+                    raise RuntimeError(respuesta.get_json())
+                descarga = cliente.get(respuesta.get_json()["download_url"])
+                len(descarga.data)
+            finally:
+                for h in handles:
+                    h.close()
+        return operacion, _tamano(archivos)
+
+    raise ValueError(f"Tipo de caso desconocido: {tipo}")
+
+
+def _ejecutar_caso(caso):
+    """Se ejecuta en un proceso nuevo: calienta una vez y mide `iteraciones` ejecuciones"""
+    os.environ["CACHE_DIR"] = ""  # sin caché: se mide el trabajo completo
+    trabajo = tempfile.mkdtemp(prefix="bench_")
+    try:
+        operacion, bytes_entrada = _preparar(caso, trabajo)
+        rss_inicial = rss_maximo_mb()
+        tiempos = []
+        with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+            operacion()
+            for _ in range(caso["iteraciones"]):
+                inicio = time.perf_counter()
+                operacion()
+                tiempos.append(time.perf_counter() - inicio)
+        tiempos.sort()
+        media = sum(tiempos) / len(tiempos)
+        return {
+            "nombre": caso["nombre"],
+            "iteraciones": len(tiempos),
+            "bytes_entrada": bytes_entrada,
+            "p50_s": round(_percentil(tiempos, 0.50), 5),
+            "p99_s": round(_percentil(tiempos, 0.99), 5),
+            "media_s": round(media, 5),
+            "ops_s": round(1 / media, 3) if media else None,
+            "mb_s": round(bytes_entrada / media / (1024 * 1024), 3) if media else None,
+            "rss_inicial_mb": round(rss_inicial, 1),
+            "rss_max_mb": round(rss_maximo_mb(), 1),
+        }
+    finally:
+        shutil.rmtree(trabajo, ignore_errors=True)
+
+
+def definir_casos(corpus, iteraciones):
+    # Los casos pesados se repiten menos para que la suite termine en un tiempo razonable
+    pocas = max(1, iteraciones // 3)
+    casos = []
+    for nombre, ruta in corpus["xml"].items():
+        casos.append({"nombre": f"convert/xml_{nombre}", "tipo": "convert", "entrada": ruta,
+                      "iteraciones": pocas if nombre == "grande" else iteraciones})
+
+    casos.append({"nombre": "combinar_archivos/pares", "tipo": "combinar_archivos",
+                  "entrada": corpus["pares"], "iteraciones": iteraciones})
+    for grayscale in (False, True):
+        color = "grises" if grayscale else "color"
+        casos.append({"nombre": f"combinar_y_optimizar/pares_{color}", "tipo": "combinar_y_optimizar",
+                      "entrada": corpus["pares"], "grayscale": grayscale, "iteraciones": iteraciones})
+
+    for nombre, ruta in corpus["pdf"].items():
+        for grayscale in (False, True):
+            color = "grises" if grayscale else "color"
+            casos.append({"nombre": f"optimize_pdf_size/{nombre}_{color}", "tipo": "optimize_pdf_size",
+                          "entrada": ruta, "grayscale": grayscale,
+                          "iteraciones": iteraciones if nombre == "pequeno" else pocas})
+
+    for modo, color_mode in (("pares", "grayscale"), ("pares", "color"), ("completo", "grayscale")):
+        casos.append({"nombre": f"upload/{modo}_{color_mode}", "tipo": "upload", "entrada": corpus["pares"],
+                      "modo": modo, "color_mode": color_mode, "iteraciones": pocas})
+    return casos
+
+
+def _metadatos(escala):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import fitz
+    return {
+        "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "escala": escala,
+        "python": platform.python_version(),
+        "pymupdf": fitz.VersionBind,
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def comparar(resultados, base, umbral):
+    """Imprime la variación contra una ejecución anterior; devuelve los casos con regresión"""
+    anteriores = {r["nombre"]: r for r in base["resultados"]}
+    regresiones = []
+    print(f"\nComparación contra {base['meta'].get('commit')} ({base['meta'].get('fecha')}), umbral {umbral}%")
+    print(f"{'caso':<42} {'p50 antes':>10} {'p50 ahora':>10} {'Δp50':>8} {'Δrss':>8}")
+    for r in resultados:
+        anterior = anteriores.get(r["nombre"])
+        if not anterior:
+            print(f"{r['nombre']:<42} {'(nuevo)':>10}")
+            continue
+        delta_p50 = (r["p50_s"] / anterior["p50_s"] - 1) * 100 if anterior["p50_s"] else 0.0
+        delta_rss = (r["rss_max_mb"] / anterior["rss_max_mb"] - 1) * 100 if anterior["rss_max_mb"] else 0.0
+        marca = ""
+        if delta_p50 > umbral or delta_rss > umbral:
+            regresiones.append(r["nombre"])
+            marca = "  <- regresión"
+        print(f"{r['nombre']:<42} {anterior['p50_s']:>10.4f} {r['p50_s']:>10.4f} "
+              f"{delta_p50:>+7.1f}% {delta_rss:>+7.1f}%{marca}")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--escala", choices=tuple(ESCALAS), default="normal")
+    parser.add_argument("--iteraciones", type=int, default=6)
+    parser.add_argument("--filtro", default=None, help="Ejecutar solo los casos cuyo nombre contenga este texto")
+    parser.add_argument("--salida", default=None, help="Archivo JSON donde guardar los resultados")
+    parser.add_argument("--comparar", default=None, help="JSON de una ejecución anterior")
+    parser.add_argument("--umbral", type=float, default=15.0, help="Porcentaje de empeoramiento tolerado")
+    args = parser.parse_args()
+
+    base_dir = tempfile.mkdtemp()
+    try:
+        inicio = time.perf_counter()
+        corpus = generar_corpus(os.path.join(base_dir, "corpus"), args.escala)
+        print(f"Corpus ({args.escala}) generado en {time.perf_counter() - inicio:.1f} s")
+
+        casos = definir_casos(corpus, args.iteraciones)
+        if args.filtro:
+            casos = [c for c in casos if args.filtro in c["nombre"]]
+
+        resultados = []
+        print(f"{'caso':<42} {'p50 s':>9} {'p99 s':>9} {'ops/s':>8} {'MB/s':>8} {'RSS MB':>8}")
+        contexto = multiprocessing.get_context("spawn")
+        for caso in casos:
+            with contexto.Pool(1) as pool:
+                r = pool.apply(_ejecutar_caso, (caso,))
+            resultados.append(r)
+            print(f"{r['nombre']:<42} {r['p50_s']:>9.4f} {r['p99_s']:>9.4f} {r['ops_s']:>8.2f} "
+                  f"{r['mb_s']:>8.2f} {r['rss_max_mb']:>8.1f}")
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+    informe = {"meta": _metadatos(args.escala), "resultados": resultados}
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados guardados en {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            regresiones = comparar(resultados, json.load(f), args.umbral)
+        if regresiones:
+            print(f"\n{len(regresiones)} casos empeoraron más de {args.umbral}%")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
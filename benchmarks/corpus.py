@@ -0,0 +1,113 @@
+"""Corpus sintético para los benchmarks: PDF de distintos perfiles y XML tipo CFDI.
+
+Todo se genera localmente y de forma determinista, sin datos reales.
+"""
+import os
+
+import fitz  # PyMuPDF
+from bench_grayscale import _imagen
+from bench_pares import generar_lote
+
+# Tamaños por escala: páginas de los PDF grandes, MB del XML más grande y pares del lote
+ESCALAS = {
+    "rapida": {"paginas_grande": 20, "xml_mb": 1, "pares": 4},
+    "normal": {"paginas_grande": 200, "xml_mb": 10, "pares": 20},
+    "completa": {"paginas_grande": 1000, "xml_mb": 40, "pares": 100},
+}
+
+
+def _pdf_texto(ruta, paginas):
+    doc = fitz.open()
+    for p in range(paginas):
+        page = doc.new_page()
+        page.insert_text((50, 60), f"Factura sintética - página {p + 1}", fontsize=16)
+        for linea in range(45):
+            page.insert_text((50, 90 + linea * 16), f"Concepto {linea:03d}  cantidad 1  importe {linea * 10.5:.2f}")
+        page.draw_rect(fitz.Rect(40, 80, 560, 820), color=(0, 0.4, 0.2), width=1)
+    doc.save(ruta, garbage=4, deflate=True)
+    doc.close()
+    return ruta
+
+
+def _pdf_imagenes(ruta, paginas):
+    """Páginas con texto, logotipo PNG y una fotografía JPEG distinta por página"""
+    logo = _imagen(300, 120, "PNG")
+    doc = fitz.open()
+    for p in range(paginas):
+        page = doc.new_page()
+        page.insert_text((50, 60), f"Factura con imágenes - página {p + 1}", fontsize=16)
+        page.insert_image(fitz.Rect(400, 30, 560, 94), stream=logo)
+        page.insert_image(fitz.Rect(50, 300, 560, 770), stream=_imagen(1200 + p, 800, "JPEG"))
+    doc.save(ruta, garbage=4, deflate=True)
+    doc.close()
+    return ruta
+
+
+def _pdf_escaneado(ruta, paginas):
+    escaneo = _imagen(1700, 2200, "JPEG", escaneo=True)
+    doc = fitz.open()
+    for _ in range(paginas):
+        page = doc.new_page()
+        page.insert_image(page.rect, stream=escaneo)
+    doc.save(ruta, garbage=4, deflate=True)
+    doc.close()
+    return ruta
+
+
+def generar_xml_cfdi(ruta, tamano_bytes, folio=1):
+    """Escribe un XML tipo CFDI con conceptos hasta alcanzar aproximadamente `tamano_bytes`"""
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<cfdi:Comprobante xmlns:cfdi="http://www.sat.gob.mx/cfd/4" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" Version="4.0" Serie="A" '
+            f'Folio="{folio}" Fecha="2024-01-01T00:00:00" SubTotal="100.00" Moneda="MXN" Total="116.00" '
+            'TipoDeComprobante="I" Exportacion="01" LugarExpedicion="01000">\n'
+            '  <cfdi:Emisor Rfc="AAA010101AAA" Nombre="EMISOR DE PRUEBA" RegimenFiscal="601"/>\n'
+            '  <cfdi:Receptor Rfc="XAXX010101000" Nombre="PUBLICO EN GENERAL" UsoCFDI="G03"/>\n'
+            '  <cfdi:Conceptos>\n'
+        )
+        c = 0
+        while f.tell() < tamano_bytes:
+            f.write(
+                f'    <cfdi:Concepto ClaveProdServ="01010101" NoIdentificacion="SKU-{c:08d}" Cantidad="1" '
+                f'ClaveUnidad="H87" Descripcion="Producto de prueba número {c} con descripción larga" '
+                f'ValorUnitario="{c % 1000}.50" Importe="{c % 1000}.50" ObjetoImp="02">\n'
+                '      <cfdi:Impuestos><cfdi:Traslados>'
+                f'<cfdi:Traslado Base="{c % 1000}.50" Impuesto="002" TipoFactor="Tasa" TasaOCuota="0.160000" '
+                f'Importe="{(c % 1000) * 0.16:.2f}"/></cfdi:Traslados></cfdi:Impuestos>\n'
+                '    </cfdi:Concepto>\n'
+            )
+            c += 1
+        f.write(
+            '  </cfdi:Conceptos>\n'
+            '  <cfdi:Complemento><tfd:TimbreFiscalDigital xmlns:tfd="http://www.sat.gob.mx/TimbreFiscalDigital" '
+            'Version="1.1" UUID="6F9619FF-8B86-D011-B42D-00C04FC964FF" FechaTimbrado="2024-01-01T00:00:01"/>'
+            '</cfdi:Complemento>\n'
+            '</cfdi:Comprobante>\n'
+        )
+    return ruta
+
+
+def generar_corpus(directorio, escala="normal"):
+    """Genera el corpus completo y devuelve {'pdf': {...}, 'xml': {...}, 'pares': {base: [pdf, xml]}}"""
+    config = ESCALAS[escala]
+    os.makedirs(directorio, exist_ok=True)
+
+    pdf = {
+        "pequeno": _pdf_texto(os.path.join(directorio, "pequeno.pdf"), 1),
+        "grande": _pdf_texto(os.path.join(directorio, "grande.pdf"), config["paginas_grande"]),
+        "imagenes": _pdf_imagenes(os.path.join(directorio, "imagenes.pdf"), 10),
+        "escaneado": _pdf_escaneado(os.path.join(directorio, "escaneado.pdf"), 10),
+    }
+    xml = {
+        "pequeno": generar_xml_cfdi(os.path.join(directorio, "pequeno.xml"), 20 * 1024),
+        "mediano": generar_xml_cfdi(os.path.join(directorio, "mediano.xml"), 1024 * 1024),
+    }
+    if config["xml_mb"] > 1:
+        xml["grande"] = generar_xml_cfdi(os.path.join(directorio, "grande.xml"), config["xml_mb"] * 1024 * 1024)
+
+    lote = os.path.join(directorio, "lote")
+    os.makedirs(lote, exist_ok=True)
+    pares = generar_lote(lote, config["pares"])
+    return {"pdf": pdf, "xml": xml, "pares": pares}
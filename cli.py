@@ -0,0 +1,259 @@
+"""Conversión por lotes desde la línea de comandos, sin pasar por el servidor web.
+
+Toma un directorio (o un patrón glob) con PDF y XML y escribe los resultados en un
+directorio de salida con los mismos modos que /upload:
+
+    pares     un PDF por cada par nombre.pdf + nombre.xml  ->  opt_<nombre>.pdf
+    completo  todos los archivos combinados en un solo PDF  ->  opt_<nombre>.pdf
+
+Los pares se forman dentro de cada directorio: con --recursivo (o un glob que abarca
+varios directorios) la salida reproduce los subdirectorios de la entrada.
+
+La ejecución se puede reanudar: los resultados más nuevos que sus entradas se omiten
+(usar --forzar para regenerarlos). Cada resultado se escribe primero en un directorio
+temporal dentro de la salida y se mueve al terminar, así un proceso interrumpido no
+deja PDF a medias que parezcan al día. En modo completo (backend fitz) se guarda un
+manifiesto junto al PDF: el PDF se omite solo si las entradas y su contenido coinciden
+con el manifiesto y, si no, en la siguiente ejecución solo se procesan los archivos
+que cambiaron (también cuando se quitan o renombran entradas).
+
+Uso:
+    python cli.py facturas/ salida/ --modo pares --grayscale --workers 8
+    python cli.py "facturas/**/*" salida/ --recursivo
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import time
+
+from converters.pdf_optimizer import GRAYSCALE_MODES, PRESUPUESTOS, resumen_decisiones
+from converters.pdf_processor import BACKENDS, PDFProcessor
+from utils.cache import ResultCache
+from utils.cfdi import CRITERIOS_ORDEN, leer_encabezado
+from utils.file_utils import IndicePares, allowed_file, ordenar_por_cfdi
+
+# Cada cuántos resultados se imprime una línea de avance
+INTERVALO_AVANCE = 100
+
+
+def listar_entradas(entrada, recursivo=False):
+    """Devuelve los PDF/XML de un directorio o de un patrón glob, ordenados"""
+    if os.path.isdir(entrada):
+        if recursivo:
+            rutas = []
+            for raiz, _, nombres in os.walk(entrada):
+                rutas.extend(os.path.join(raiz, n) for n in nombres)
+        else:
+            rutas = [e.path for e in os.scandir(entrada) if e.is_file()]
+    else:
+        rutas = [r for r in glob.glob(entrada, recursive=recursivo) if os.path.isfile(r)]
+    return sorted(r for r in rutas if allowed_file(os.path.basename(r)))
+
+
+def al_dia(salida, entradas):
+    """True si `salida` existe y es más nueva que todas sus entradas"""
+    try:
+        mtime = os.path.getmtime(salida)
+    except OSError:
+        return False
+    return all(os.path.getmtime(f) <= mtime for f in entradas)
+
+
+def _tamano(archivos):
+    return sum(os.path.getsize(f) for f in archivos)
+
+
+def _raiz_entradas(entrada, archivos):
+    """Directorio común de las entradas: las claves de los pares y la salida son relativas a él"""
+    if os.path.isdir(entrada):
+        return os.path.abspath(entrada)
+    return os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in archivos])
+
+
+def _destino_par(output_dir, clave):
+    """Ruta del resultado de un par; la salida reproduce los subdirectorios de la entrada"""
+    *subdirectorios, base = clave.split("/")
+    return os.path.join(output_dir, *subdirectorios, f"opt_{base}.pdf")
+
+
+def procesar_pares(args, processor, archivos, output_dir, staging):
+    indice = IndicePares(archivos, raiz=_raiz_entradas(args.entrada, archivos))
+    if args.por_uuid:
+        unidos = indice.emparejar_por_uuid()
+        if unidos:
+            print(f"{unidos} pares formados por UUID")
+    grupos, incompletos = indice.completos(), indice.huerfanos()
+    for huerfano in incompletos:
+        print(f"Omitido {huerfano['nombre']}: no tiene su par correspondiente (falta el {huerfano['falta'].upper()})")
+
+    pendientes = {}
+    for base, grupo in grupos.items():
+        if args.forzar or not al_dia(_destino_par(output_dir, base), grupo):
+            pendientes[base] = grupo
+    omitidos = len(grupos) - len(pendientes)
+    if omitidos:
+        print(f"{omitidos} pares ya están al día")
+
+    total = len(pendientes)
+    estado = {'hechos': 0, 'errores': 0, 'bytes': 0, 'decisiones': []}
+    # Las claves con subdirectorio no sirven como nombre de archivo en el directorio temporal
+    claves = {(clave if "/" not in clave else f"{i:06d}_{clave.rsplit('/', 1)[1]}"): clave
+              for i, clave in enumerate(pendientes)}
+
+    def al_terminar(resultado):
+        clave = claves[resultado['nombre']]
+        estado['hechos'] += 1
+        if resultado['error']:
+            estado['errores'] += 1
+            print(f"Error en {clave}: {resultado['error']}")
+        else:
+            destino = _destino_par(output_dir, clave)
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            os.replace(resultado['pdf'], destino)
+            estado['bytes'] += _tamano(pendientes[clave])
+            estado['decisiones'].extend(resultado.get('paginas') or ())
+        if estado['hechos'] % INTERVALO_AVANCE == 0:
+            print(f"  {estado['hechos']}/{total} pares")
+
+    if pendientes:
+        processor.procesar_pares({nombre: pendientes[clave] for nombre, clave in claves.items()}, staging,
+                                 grayscale=args.grayscale, al_terminar=al_terminar)
+    return {
+        'unidad': 'pares',
+        'procesados': estado['hechos'] - estado['errores'],
+        'omitidos': omitidos,
+        'incompletos': len(incompletos),
+        'errores': estado['errores'],
+        'bytes': estado['bytes'],
+        'decisiones': estado['decisiones'],
+    }
+
+
+def _leer_manifiesto(ruta_manifiesto, destino):
+    """(PDF, manifiesto) de la ejecución anterior en modo completo, o None"""
+    if not os.path.isfile(destino):
+        return None
+    try:
+        with open(ruta_manifiesto, encoding='utf-8') as f:
+            return destino, json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def procesar_completo(args, processor, archivos, output_dir, staging):
+    nombre = f"opt_{args.nombre}.pdf"
+    destino = os.path.join(output_dir, nombre)
+    ruta_manifiesto = os.path.join(output_dir, f".{nombre}.manifiesto.json")
+    resumen = {'unidad': 'archivos', 'procesados': 0, 'omitidos': 0, 'incompletos': 0, 'errores': 0, 'bytes': 0,
+               'decisiones': []}
+    if args.orden:
+        metadatos = {os.path.basename(f): leer_encabezado(f) for f in archivos if f.lower().endswith('.xml')}
+        archivos = ordenar_por_cfdi(archivos, args.orden, metadatos)
+
+    manifiesto = None
+    if args.backend == "fitz":
+        anterior = None if args.forzar else _leer_manifiesto(ruta_manifiesto, destino)
+        # Las fechas no bastan: si se quitó o renombró una entrada el PDF sigue siendo más nuevo.
+        # Solo se omite si el manifiesto tiene exactamente estas entradas, con este contenido
+        if anterior and processor.manifiesto_al_dia(archivos, anterior[1], grayscale=args.grayscale):
+            print(f"{nombre} ya está al día")
+            resumen['omitidos'] = len(archivos)
+            return resumen
+        resultado, manifiesto = processor.combinar_incremental(
+            archivos, os.path.join(staging, nombre), grayscale=args.grayscale, anterior=anterior
+        )
+    else:
+        resultado = processor.combinar_y_optimizar(
+            archivos, os.path.join(staging, nombre), modo="completo", grayscale=args.grayscale
+        )
+    if not resultado:
+        print("Error: no se pudo crear el PDF combinado")
+        resumen['errores'] = 1
+        return resumen
+    os.replace(resultado, destino)
+    if manifiesto:
+        temporal = os.path.join(staging, os.path.basename(ruta_manifiesto))
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(manifiesto, f)
+        os.replace(temporal, ruta_manifiesto)
+    resumen['procesados'] = len(archivos)
+    resumen['bytes'] = _tamano(archivos)
+    resumen['decisiones'] = processor.reporte_paginas or []
+    return resumen
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("entrada", help="Directorio o patrón glob con los PDF y XML")
+    parser.add_argument("salida", help="Directorio donde se escriben los resultados")
+    parser.add_argument("--modo", choices=("pares", "completo"), default="pares")
+    parser.add_argument("--grayscale", action="store_true", help="Convertir el resultado a escala de grises")
+    parser.add_argument("--grayscale-mode", choices=GRAYSCALE_MODES, default="vector")
+    parser.add_argument("--backend", choices=BACKENDS, default="fitz")
+    parser.add_argument("--presupuesto", choices=sorted(PRESUPUESTOS), default=None,
+                        help="Reducir las imágenes según el presupuesto de tamaño (por defecto solo se deduplica)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--nombre", default="documento_completo", help="Nombre del PDF en modo completo")
+    parser.add_argument("--orden", choices=sorted(CRITERIOS_ORDEN), default=None,
+                        help="En modo completo, ordenar por datos del CFDI en lugar de por nombre")
+    parser.add_argument("--recursivo", action="store_true", help="Incluir subdirectorios (o ** en el glob)")
+    parser.add_argument("--forzar", action="store_true", help="Regenerar aunque el resultado esté al día")
+    parser.add_argument("--por-uuid", action="store_true",
+                        help="En modo pares, emparejar por el UUID del CFDI los archivos cuyos nombres no coinciden")
+    parser.add_argument("--cache-dir", default=None, help="Caché de resultados compartida con el servidor")
+    parser.add_argument("--memoria-mb", type=int, default=None,
+                        help="Límite de memoria en modo completo: combina por bloques sin superarlo")
+    args = parser.parse_args(argv)
+
+    archivos = listar_entradas(args.entrada, recursivo=args.recursivo)
+    if not archivos:
+        print(f"No se encontraron PDF ni XML en {args.entrada}")
+        return 1
+
+    output_dir = os.path.abspath(args.salida)
+    os.makedirs(output_dir, exist_ok=True)
+    # En el mismo sistema de archivos que la salida para que el movimiento final sea atómico
+    staging = os.path.join(output_dir, f".parcial_{os.getpid()}")
+    os.makedirs(staging, exist_ok=True)
+
+    processor = PDFProcessor(
+        temp_dir=os.path.join(staging, "tmp"),
+        max_workers=args.workers,
+        backend=args.backend,
+        grayscale_mode=args.grayscale_mode,
+        cache=ResultCache(args.cache_dir) if args.cache_dir else None,
+        memoria_max_mb=args.memoria_mb,
+        presupuesto=args.presupuesto
+    )
+
+    inicio = time.perf_counter()
+    try:
+        if args.modo == "pares":
+            resumen = procesar_pares(args, processor, archivos, output_dir, staging)
+        else:
+            resumen = procesar_completo(args, processor, archivos, output_dir, staging)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    duracion = time.perf_counter() - inicio
+
+    unidad = resumen['unidad']
+    print(f"\n{len(archivos)} archivos de entrada en {duracion:.2f} s")
+    print(f"  {unidad} procesados: {resumen['procesados']}")
+    print(f"  {unidad} omitidos (al día): {resumen['omitidos']}")
+    if resumen['incompletos']:
+        print(f"  sin par: {resumen['incompletos']}")
+    print(f"  errores: {resumen['errores']}")
+    if resumen['decisiones']:
+        # Política por página (con --presupuesto o en escala de grises)
+        print(f"  {resumen_decisiones(resumen['decisiones'])}")
+    if resumen['procesados'] and duracion > 0:
+        print(f"  rendimiento: {resumen['procesados'] / duracion:.1f} {unidad}/s, "
+              f"{resumen['bytes'] / duracion / (1024 * 1024):.2f} MB/s de entrada")
+    return 1 if resumen['errores'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
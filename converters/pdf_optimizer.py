@@ -0,0 +1,809 @@
+import os
+import io
+import hashlib
+import math
+import multiprocessing
+import re
+import shutil
+import zlib
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from utils.metrics import metricas
+from utils.perezoso import ModuloPerezoso
+
+# Los backends se importan en el primer uso (ver precalentar en pdf_processor)
+fitz = ModuloPerezoso("fitz")  # PyMuPDF
+Image = ModuloPerezoso("PIL.Image")
+ImageChops = ModuloPerezoso("PIL.ImageChops")
+ImageEnhance = ModuloPerezoso("PIL.ImageEnhance")
+
+
+# Opciones de guardado optimizadas
+SAVE_OPTIONS = {
+    "garbage": 4,
+    "deflate": True,
+    "clean": True
+}
+
+
+GRAYSCALE_MODES = ("vector", "raster")
+
+# Presupuestos de tamaño/calidad: DPI efectivo máximo de las imágenes y calidad JPEG de las
+# recompresiones. `target_dpi`, si se indica, reemplaza el DPI del presupuesto
+PRESUPUESTOS = {
+    "calidad": {"dpi": 200, "calidad_jpeg": 90},
+    "equilibrado": {"dpi": 150, "calidad_jpeg": 80},
+    "tamano": {"dpi": 100, "calidad_jpeg": 60},
+}
+
+# Una imagen se reduce solo si supera el DPI máximo en más de este factor
+HOLGURA_DPI = 1.2
+
+# Fracción de la página que debe cubrir una imagen para tratarla como escaneo
+COBERTURA_ESCANEO = 0.8
+
+# Trabajo mínimo de cada rango al repartir un documento entre procesos: este volumen de
+# imágenes o, en documentos casi sin imágenes, estas páginas. Según benchmarks/bench_rangos.py
+# (grises, 1 CPU) repartir cuesta ~0.1 s más ~0.06 s por MB de imágenes, y en serie cada MB
+# de imágenes cuesta ~0.8 s y cada página de texto ~0.002 s: con 2 procesos se gana desde
+# ~0.3 MB o ~100 páginas de texto por rango; se deja el doble de margen o más
+BYTES_IMAGENES_MIN_RANGO = 1024 * 1024
+PAGINAS_MIN_RANGO = 200
+
+# True dentro de un proceso de nuestros pools: ahí no se abren pools anidados
+_EN_WORKER = False
+
+# Módulos que el servidor de procesos (forkserver) carga una vez para todos los workers
+PRECARGA_POOL = ["fitz", "PIL.Image", "converters.pdf_processor"]
+
+_contexto = None
+
+
+def contexto_pool():
+    """Contexto de multiprocessing para nuestros pools
+
+    Los pools se crean desde hilos (trabajos en segundo plano, solicitudes) y un fork del
+    proceso con hilos puede heredar un lock tomado por otro hilo y bloquearse. Con
+    forkserver los workers salen de un proceso sin hilos que ya cargó PRECARGA_POOL; donde
+    no existe (Windows) se usa spawn.
+    """
+    global _contexto
+    if _contexto is None:
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            contexto = multiprocessing.get_context("forkserver")
+            contexto.set_forkserver_preload(PRECARGA_POOL)
+        else:
+            contexto = multiprocessing.get_context("spawn")
+        _contexto = contexto
+    return _contexto
+
+
+def marcar_worker():
+    """Inicializador de los pools: el proceso no debe repartir su trabajo en otro pool"""
+    global _EN_WORKER
+    _EN_WORKER = True
+
+
+def en_worker():
+    """True si el proceso actual es un worker de nuestros pools"""
+    return _EN_WORKER
+
+
+# Desde un "(" o "<" se saltan strings y nombres; lo demás que coincide es una referencia "N G R"
+_TOKEN_OBJETO = re.compile(r"\(|<<|<[0-9A-Fa-f\s]*>|/[^\s/\[\]()<>{}%]*|(\d+)\s+\d+\s+R\b")
+
+
+def _fin_string(texto, inicio):
+    """Posición siguiente al ")" que cierra el string literal que abre en `inicio`"""
+    nivel, i = 0, inicio
+    while i < len(texto):
+        c = texto[i]
+        if c == "\\":
+            i += 1
+        elif c == "(":
+            nivel += 1
+        elif c == ")":
+            nivel -= 1
+            if not nivel:
+                return i + 1
+        i += 1
+    return len(texto)
+
+
+def _reemplazar_referencias(texto, reemplazos):
+    """Reescribe las referencias indirectas de un valor PDF según {xref: nuevo xref}, sin
+    tocar el contenido de strings ni nombres"""
+    partes, ultimo, pos = [], 0, 0
+    while True:
+        m = _TOKEN_OBJETO.search(texto, pos)
+        if m is None:
+            break
+        if m.group(0) == "(":
+            pos = _fin_string(texto, m.start())
+            continue
+        pos = m.end()
+        if m.group(1) is not None and int(m.group(1)) in reemplazos:
+            partes.append(texto[ultimo:m.start()])
+            partes.append(f"{reemplazos[int(m.group(1))]} 0 R")
+            ultimo = pos
+    if not partes:
+        return texto
+    partes.append(texto[ultimo:])
+    return "".join(partes)
+
+
+def _redirigir_referencias(doc, reemplazos, inicio=1):
+    """Hace que los objetos desde `inicio` apunten a los xref de reemplazo ({xref: nuevo})
+    y deja como null los reemplazados, que el guardado con garbage ya no escribe
+
+    Se recorren las claves de cada diccionario con la API de objetos de PyMuPDF; solo los
+    objetos que no son diccionarios (p. ej. arreglos indirectos) se reescriben completos.
+    """
+    for xref in range(inicio, doc.xref_length()):
+        if xref in reemplazos:
+            continue
+        try:
+            claves = doc.xref_get_keys(xref)
+        except RuntimeError:
+            continue  # Objeto libre
+        if not claves:
+            definicion = doc.xref_object(xref, compressed=True)
+            if definicion.startswith("["):
+                nueva = _reemplazar_referencias(definicion, reemplazos)
+                if nueva != definicion:
+                    doc.update_object(xref, nueva)
+            continue
+        for clave in claves:
+            tipo, valor = doc.xref_get_key(xref, clave)
+            if tipo in ("xref", "array", "dict"):
+                nuevo = _reemplazar_referencias(valor, reemplazos)
+                if nuevo != valor:
+                    doc.xref_set_key(xref, clave, nuevo)
+    for xref in reemplazos:
+        if doc.xref_is_stream(xref):
+            doc.update_stream(xref, b"", compress=False)
+        doc.update_object(xref, "null")
+
+
+def _definiciones(doc, inicio, fin):
+    """{xref: definición} de los objetos entre `inicio` y `fin` que se pueden compartir:
+    todos salvo las páginas (como en el guardado con garbage de MuPDF), los que apunta el
+    trailer y los libres o null"""
+    protegidos = set()
+    for clave in ("Root", "Info"):
+        tipo, valor = doc.xref_get_key(-1, clave)
+        if tipo == "xref":
+            protegidos.add(int(valor.split()[0]))
+    definiciones = {}
+    for xref in range(inicio, fin):
+        if xref in protegidos:
+            continue
+        try:
+            definicion = doc.xref_object(xref, compressed=True)
+        except RuntimeError:
+            continue  # Objeto libre
+        if definicion == "null" or doc.xref_get_key(xref, "Type") == ("name", "/Page"):
+            continue
+        definiciones[xref] = definicion
+    return definiciones
+
+
+def _buscar_reemplazos(doc, definiciones, fijos=()):
+    """{xref: xref equivalente} para los objetos de `definiciones` iguales a uno anterior
+    (en los streams, también en contenido). Los xref de `fijos` pueden ser el equivalente
+    de otros pero nunca se reemplazan
+
+    Se hacen varias pasadas: dos objetos solo coinciden cuando ya se reemplazaron los que
+    apuntan (p. ej. una imagen, su máscara y el arreglo de su perfil ICC). El contenido de
+    un stream solo se lee si otro tiene el mismo diccionario, que incluye su longitud.
+    """
+    fijos = set(fijos)
+    reemplazos, contenidos = {}, {}
+    while True:
+        grupos = {}
+        for xref, definicion in definiciones.items():
+            if xref not in reemplazos:
+                grupos.setdefault(_reemplazar_referencias(definicion, reemplazos), []).append(xref)
+        encontrados = 0
+        for iguales in grupos.values():
+            if len(iguales) < 2:
+                continue
+            conservados = {}
+            for xref in iguales:
+                clave = None
+                if doc.xref_is_stream(xref):
+                    if xref not in contenidos:
+                        contenidos[xref] = hashlib.sha256(doc.xref_stream_raw(xref)).digest()
+                    clave = contenidos[xref]
+                original = conservados.setdefault(clave, xref)
+                if original != xref and xref not in fijos:
+                    reemplazos[xref] = original
+                    encontrados += 1
+        if not encontrados:
+            break
+    # Un objeto conservado en una pasada puede haberse reemplazado en la siguiente
+    for xref, original in reemplazos.items():
+        while original in reemplazos:
+            original = reemplazos[original]
+        reemplazos[xref] = original
+    return reemplazos
+
+
+def deduplicar_recursos(doc):
+    """Deja una sola copia de cada recurso idéntico (logotipos, fuentes incrustadas...) de un
+    documento combinado, antes de procesarlo o guardarlo
+
+    Se trabaja en sitio: las referencias a cada copia pasan a la primera y las copias quedan
+    como null, así la conversión a grises procesa cada recurso una vez y tampoco se
+    repiten al copiar las páginas a otro documento. Devuelve el reporte, con 'bytes_ahorrados'.
+    """
+    reporte = {'streams': 0, 'duplicados': 0, 'bytes_ahorrados': 0}
+    if doc.is_encrypted:
+        return reporte
+    with metricas.medir("dedupe", paginas=doc.page_count) as span:
+        try:
+            definiciones = _definiciones(doc, 1, doc.xref_length())
+            largos = {}
+            for xref in definiciones:
+                if doc.xref_is_stream(xref):
+                    tipo, largo = doc.xref_get_key(xref, "Length")
+                    largos[xref] = int(largo) if tipo == "int" else 0
+            reemplazos = _buscar_reemplazos(doc, definiciones)
+            _redirigir_referencias(doc, reemplazos)
+        except Exception as e:
+            print(f"No se pudieron deduplicar los recursos del PDF: {str(e)}")
+            return reporte
+        duplicados = [xref for xref in reemplazos if xref in largos]
+        total, ahorro = sum(largos.values()), sum(largos[xref] for xref in duplicados)
+        reporte = {'streams': len(largos), 'duplicados': len(duplicados), 'bytes_ahorrados': ahorro}
+        span.bytes_entrada = total
+        span.bytes_salida = total - ahorro
+    return reporte
+
+
+def reutilizar_recursos(doc, primer_xref):
+    """Hace que los objetos agregados a partir de `primer_xref` (p. ej. páginas insertadas
+    en un PDF existente) usen los recursos idénticos que el documento ya tenía
+
+    Un objeto se reutiliza si su definición (y en los streams, su contenido) coincide; las
+    referencias de los objetos nuevos se redirigen y la copia queda como null, así un
+    guardado incremental no la vuelve a escribir. Devuelve (streams reutilizados, bytes ahorrados).
+    """
+    if doc.is_encrypted:
+        return 0, 0
+    with metricas.medir("dedupe") as span:
+        nuevos = _definiciones(doc, primer_xref, doc.xref_length())
+        if not nuevos:
+            return 0, 0
+        existentes = _definiciones(doc, 1, primer_xref)
+        reemplazos = _buscar_reemplazos(doc, {**existentes, **nuevos}, fijos=existentes)
+        if not reemplazos:
+            return 0, 0
+
+        reutilizados = ahorro = 0
+        for xref in reemplazos:
+            if doc.xref_is_stream(xref):
+                tipo, largo = doc.xref_get_key(xref, "Length")
+                reutilizados += 1
+                ahorro += int(largo) if tipo == "int" else 0
+        _redirigir_referencias(doc, reemplazos, inicio=primer_xref)
+        span.bytes_entrada = ahorro
+    print(f"Recursos reutilizados del PDF anterior: {reutilizados} ({ahorro / 1024:.1f} KB)")
+    return reutilizados, ahorro
+
+
+def clasificar_paginas(doc):
+    """Clasifica cada página como "texto" (sin imágenes), "escaneo" (una imagen la cubre casi
+    entera) o "imagenes"
+
+    Devuelve (clases, dpi) donde dpi es {xref: DPI efectivo} de cada imagen; si una imagen
+    se muestra varias veces se toma el menor, el del uso más grande.
+    """
+    clases, dpi = [], {}
+    for page in doc:
+        area = abs(page.rect) or 1
+        imagenes = page.get_images(full=True)
+        cobertura = 0.0
+        for img in imagenes:
+            xref, ancho, alto = img[0], img[2], img[3]
+            try:
+                bbox = page.get_image_bbox(img) & page.rect
+            except Exception:
+                continue  # Imagen referenciada pero no dibujada en la página
+            if bbox.is_empty or bbox.is_infinite:
+                continue
+            # Media geométrica de ambos ejes: no cambia si la imagen está girada
+            efectivo = math.sqrt(ancho * alto / (bbox.width * bbox.height)) * 72
+            dpi[xref] = min(dpi.get(xref, efectivo), efectivo)
+            cobertura = max(cobertura, abs(bbox) / area)
+        if not imagenes:
+            clases.append("texto")
+        else:
+            clases.append("escaneo" if cobertura >= COBERTURA_ESCANEO else "imagenes")
+    return clases, dpi
+
+
+def _casi_gris(img):
+    """True si una imagen RGB casi no tiene color (p. ej. el escaneo de una hoja impresa)"""
+    muestra = img.resize((64, 64))
+    r, g, b = muestra.split()
+    diferencia = max(ImageChops.difference(r, g).getextrema()[1], ImageChops.difference(g, b).getextrema()[1])
+    return diferencia <= 16
+
+
+def _recomprimir_imagen(doc, xref, escala=1.0, calidad=85, grayscale=False, contraste=1.5,
+                        con_perdida=True):
+    """Decodifica una imagen, la reduce por `escala` y la vuelve a codificar; solo reemplaza
+    el stream si el resultado es menor. Devuelve (bytes antes, bytes después)
+
+    En escala de grises se mejora el contraste y se elige la codificación más pequeña
+    (JPEG o Flate). En color se usa JPEG con `con_perdida` y Flate sin ella, y las
+    imágenes casi grises se guardan en un solo canal.
+    """
+    antes = len(doc.xref_stream_raw(xref))
+    if doc.xref_get_key(xref, "ImageMask")[1] == "true":
+        return antes, antes  # Máscaras de 1 bit: no tienen color
+    # Las máscaras por rango de color dependen de los valores exactos de cada píxel
+    if not grayscale and doc.xref_get_key(xref, "Mask")[0] != "null":
+        return antes, antes
+
+    pix = fitz.Pixmap(doc, xref)
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    if grayscale and pix.n != 1:
+        pix = fitz.Pixmap(fitz.csGRAY, pix)
+    elif pix.n not in (1, 3):
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+
+    img_pil = Image.frombytes("L" if pix.n == 1 else "RGB", (pix.width, pix.height), pix.samples)
+    if escala < 1:
+        img_pil = img_pil.resize((max(1, round(pix.width * escala)), max(1, round(pix.height * escala))),
+                                 Image.LANCZOS)
+    if grayscale:
+        img_pil = ImageEnhance.Contrast(img_pil).enhance(contraste)
+    elif img_pil.mode == "RGB" and con_perdida and _casi_gris(img_pil):
+        img_pil = img_pil.convert("L")
+
+    candidatos = []
+    if grayscale or con_perdida:
+        jpeg = io.BytesIO()
+        img_pil.save(jpeg, format="JPEG", quality=calidad, optimize=True)
+        candidatos.append((jpeg.getvalue(), "/DCTDecode"))
+    if grayscale or not con_perdida:
+        candidatos.append((zlib.compress(img_pil.tobytes(), 9), "/FlateDecode"))
+    data, filtro = min(candidatos, key=lambda c: len(c[0]))
+
+    if len(data) >= antes:
+        return antes, antes
+
+    doc.update_stream(xref, data, compress=False)
+    doc.xref_set_key(xref, "Filter", filtro)
+    doc.xref_set_key(xref, "ColorSpace", "/DeviceGray" if img_pil.mode == "L" else "/DeviceRGB")
+    doc.xref_set_key(xref, "BitsPerComponent", "8")
+    doc.xref_set_key(xref, "DecodeParms", "null")
+    doc.xref_set_key(xref, "Decode", "null")
+    if escala < 1:
+        doc.xref_set_key(xref, "Width", str(img_pil.width))
+        doc.xref_set_key(xref, "Height", str(img_pil.height))
+    return antes, len(data)
+
+
+def optimizar_paginas(doc, presupuesto="equilibrado", target_dpi=None, grayscale=False, contraste=1.5):
+    """Aplica en sitio a cada página la estrategia que corresponde a su clase y devuelve la
+    decisión tomada en cada una
+
+    - texto: se deja intacta.
+    - imagenes: solo se reducen las imágenes que superan el DPI del presupuesto.
+    - escaneo: se recomprime con la calidad JPEG del presupuesto (y se reduce si sobra DPI).
+    Ninguna imagen se reemplaza si el resultado no es menor; si ninguna de una página se
+    pudo reducir, la página queda como "omitida". En escala de grises (documento ya
+    recoloreado) todas las imágenes se convierten; con `presupuesto=None` se usa calidad 85
+    sin reducir resolución.
+
+    Cada decisión es {'pagina', 'clase', 'accion', 'bytes_antes', 'bytes_despues'}; los
+    bytes son los de las imágenes tratadas por primera vez en esa página y las páginas que
+    repiten una imagen ya tratada reciben la misma acción.
+    """
+    if presupuesto is None:
+        dpi_max, calidad = target_dpi, 85
+    else:
+        if presupuesto not in PRESUPUESTOS:
+            raise ValueError(f"Presupuesto no soportado: {presupuesto}")
+        dpi_max = target_dpi or PRESUPUESTOS[presupuesto]["dpi"]
+        calidad = PRESUPUESTOS[presupuesto]["calidad_jpeg"]
+
+    clases, dpi = clasificar_paginas(doc)
+    procesadas = {}  # xref -> redujo o no, para las páginas que repiten la imagen
+    decisiones = []
+    for page, clase in zip(doc, clases):
+        antes = despues = 0
+        intentadas = reducidas = 0
+        for img in page.get_images(full=True):
+            xref = img[0]
+            if xref in procesadas:
+                if procesadas[xref] is not None:
+                    intentadas += 1
+                    reducidas += procesadas[xref]
+                continue
+            procesadas[xref] = None
+
+            efectivo = dpi.get(xref)
+            escala = 1.0
+            if dpi_max and efectivo and efectivo > dpi_max * HOLGURA_DPI:
+                escala = dpi_max / efectivo
+            # En color, una imagen que no sobra en DPI solo se recomprime si es un escaneo
+            if not grayscale and escala == 1.0 and clase != "escaneo":
+                continue
+            con_perdida = clase == "escaneo" or img[8] == "DCTDecode"
+
+            intentadas += 1
+            try:
+                bytes_antes, bytes_despues = _recomprimir_imagen(
+                    doc, xref, escala=escala, calidad=calidad, grayscale=grayscale, contraste=contraste,
+                    con_perdida=con_perdida
+                )
+            except Exception as e:
+                print(f"Error procesando imagen en xref {xref}: {str(e)}")
+                continue
+            procesadas[xref] = bytes_despues < bytes_antes
+            reducidas += procesadas[xref]
+            antes += bytes_antes
+            despues += bytes_despues
+
+        if not intentadas:
+            accion = "sin_cambios"
+        elif not reducidas:
+            accion = "omitida"
+        else:
+            accion = "recomprimir" if clase == "escaneo" or grayscale else "reducir_resolucion"
+        decisiones.append({'pagina': page.number + 1, 'clase': clase, 'accion': accion,
+                           'bytes_antes': antes, 'bytes_despues': despues})
+    return decisiones
+
+
+def resumen_decisiones(decisiones):
+    """Texto breve con cuántas páginas recibió cada acción y el ahorro en imágenes"""
+    acciones = {}
+    for d in decisiones:
+        acciones[d['accion']] = acciones.get(d['accion'], 0) + 1
+    ahorro = sum(d['bytes_antes'] - d['bytes_despues'] for d in decisiones)
+    detalle = ", ".join(f"{n} {accion}" for accion, n in acciones.items())
+    return f"Páginas: {detalle}; imágenes {ahorro / 1024:.1f} KB menos"
+
+
+def _gris_vectorial(src_doc, presupuesto=None, target_dpi=None):
+    """Convierte a escala de grises conservando texto y vectores: recolorea los content
+    streams y las imágenes en sitio en lugar de rasterizar cada página"""
+    dst_doc = fitz.open()
+    try:
+        dst_doc.insert_pdf(src_doc)
+        dst_doc.recolor(1)
+        decisiones = optimizar_paginas(dst_doc, presupuesto=presupuesto, target_dpi=target_dpi, grayscale=True)
+    except Exception:
+        dst_doc.close()
+        raise
+    return dst_doc, decisiones
+
+
+def _conservar_indice(src_doc, dst_doc):
+    """Copia los metadatos y el índice (marcadores) de `src_doc` al documento optimizado"""
+    try:
+        # Solo lo que tiene valor: un diccionario Info vacío agrega bytes sin aportar nada
+        metadatos = {clave: valor for clave, valor in (src_doc.metadata or {}).items()
+                     if valor and clave not in ("format", "encryption")}
+        if metadatos:
+            dst_doc.set_metadata(metadatos)
+        indice = src_doc.get_toc(simple=False)
+        if indice:
+            dst_doc.set_toc(indice)
+    except Exception as e:
+        print(f"No se pudo conservar el índice del documento: {str(e)}")
+
+
+def optimizar_documento(src_doc, target_dpi=150, grayscale=False, grayscale_mode="vector", presupuesto=None,
+                        decisiones=None, conservar_indice=True):
+    """Aplica la optimización página por página a un documento abierto y devuelve uno nuevo en memoria
+
+    En escala de grises, grayscale_mode="vector" recolorea sin rasterizar; si el documento no
+    lo admite (o PyMuPDF es anterior a 1.24, sin Document.recolor) se usa el modo "raster"
+    (página completa a 150 dpi + texto superpuesto). Con
+    `presupuesto` las imágenes del modo vectorial se tratan según PRESUPUESTOS y, si se pasa
+    una lista en `decisiones`, se le agregan las decisiones por página. El documento nuevo
+    conserva los metadatos y el índice del original salvo con `conservar_indice=False`
+    (rangos de páginas, cuyo índice se arma al reensamblarlos).
+    """
+    if grayscale and grayscale_mode == "vector" and not hasattr(src_doc, "recolor"):
+        print("Esta versión de PyMuPDF no tiene Document.recolor (requiere 1.24), usando rasterizado")
+    elif grayscale and grayscale_mode == "vector":
+        try:
+            dst_doc, tomadas = _gris_vectorial(src_doc, presupuesto=presupuesto,
+                                               target_dpi=target_dpi if presupuesto else None)
+            if decisiones is not None:
+                decisiones.extend(tomadas)
+            if conservar_indice:
+                _conservar_indice(src_doc, dst_doc)
+            return dst_doc
+        except Exception as e:
+            print(f"No se pudo convertir a grises en modo vectorial, usando rasterizado: {str(e)}")
+
+    dst_doc = fitz.open()
+    try:
+        for page in src_doc:
+            new_page = dst_doc.new_page(width=page.rect.width, height=page.rect.height)
+
+            if grayscale:
+                # Extraer texto y bloques
+                text_blocks = page.get_text("blocks")
+                images = page.get_images(full=True)
+
+                # Convertir la página completa a escala de grises (sin texto)
+                pix = page.get_pixmap(dpi=max(target_dpi, 150), colorspace=fitz.csGRAY, alpha=False)
+                new_page.insert_image(new_page.rect, pixmap=pix)
+
+                # Reinsertar texto en negro sólido para mayor claridad
+                tw = fitz.TextWriter(new_page.rect)
+                for block in text_blocks:
+                    if block[6]:  # Si el bloque contiene texto
+                        x0, y0, _, _, text, *_ = block
+                        tw.append((x0, y0), text)
+                tw.write_text(new_page, color=(0, 0, 0))  # Texto en negro puro
+            
+                # Procesar imágenes individualmente con mejora de contraste y compresión
+                for img in images:
+                    xref = img[0]
+
+                    try:
+                        # Extraer imagen del PDF
+                        base_image = src_doc.extract_image(xref)
+                        if not base_image or "image" not in base_image:
+                            print(f"Advertencia: Imagen en xref {xref} es nula o no extraíble, saltando...")
+                            continue
+
+                        # Añade esta validación adicional:
+                        if not base_image.get("width", 0) or not base_image.get("height", 0):
+                            print(f"Imagen en xref {xref} tiene dimensiones inválidas, saltando...")
+                            continue
+
+                        # Validar tamaño y formato de la imagen extraída
+                        img_bytes = base_image["image"]
+                        if len(img_bytes) < 100:  # Tamaño mínimo de imagen razonable
+                            print(f"Imagen en xref {xref} es demasiado pequeña, ignorando...")
+                            continue
+
+                        img_pil = Image.open(io.BytesIO(img_bytes))
+
+                        # Verificar si la imagen es un formato soportado
+                        if img_pil.format not in ["JPEG", "PNG", "TIFF"]:
+                            print(f"Formato de imagen en xref {xref} no soportado ({img_pil.format}), ignorando...")
+                            continue
+
+                        if img_pil.mode != "L":
+                            img_pil = img_pil.convert("L")
+                    
+                        # Mejorar contraste para mayor legibilidad
+                        enhancer = ImageEnhance.Contrast(img_pil)
+                        img_pil = enhancer.enhance(1.5)
+
+                        # Convertir a JPEG con compresión optimizada
+                        img_bytes = io.BytesIO()
+                        img_pil.save(img_bytes, format="JPEG", quality=85, optimize=True)
+                        img_bytes.seek(0)
+
+                        # Guardar en archivo temporal con un nombre único
+                        with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as tmp:
+                            tmp.write(img_bytes.read())
+                            img_rect = page.get_image_bbox(xref)
+                            new_page.insert_image(img_rect, filename=tmp.name)
+
+                        os.unlink(tmp.name)  # Eliminar archivo temporal después de usarlo
+                    except Exception as e:
+                        print(f"Error procesando imagen en xref {xref}: {str(e)}")
+            else:
+                # Si no es escala de grises, copiar la página original
+                new_page.show_pdf_page(new_page.rect, src_doc, page.number)
+    except Exception:
+        dst_doc.close()
+        raise
+    if conservar_indice:
+        _conservar_indice(src_doc, dst_doc)
+    return dst_doc
+
+
+def bytes_imagenes(doc):
+    """Bytes comprimidos de las imágenes de un documento, cada stream una vez"""
+    total = 0
+    for xref in range(1, doc.xref_length()):
+        try:
+            if doc.xref_get_key(xref, "Subtype") != ("name", "/Image"):
+                continue
+            tipo, largo = doc.xref_get_key(xref, "Length")
+        except RuntimeError:
+            continue  # Objeto libre
+        if tipo == "int":
+            total += int(largo)
+    return total
+
+
+def _reparto(doc, workers=None):
+    """(procesos, rangos como máximo) para optimizar un documento: un proceso si tiene poco
+    trabajo para repartir o si ya estamos en un worker"""
+    if _EN_WORKER:
+        return 1, 1
+    workers = workers or os.cpu_count() or 1
+    paginas = doc.page_count
+    rangos = paginas // PAGINAS_MIN_RANGO
+    if workers > 1 and rangos < 2 and paginas >= 2:
+        rangos = max(rangos, bytes_imagenes(doc) // BYTES_IMAGENES_MIN_RANGO)
+    rangos = max(1, min(rangos, paginas))
+    return min(workers, rangos), rangos
+
+
+def _optimizar_rango(input_pdf, inicio, fin, target_dpi, grayscale, grayscale_mode, presupuesto):
+    """Optimiza las páginas [inicio, fin) dentro de un proceso del pool, con su propio
+    documento abierto; devuelve (bytes del PDF parcial, decisiones por página)"""
+    doc = fitz.open(input_pdf)
+    try:
+        doc.select(list(range(inicio, fin)))
+        decisiones = []
+        if grayscale:
+            parcial = optimizar_documento(doc, target_dpi=target_dpi, grayscale=True, grayscale_mode=grayscale_mode,
+                                          presupuesto=presupuesto, decisiones=decisiones, conservar_indice=False)
+        else:
+            decisiones = optimizar_paginas(doc, presupuesto=presupuesto, target_dpi=target_dpi)
+            parcial = doc
+        try:
+            # garbage descarta los objetos de las páginas que no son de este rango
+            data = parcial.tobytes(garbage=3, deflate=True)
+        finally:
+            if parcial is not doc:
+                parcial.close()
+    finally:
+        doc.close()
+    for decision in decisiones:
+        decision['pagina'] += inicio
+    return data, decisiones
+
+
+def _optimizar_en_paralelo(input_pdf, paginas, workers, target_dpi, grayscale, grayscale_mode, presupuesto,
+                           rangos):
+    """Reparte las páginas en hasta `rangos` rangos contiguos entre `workers` procesos y
+    reensambla los resultados en orden; devuelve (documento, decisiones por página)"""
+    rangos = min(workers * 2, rangos)
+    limites = [paginas * i // rangos for i in range(rangos + 1)]
+    dst_doc = fitz.open()
+    decisiones = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=contexto_pool(),
+                                 initializer=marcar_worker) as executor:
+            futuros = [
+                executor.submit(_optimizar_rango, input_pdf, limites[i], limites[i + 1], target_dpi, grayscale,
+                                grayscale_mode, presupuesto)
+                for i in range(rangos)
+            ]
+            for futuro in futuros:
+                data, parciales = futuro.result()
+                parte = fitz.open("pdf", data)
+                try:
+                    dst_doc.insert_pdf(parte)
+                finally:
+                    parte.close()
+                decisiones.extend(parciales)
+    except Exception:
+        dst_doc.close()
+        raise
+    return dst_doc, decisiones
+
+
+def optimizar_en_procesos(src_doc, directorio, workers=None, target_dpi=150, grayscale=False,
+                          grayscale_mode="vector", presupuesto=None, decisiones=None):
+    """Optimiza un documento abierto repartiendo sus páginas por rangos entre procesos
+
+    Es el mismo reparto de optimize_pdf_size para un documento en memoria (p. ej. el
+    combinado del backend fitz): se escribe en un temporal de `directorio` (el del sistema
+    si es None; se crea solo si hay reparto) que cada proceso abre por su cuenta. Devuelve un documento nuevo con los metadatos y el índice del
+    original y los recursos repetidos entre rangos deduplicados, o None si conviene hacerlo
+    en serie (documento chico, un solo worker o ya dentro de un worker).
+    """
+    workers, rangos = _reparto(src_doc, workers)
+    if workers <= 1:
+        return None
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    fd, temporal = tempfile.mkstemp(suffix=".pdf", dir=directorio)
+    os.close(fd)
+    try:
+        src_doc.save(temporal)
+        dst_doc, tomadas = _optimizar_en_paralelo(temporal, src_doc.page_count, workers, target_dpi, grayscale,
+                                                  grayscale_mode, presupuesto, rangos)
+    finally:
+        os.remove(temporal)
+    _conservar_indice(src_doc, dst_doc)
+    if decisiones is not None:
+        decisiones.extend(tomadas)
+    deduplicar_recursos(dst_doc)
+    return dst_doc
+
+
+def optimize_pdf_size(input_pdf, output_dir=None, target_dpi=None, grayscale=False, grayscale_mode="vector",
+                      presupuesto="equilibrado", reporte=None, workers=None):
+    """Optimiza un PDF manteniendo texto vectorial y mejorando la legibilidad.
+
+    Cada página recibe la estrategia de su clase (ver `optimizar_paginas`) dentro del
+    `presupuesto` de tamaño/calidad ("calidad", "equilibrado" o "tamano"). En color, si el
+    resultado no es menor que la entrada se conserva el PDF original. Si `reporte` es una
+    lista, se le agregan las decisiones por página.
+
+    Los documentos con trabajo para al menos dos rangos (PAGINAS_MIN_RANGO páginas o
+    BYTES_IMAGENES_MIN_RANGO de imágenes cada uno) se reparten entre `workers` procesos
+    (por omisión, uno por CPU); dentro de un proceso de un pool se optimizan en serie.
+    """
+    try:
+        if not os.path.exists(input_pdf):
+            print(f"Archivo no encontrado: {input_pdf}")
+            return None
+        if presupuesto not in PRESUPUESTOS:
+            raise ValueError(f"Presupuesto no soportado: {presupuesto}")
+        target_dpi = target_dpi or PRESUPUESTOS[presupuesto]["dpi"]
+
+        output_dir = output_dir or os.path.dirname(input_pdf)
+        os.makedirs(output_dir, exist_ok=True)
+        
+        output_pdf = os.path.join(output_dir, f"opt_{os.path.basename(input_pdf)}")
+        decisiones = []
+        
+        etapa = "grayscale" if grayscale else "pdf_optimize"
+        with metricas.medir(etapa, bytes_entrada=os.path.getsize(input_pdf)) as span:
+            # Abrimos el documento original y creamos uno nuevo
+            src_doc = fitz.open(input_pdf)
+            workers, rangos = _reparto(src_doc, workers)
+            if workers > 1:
+                # Cada proceso abre el archivo por su cuenta; aquí solo se reensamblan las partes
+                metadata, toc = src_doc.metadata, src_doc.get_toc(simple=False)
+                paginas = src_doc.page_count
+                src_doc.close()
+                src_doc, decisiones = _optimizar_en_paralelo(input_pdf, paginas, workers, target_dpi, grayscale,
+                                                             grayscale_mode, presupuesto, rangos)
+                src_doc.set_metadata(metadata)
+                src_doc.set_toc(toc)
+            # Tras reensamblar, las fuentes y logotipos comunes a varios rangos quedan repetidos
+            deduplicar_recursos(src_doc)
+            if workers > 1:
+                dst_doc = src_doc
+            elif grayscale:
+                dst_doc = optimizar_documento(src_doc, target_dpi=target_dpi, grayscale=True,
+                                              grayscale_mode=grayscale_mode, presupuesto=presupuesto,
+                                              decisiones=decisiones)
+            else:
+                # En color las páginas se optimizan en sitio, sin copiarlas a otro documento
+                decisiones = optimizar_paginas(src_doc, presupuesto=presupuesto, target_dpi=target_dpi)
+                dst_doc = src_doc
+
+            dst_doc.save(output_pdf, **SAVE_OPTIONS)
+            span.paginas = dst_doc.page_count
+            if not grayscale and os.path.getsize(output_pdf) >= span.bytes_entrada:
+                shutil.copyfile(input_pdf, output_pdf)
+                print("La optimización no reduce el tamaño; se conserva el PDF original")
+            span.bytes_salida = os.path.getsize(output_pdf)
+        
+        # Cerrar documentos correctamente
+        src_doc.close()
+        if not dst_doc.is_closed:
+            dst_doc.close()
+        
+        if decisiones:
+            print(resumen_decisiones(decisiones))
+        if reporte is not None:
+            reporte.extend(decisiones)
+        print(f"PDF optimizado guardado en: {output_pdf}")
+        return output_pdf
+
+    except Exception as e:
+        print(f"Error al optimizar PDF: {str(e)}")
+    finally:
+        # Asegurar que los documentos se cierran en caso de error
+        if 'src_doc' in locals() and not src_doc.is_closed:
+            src_doc.close()
+        if 'dst_doc' in locals() and not dst_doc.is_closed:
+            dst_doc.close()
+    
+    return None
@@ -1,110 +1,839 @@
-import os
-import shutil
-from PyPDF2 import PdfMerger, PdfWriter, PdfReader
-from concurrent.futures import ThreadPoolExecutor
-from converters.xml_to_pdf import XMLtoPDFConverter
-
-class PDFProcessor:
-    def __init__(self):
-        self.temp_dir = "temp_pdfs"
-        os.makedirs(self.temp_dir, exist_ok=True)
-        self.xml_converter = XMLtoPDFConverter()
-        self.merge_chunk_size = 10
-        self.max_workers = 4
-
-    def _convert_xml_to_pdf(self, xml_path, output_pdf):
-        """Convierte XML a PDF con manejo de errores"""
-        try:
-            return self.xml_converter.convert(xml_path, output_pdf)
-        except Exception as e:
-            print(f"Error convirtiendo {xml_path}: {str(e)}")
-            return False
-
-    def _optimize_pdf(self, input_path):
-        """Optimiza un PDF individual con parámetros compatibles"""
-        try:
-            reader = PdfReader(input_path)
-            writer = PdfWriter()
-
-            for page in reader.pages:
-                # Versión compatible de compresión
-                page.compress_content_streams()  # Sin parámetro 'level'
-                writer.add_page(page)
-
-            temp_path = os.path.join(self.temp_dir, f"opt_{os.path.basename(input_path)}")
-            with open(temp_path, 'wb') as f:
-                writer.write(f)
-            
-            return temp_path
-        except Exception as e:
-            print(f"Error optimizando PDF: {str(e)}")
-            return input_path
-
-    def combinar_archivos(self, archivos, output_path, modo="pares"):
-        """Combina archivos en un solo PDF"""
-        try:
-            archivos = [f for f in archivos if os.path.exists(f)]
-            if not archivos:
-                raise ValueError("No hay archivos válidos para combinar")
-
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
-
-            merger = PdfMerger()
-            temp_files = []
-
-            try:
-                if modo == "pares":
-                    grupos = {}
-                    for archivo in archivos:
-                        base = os.path.splitext(os.path.basename(archivo))[0]
-                        if archivo.lower().endswith('.xml'):
-                            base = base[:-4]  # Quitar .xml para agrupar bien
-                        grupos.setdefault(base, []).append(archivo)
-
-                    for grupo in grupos.values():
-                        pdfs = sorted([f for f in grupo if f.lower().endswith('.pdf')])
-                        xmls = sorted([f for f in grupo if f.lower().endswith('.xml')])
-
-                        for archivo in pdfs:
-                            optimized = self._optimize_pdf(archivo)
-                            if optimized:
-                                temp_files.append(optimized)
-                                merger.append(optimized)
-
-                        for archivo in xmls:
-                            temp_pdf = os.path.join(self.temp_dir, f"temp_{os.path.basename(archivo)}.pdf")
-                            if self._convert_xml_to_pdf(archivo, temp_pdf):
-                                temp_files.append(temp_pdf)
-                                merger.append(temp_pdf)
-                else:
-                    for archivo in archivos:
-                        if archivo.lower().endswith('.xml'):
-                            temp_pdf = os.path.join(self.temp_dir, f"temp_{os.path.basename(archivo)}.pdf")
-                            if self._convert_xml_to_pdf(archivo, temp_pdf):
-                                temp_files.append(temp_pdf)
-                                merger.append(temp_pdf)
-                        else:
-                            optimized = self._optimize_pdf(archivo)
-                            if optimized:
-                                temp_files.append(optimized)
-                                merger.append(optimized)
-
-                merger.write(output_path)
-                return output_path
-
-            finally:
-                merger.close()
-                self._limpiar_temporales(temp_files)
-
-        except Exception as e:
-            print(f"Error en combinar_archivos: {str(e)}")
-            return None
-
-    def _limpiar_temporales(self, files):
-        """Limpia archivos temporales de forma segura"""
-        for f in files:
-            try:
-                if os.path.exists(f):
-                    os.remove(f)
-            except Exception as e:
-                print(f"No se pudo eliminar {f}: {str(e)}")
+import difflib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from converters.pdf_optimizer import (GRAYSCALE_MODES, PRESUPUESTOS, SAVE_OPTIONS, Image, deduplicar_recursos,
+                                      contexto_pool, en_worker, fitz, marcar_worker, optimizar_documento,
+                                      optimizar_en_procesos, optimizar_paginas, optimize_pdf_size,
+                                      reutilizar_recursos)
+from utils.cache import hash_archivo
+from utils.file_utils import (ArchivoEnMemoria, IndicePares, en_memoria, existe_archivo, nombre_archivo,
+                              tamano_archivo)
+from utils.metrics import Span, metricas, rss_actual_mb
+from utils.perezoso import ModuloPerezoso
+
+# Solo lo usa el backend "pypdf2"; fitz y Pillow también se cargan en el primer uso
+PyPDF2 = ModuloPerezoso("PyPDF2")
+
+BACKENDS = ("fitz", "pypdf2")
+
+# Formato del manifiesto de combinar_incremental
+VERSION_MANIFIESTO = 2
+
+# Un PDF rehecho por partes se reescribe completo tras estas ediciones incrementales (o si
+# cambia más de la mitad de las entradas), para descartar lo que quedó sin uso
+MAX_EDICIONES = 10
+
+# Memoria estimada por byte de entrada de un bloque: el bloque combinado, la copia de la
+# conversión a grises y el origen abierto
+FACTOR_MEMORIA_BLOQUE = 3
+
+# XML mínimo con que precalentar() ejercita el convertidor (fpdf y métricas de la fuente)
+_XML_PRECALENTAR = (b'<?xml version="1.0" encoding="UTF-8"?>'
+                    b'<Comprobante Version="4.0"><Emisor Rfc="XAXX010101000"/></Comprobante>')
+
+_convertidor = None
+_convertidor_lock = threading.Lock()
+_precalentados = set()
+# Procesadores reutilizados por los workers del pool, por (backend, grayscale_mode, presupuesto)
+_procesadores_worker = {}
+# Pool de procesos de los lotes en modo pares, compartido por todos los trabajos del proceso
+_pool_pares = None
+_pool_pares_lock = threading.Lock()
+
+
+def _convertidor_compartido():
+    """XMLtoPDFConverter del proceso: no guarda estado entre conversiones, así que todos
+    los PDFProcessor lo comparten; converters.xml_to_pdf (y fpdf) se importan aquí"""
+    global _convertidor
+    if _convertidor is None:
+        with _convertidor_lock:
+            if _convertidor is None:
+                from converters.xml_to_pdf import XMLtoPDFConverter
+                _convertidor = XMLtoPDFConverter()
+    return _convertidor
+
+
+def precalentar(backend="fitz"):
+    """Importa los backends e inicializa el convertidor de XML en el proceso actual
+
+    Pensado para llamarse antes de crear los workers de un servidor con pre-fork (como
+    gunicorn --preload): los hijos heredan los módulos ya cargados y comparten esas páginas
+    de memoria en lugar de importarlos cada uno. Los workers de nuestros pools salen del
+    servidor de procesos, que precarga los suyos (ver contexto_pool). La conversión de
+    prueba no se registra en las métricas. Devuelve los segundos que tomó (0 si el proceso
+    ya estaba precalentado para `backend`).
+    """
+    if backend in _precalentados:
+        return 0.0
+    inicio = time.perf_counter()
+    with metricas.traza(capturar=True):
+        if backend == "pypdf2":
+            PyPDF2.cargar()
+        Image.cargar()
+        doc = fitz.open()
+        try:
+            doc.new_page(width=10, height=10)
+            doc.tobytes()
+        finally:
+            doc.close()
+        _convertidor_compartido().convert_to_bytes(ArchivoEnMemoria("precalentar.xml", _XML_PRECALENTAR))
+    _precalentados.add(backend)
+    return time.perf_counter() - inicio
+
+
+def _enviar_a_pool_pares(workers, funcion, *args):
+    """Envía `funcion(*args)` al pool compartido de modo pares y devuelve el future
+
+    Los trabajos simultáneos reparten los mismos procesos en lugar de abrir un pool cada
+    uno; el pool se crea con los `workers` de la primera llamada. Si un worker murió y el
+    pool quedó roto, se descarta y se crea otro.
+    """
+    global _pool_pares
+    for intento in range(2):
+        with _pool_pares_lock:
+            if _pool_pares is None:
+                _pool_pares = ProcessPoolExecutor(max_workers=workers, mp_context=contexto_pool(),
+                                                  initializer=marcar_worker)
+            pool = _pool_pares
+        try:
+            return pool.submit(funcion, *args)
+        except BrokenProcessPool:
+            with _pool_pares_lock:
+                if _pool_pares is pool:
+                    _pool_pares = None
+            if intento:
+                raise
+
+
+def _procesador_para_grupo(temp_dir, backend, grayscale_mode, cache, presupuesto=None):
+    """PDFProcessor para un grupo; dentro de un worker del pool se reutiliza uno por proceso"""
+    if not en_worker():
+        return PDFProcessor(temp_dir=temp_dir, max_workers=1, backend=backend,
+                            grayscale_mode=grayscale_mode, cache=cache, presupuesto=presupuesto)
+    processor = _procesadores_worker.get((backend, grayscale_mode, presupuesto))
+    if processor is None:
+        processor = PDFProcessor(max_workers=1, backend=backend, grayscale_mode=grayscale_mode,
+                                 presupuesto=presupuesto)
+        _procesadores_worker[(backend, grayscale_mode, presupuesto)] = processor
+    # Un worker procesa un grupo a la vez: solo cambian el directorio temporal y la caché
+    processor._temp_dir = temp_dir
+    processor.cache = cache
+    return processor
+
+
+def _abrir_pdf(archivo):
+    """Abre con fitz una ruta o un ArchivoEnMemoria (sin pasar por disco)"""
+    if en_memoria(archivo):
+        return fitz.open("pdf", archivo.data)
+    return fitz.open(archivo)
+
+
+def _hash_entrada(archivo):
+    return archivo.sha256() if en_memoria(archivo) else hash_archivo(archivo)
+
+
+def _hash_segmento(archivo):
+    """Huella del tramo de una entrada en combinar_incremental
+
+    El PDF de un XML lleva su nombre en el título, así que (como en _clave_xml) el nombre
+    forma parte de la huella: un XML renombrado con el mismo contenido se vuelve a generar.
+    """
+    huella = _hash_entrada(archivo)
+    nombre = nombre_archivo(archivo)
+    if not nombre.lower().endswith('.xml'):
+        return huella
+    return hashlib.sha256(f"{huella}:{nombre}".encode()).hexdigest()
+
+
+def _procesar_grupo(base_name, archivos, output_dir, grayscale, backend, grayscale_mode, cache=None,
+                    presupuesto=None):
+    """Combina y optimiza un grupo de archivos; se ejecuta dentro de un proceso del pool"""
+    # Directorio temporal propio para que los grupos no compartan intermedios
+    temp_dir = os.path.join(output_dir, f".tmp_{base_name}")
+    resultado = {'nombre': base_name, 'pdf': None, 'error': None}
+    inicio = time.perf_counter()
+    if cache is not None:
+        antes = (cache.hits, cache.misses, cache.evictions)
+    # Los spans se devuelven con el resultado y se registran en el proceso principal
+    with metricas.traza(capturar=True) as traza:
+        try:
+            processor = _procesador_para_grupo(temp_dir, backend, grayscale_mode, cache, presupuesto)
+            output_path = os.path.join(output_dir, f"opt_{base_name}.pdf")
+            processed_pdf = processor.combinar_y_optimizar(archivos, output_path, modo="pares", grayscale=grayscale)
+            if processed_pdf:
+                resultado['pdf'] = processed_pdf
+                resultado['paginas'] = processor.reporte_paginas
+            else:
+                resultado['error'] = "No se pudo crear el PDF combinado"
+        except Exception as e:
+            resultado['error'] = str(e)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    resultado['segundos'] = time.perf_counter() - inicio
+    resultado['spans'] = [span.to_dict() for span in traza.spans]
+
+    if cache is not None:
+        # Los contadores del worker se devuelven para acumularlos en el proceso principal
+        resultado['cache'] = (cache.hits - antes[0], cache.misses - antes[1], cache.evictions - antes[2])
+    return resultado
+
+
+class PDFProcessor:
+    """Combina y optimiza PDF y XML; las entradas pueden ser rutas o ArchivoEnMemoria
+
+    `temp_dir` solo se crea si hace falta escribir intermedios (backend "pypdf2"); si no
+    se indica se usa un directorio del sistema, nunca uno relativo al directorio actual.
+
+    Con `memoria_max_mb` (backend "fitz") la combinación se hace por bloques de hasta
+    `merge_chunk_size` archivos, dimensionados para no superar ese límite; sin él todo
+    el documento se combina en memoria en una sola pasada.
+
+    `presupuesto` ("calidad", "equilibrado" o "tamano", ver PRESUPUESTOS) aplica a cada
+    página la política de imágenes del presupuesto, con su DPI máximo, también en color;
+    sin él solo se deduplican recursos (y en grises se recomprime sin reducir resolución).
+    """
+
+    def __init__(self, temp_dir=None, max_workers=None, backend="fitz", grayscale_mode="vector", cache=None,
+                 memoria_max_mb=None, merge_chunk_size=100, presupuesto=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend no soportado: {backend}")
+        if grayscale_mode not in GRAYSCALE_MODES:
+            raise ValueError(f"Modo de escala de grises no soportado: {grayscale_mode}")
+        if presupuesto is not None and presupuesto not in PRESUPUESTOS:
+            raise ValueError(f"Presupuesto no soportado: {presupuesto}")
+        self.backend = backend
+        self.grayscale_mode = grayscale_mode
+        self.presupuesto = presupuesto
+        self.cache = cache  # utils.cache.ResultCache opcional
+        self._temp_dir = temp_dir
+        self._xml_converter = None
+        self.memoria_max_mb = memoria_max_mb
+        self.merge_chunk_size = merge_chunk_size
+        # Reportes de deduplicación de recursos y de memoria de la última combinación (backend fitz)
+        self.reporte_dedup = None
+        self.reporte_memoria = None
+        # Decisiones por página de la última combinación (ver optimizar_paginas): 'pagina' es
+        # el número en el PDF generado. None si no se aplicó la política (sin presupuesto en
+        # color, o resultado tomado de la caché)
+        self.reporte_paginas = None
+        self.max_workers = max_workers or os.cpu_count() or 4
+
+    @property
+    def temp_dir(self):
+        """Directorio para intermedios, creado en el primer uso"""
+        if self._temp_dir is None:
+            self._temp_dir = tempfile.mkdtemp(prefix="temp_pdfs_")
+        else:
+            os.makedirs(self._temp_dir, exist_ok=True)
+        return self._temp_dir
+
+    @property
+    def xml_converter(self):
+        """Convertidor de XML; salvo que se asigne otro, el compartido del proceso"""
+        return self._xml_converter or _convertidor_compartido()
+
+    @xml_converter.setter
+    def xml_converter(self, valor):
+        self._xml_converter = valor
+
+    def _clave_xml(self, xml_path):
+        # El título del PDF lleva el nombre del XML, por eso forma parte de la clave
+        return self.cache.clave([xml_path], tipo="xml", nombre=nombre_archivo(xml_path),
+                                **self.xml_converter.parametros())
+
+    def _convert_xml_to_pdf(self, xml_path, output_pdf):
+        """Convierte XML a PDF con manejo de errores"""
+        try:
+            if self.cache is None:
+                return self.xml_converter.convert(xml_path, output_pdf)
+
+            clave = self._clave_xml(xml_path)
+            if self.cache.copiar(clave, output_pdf):
+                return True
+            if not self.xml_converter.convert(xml_path, output_pdf):
+                return False
+            self.cache.guardar_archivo(clave, output_pdf)
+            return True
+        except Exception as e:
+            print(f"Error convirtiendo {nombre_archivo(xml_path)}: {str(e)}")
+            return False
+
+    def _xml_a_bytes(self, xml_path):
+        """Renderiza un XML a PDF en memoria, reutilizando la caché si está disponible"""
+        if self.cache is None:
+            return self.xml_converter.convert_to_bytes(xml_path)
+
+        clave = self._clave_xml(xml_path)
+        data = self.cache.leer(clave)
+        if data is None:
+            data = self.xml_converter.convert_to_bytes(xml_path)
+            if data:
+                self.cache.guardar_bytes(clave, data)
+        return data
+
+    def _optimize_pdf(self, input_path):
+        """Optimiza un PDF individual con parámetros compatibles"""
+        try:
+            reader = PyPDF2.PdfReader(input_path.abrir() if en_memoria(input_path) else input_path)
+            writer = PyPDF2.PdfWriter()
+
+            for page in reader.pages:
+                # Versión compatible de compresión
+                page.compress_content_streams()  # Sin parámetro 'level'
+                writer.add_page(page)
+
+            temp_path = os.path.join(self.temp_dir, f"opt_{nombre_archivo(input_path)}")
+            with open(temp_path, 'wb') as f:
+                writer.write(f)
+            
+            return temp_path
+        except Exception as e:
+            print(f"Error optimizando PDF: {str(e)}")
+            return input_path.abrir() if en_memoria(input_path) else input_path
+
+    def _ordenar_archivos(self, archivos, modo):
+        """Devuelve los archivos en el orden en que se combinan"""
+        if modo != "pares":
+            return list(archivos)
+        return IndicePares(archivos).ordenados()
+
+    def combinar_archivos(self, archivos, output_path, modo="pares"):
+        """Combina archivos en un solo PDF"""
+        try:
+            archivos = [f for f in archivos if existe_archivo(f)]
+            if not archivos:
+                raise ValueError("No hay archivos válidos para combinar")
+
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+            merger = PyPDF2.PdfMerger()
+            temp_files = []
+
+            try:
+                for archivo in self._ordenar_archivos(archivos, modo):
+                    if nombre_archivo(archivo).lower().endswith('.xml'):
+                        temp_pdf = os.path.join(self.temp_dir, f"temp_{nombre_archivo(archivo)}.pdf")
+                        if self._convert_xml_to_pdf(archivo, temp_pdf):
+                            temp_files.append(temp_pdf)
+                            merger.append(temp_pdf)
+                    else:
+                        optimized = self._optimize_pdf(archivo)
+                        if optimized:
+                            # Si no se pudo optimizar se usa la entrada original, que no es temporal
+                            if isinstance(optimized, str) and optimized != archivo:
+                                temp_files.append(optimized)
+                            merger.append(optimized)
+
+                merger.write(output_path)
+                return output_path
+
+            finally:
+                merger.close()
+                self._limpiar_temporales(temp_files)
+
+        except Exception as e:
+            print(f"Error en combinar_archivos: {str(e)}")
+            return None
+
+    def _insertar_archivos(self, destino, archivos, progreso=None, paginas=None):
+        """Inserta las páginas de cada archivo en `destino` y cierra cada origen en cuanto se
+        copian; devuelve el span "merge" (solo la inserción) sin registrar
+
+        Si `paginas` es una lista se le agrega cuántas páginas aportó cada archivo.
+        """
+        # La conversión de los XML tiene sus propios spans; "merge" mide solo la inserción
+        combinar = Span("merge")
+        for archivo in archivos:
+            inicio = time.perf_counter()
+            if nombre_archivo(archivo).lower().endswith('.xml'):
+                data = self._xml_a_bytes(archivo)
+                if not data:
+                    if paginas is not None:
+                        paginas.append(0)
+                    if progreso:
+                        progreso(archivo, time.perf_counter() - inicio, "No se pudo convertir el XML")
+                    continue
+                combinar.bytes_entrada += len(data)
+                inicio_insercion = time.perf_counter()
+                src = fitz.open("pdf", data)
+            else:
+                combinar.bytes_entrada += tamano_archivo(archivo)
+                inicio_insercion = time.perf_counter()
+                src = _abrir_pdf(archivo)
+            try:
+                if paginas is not None:
+                    paginas.append(src.page_count)
+                destino.insert_pdf(src)
+            finally:
+                src.close()
+            combinar.segundos += time.perf_counter() - inicio_insercion
+            if progreso:
+                progreso(archivo, time.perf_counter() - inicio, None)
+        combinar.paginas = destino.page_count
+        return combinar
+
+    def _preparar_documento(self, doc, grayscale, target_dpi, decisiones=None):
+        """Deduplica recursos y, si se pide, convierte a grises y aplica el presupuesto;
+        devuelve (documento, reporte de deduplicación). Si el documento cambia, el original
+        queda cerrado. Las decisiones por página se agregan a la lista `decisiones`"""
+        # Facturas del mismo emisor repiten logotipo y fuentes: se dejan una sola vez
+        reporte = deduplicar_recursos(doc)
+        if not grayscale and self.presupuesto is None:
+            return doc, reporte
+
+        # Con presupuesto manda su DPI máximo
+        if self.presupuesto is not None:
+            target_dpi = PRESUPUESTOS[self.presupuesto]["dpi"]
+        with metricas.medir("grayscale" if grayscale else "pdf_optimize", paginas=doc.page_count):
+            # Los documentos grandes se reparten por rangos de páginas entre max_workers procesos
+            optimizado = optimizar_en_procesos(doc, self._temp_dir, workers=self.max_workers, target_dpi=target_dpi,
+                                               grayscale=grayscale, grayscale_mode=self.grayscale_mode,
+                                               presupuesto=self.presupuesto, decisiones=decisiones)
+            if optimizado is None and grayscale:
+                optimizado = optimizar_documento(doc, target_dpi=target_dpi, grayscale=True,
+                                                 grayscale_mode=self.grayscale_mode, presupuesto=self.presupuesto,
+                                                 decisiones=decisiones)
+            elif optimizado is None:
+                # En color las páginas se optimizan en sitio
+                tomadas = optimizar_paginas(doc, presupuesto=self.presupuesto, target_dpi=target_dpi)
+                if decisiones is not None:
+                    decisiones.extend(tomadas)
+                return doc, reporte
+        doc.close()
+        return optimizado, reporte
+
+    def _combinar_fitz(self, archivos, output_path, modo, grayscale, target_dpi, progreso=None, paginas=None):
+        """Combina y optimiza en una sola pasada en memoria: cada entrada se analiza una vez
+        y el resultado se escribe una sola vez, sin archivos intermedios"""
+        archivos = self._ordenar_archivos(archivos, modo)
+        if self.memoria_max_mb:
+            return self._combinar_fitz_por_bloques(archivos, output_path, grayscale, target_dpi, progreso, paginas)
+
+        rss_inicial = rss_actual_mb()
+        merged = fitz.open()
+        try:
+            metricas.registrar(self._insertar_archivos(merged, archivos, progreso, paginas))
+            decisiones = []
+            merged, self.reporte_dedup = self._preparar_documento(merged, grayscale, target_dpi, decisiones)
+            self.reporte_paginas = decisiones or None
+
+            with metricas.medir("pdf_optimize", paginas=merged.page_count) as span:
+                merged.save(output_path, **SAVE_OPTIONS)
+                span.bytes_salida = os.path.getsize(output_path)
+            self.reporte_memoria = self._reporte_memoria(1, None, rss_inicial, rss_actual_mb())
+            return output_path
+        finally:
+            merged.close()
+
+    @staticmethod
+    def _reporte_memoria(bloques, memoria_max_mb, rss_inicial, rss_pico):
+        """'rss_pico_mb' es el mayor RSS medido durante la combinación y 'rss_extra_mb' lo que
+        creció sobre el de antes de empezar, comparable con `memoria_max_mb`; None si la
+        plataforma no expone el RSS"""
+        extra = None
+        if rss_inicial is not None and rss_pico is not None:
+            extra = round(max(0.0, rss_pico - rss_inicial), 1)
+        return {'bloques': bloques, 'memoria_max_mb': memoria_max_mb,
+                'rss_pico_mb': round(rss_pico, 1) if rss_pico is not None else None, 'rss_extra_mb': extra}
+
+    def _bloques(self, archivos):
+        """Reparte las entradas en bloques consecutivos de hasta `merge_chunk_size` archivos
+        cuyo tamaño no supere la parte del límite de memoria asignada a cada bloque"""
+        presupuesto = self.memoria_max_mb * 1024 * 1024 // FACTOR_MEMORIA_BLOQUE
+        bloque, tamano = [], 0
+        for archivo in archivos:
+            tamano_entrada = tamano_archivo(archivo)
+            if bloque and (len(bloque) >= self.merge_chunk_size or tamano + tamano_entrada > presupuesto):
+                yield bloque
+                bloque, tamano = [], 0
+            bloque.append(archivo)
+            tamano += tamano_entrada
+        if bloque:
+            yield bloque
+
+    def _combinar_fitz_por_bloques(self, archivos, output_path, grayscale, target_dpi, progreso=None, paginas=None):
+        """Combina con memoria acotada: cada bloque se combina, deduplica y convierte por
+        separado y se agrega al final del PDF de salida con un guardado incremental
+
+        Después de cada bloque se cierran el bloque y la salida, así solo se mantienen en
+        memoria las páginas del bloque en curso. Los recursos repetidos entre bloques
+        distintos no se deduplican.
+        """
+        reporte = {'streams': 0, 'duplicados': 0, 'bytes_ahorrados': 0}
+        decisiones = []
+        bloques = total = 0
+        rss_inicial = rss_pico = rss_actual_mb()
+        try:
+            for grupo in self._bloques(archivos):
+                bloque = fitz.open()
+                try:
+                    metricas.registrar(self._insertar_archivos(bloque, grupo, progreso, paginas))
+                    if not bloque.page_count:
+                        continue
+                    tomadas = []
+                    bloque, dedup = self._preparar_documento(bloque, grayscale, target_dpi, tomadas)
+                    for clave in reporte:
+                        reporte[clave] += dedup[clave]
+                    # Las páginas de cada bloque se numeran desde 1: se llevan a su número en la salida
+                    decisiones.extend(dict(d, pagina=d['pagina'] + total) for d in tomadas)
+
+                    with metricas.medir("pdf_optimize", paginas=bloque.page_count) as span:
+                        anterior = os.path.getsize(output_path) if total else 0
+                        if not total:
+                            bloque.save(output_path, **SAVE_OPTIONS)
+                        else:
+                            salida = fitz.open(output_path)
+                            try:
+                                salida.insert_pdf(bloque)
+                                salida.save(output_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP,
+                                            deflate=True)
+                            finally:
+                                salida.close()
+                        span.bytes_salida = os.path.getsize(output_path) - anterior
+                    total += bloque.page_count
+                    bloques += 1
+                    # Con el bloque aún abierto: es el momento de más memoria de cada vuelta
+                    rss = rss_actual_mb()
+                    if rss is not None:
+                        rss_pico = max(rss_pico, rss)
+                finally:
+                    bloque.close()
+                    # La caché global de MuPDF (imágenes y fuentes decodificadas) crece con cada bloque
+                    fitz.TOOLS.store_shrink(100)
+            if not total:
+                raise ValueError("Ningún archivo produjo páginas")
+        except Exception:
+            # Un PDF a medias no debe quedar como resultado
+            self._limpiar_temporales([output_path])
+            raise
+
+        self.reporte_dedup = reporte
+        self.reporte_paginas = decisiones or None
+        self.reporte_memoria = self._reporte_memoria(bloques, self.memoria_max_mb, rss_inicial, rss_pico)
+        extra = self.reporte_memoria['rss_extra_mb']
+        print(f"Combinación por bloques: {bloques} bloques, {total} páginas"
+              + (f", RSS +{extra:.0f} MB (límite {self.memoria_max_mb} MB)" if extra is not None else ""))
+        return output_path
+
+    def combinar_y_optimizar(self, archivos, output_path, modo="pares", grayscale=False, target_dpi=150,
+                             progreso=None):
+        """Combina los archivos y optimiza el resultado; devuelve la ruta final o None
+
+        Con backend "fitz" todo ocurre en una pasada en memoria. Con "pypdf2" se usa la
+        cadena anterior (combinar_archivos + optimize_pdf_size). `progreso(archivo, segundos,
+        error)` se llama por cada archivo de entrada procesado.
+        """
+        try:
+            archivos = [f for f in archivos if existe_archivo(f)]
+            if not archivos:
+                raise ValueError("No hay archivos válidos para combinar")
+
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+            clave = None
+            if self.cache is not None:
+                ordenados = self._ordenar_archivos(archivos, modo)
+                clave = self.cache.clave(
+                    ordenados, tipo="resultado", nombres=[nombre_archivo(f) for f in ordenados],
+                    modo=modo, grayscale=grayscale, grayscale_mode=self.grayscale_mode, presupuesto=self.presupuesto,
+                    target_dpi=target_dpi, backend=self.backend, xml=self.xml_converter.parametros(),
+                    memoria_max_mb=self.memoria_max_mb, merge_chunk_size=self.merge_chunk_size
+                )
+                if self.cache.copiar(clave, output_path):
+                    self._notificar_todos(progreso, archivos)
+                    return output_path
+
+            self.reporte_paginas = None
+            resultado = self._combinar_y_optimizar(archivos, output_path, modo, grayscale, target_dpi, progreso)
+            if resultado and clave is not None:
+                self.cache.guardar_archivo(clave, resultado)
+            return resultado
+        except Exception as e:
+            print(f"Error en combinar_y_optimizar: {str(e)}")
+            return None
+
+    def _parametros_manifiesto(self, grayscale, target_dpi):
+        # Ida y vuelta por JSON para compararlos tal como quedan guardados en el manifiesto
+        return json.loads(json.dumps({
+            'grayscale': grayscale, 'grayscale_mode': self.grayscale_mode, 'target_dpi': target_dpi,
+            'presupuesto': self.presupuesto,
+            'xml': self.xml_converter.parametros(),
+        }, default=str))
+
+    def manifiesto_al_dia(self, archivos, manifiesto, grayscale=False, target_dpi=150):
+        """True si `manifiesto` (de combinar_incremental) corresponde exactamente a `archivos`
+        en ese orden, con el mismo contenido y los mismos parámetros: el PDF no cambiaría"""
+        try:
+            if manifiesto.get('version') != VERSION_MANIFIESTO:
+                return False
+            if manifiesto.get('parametros') != self._parametros_manifiesto(grayscale, target_dpi):
+                return False
+            archivos = [f for f in archivos if existe_archivo(f)]
+            segmentos = manifiesto.get('segmentos') or []
+            return ([(s['nombre'], s['hash']) for s in segmentos]
+                    == [(nombre_archivo(f), _hash_segmento(f)) for f in archivos])
+        except (AttributeError, KeyError, TypeError, OSError):
+            return False
+
+    def combinar_incremental(self, archivos, output_path, grayscale=False, target_dpi=150, anterior=None,
+                             progreso=None):
+        """Combina en modo completo reutilizando un resultado anterior del mismo lote
+
+        `anterior` es (ruta del PDF, manifiesto) de una combinación previa. Las entradas
+        cuya huella (contenido y, en los XML, nombre) sigue igual conservan sus páginas; solo se procesan las nuevas o
+        modificadas, que reemplazan su tramo con un guardado incremental. Sin `anterior`,
+        con otros parámetros o con demasiados cambios se combina todo.
+
+        Devuelve (ruta, manifiesto) o (None, None). El manifiesto registra, por entrada,
+        'nombre', 'hash', 'inicio' (primera página, desde 0) y 'paginas'.
+        """
+        try:
+            if self.backend != "fitz":
+                raise ValueError("La combinación incremental requiere el backend fitz")
+            archivos = [f for f in archivos if existe_archivo(f)]
+            if not archivos:
+                raise ValueError("No hay archivos válidos para combinar")
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+            hashes = [_hash_segmento(f) for f in archivos]
+            parametros = self._parametros_manifiesto(grayscale, target_dpi)
+            previos, ediciones = None, 0
+            if anterior is not None:
+                pdf_anterior, manifiesto = anterior
+                if (manifiesto.get('version') == VERSION_MANIFIESTO and manifiesto.get('parametros') == parametros
+                        and os.path.isfile(pdf_anterior)):
+                    previos, ediciones = manifiesto['segmentos'], manifiesto.get('ediciones', 0) + 1
+
+            paginas = None
+            self.reporte_paginas = None
+            if previos is not None and ediciones <= MAX_EDICIONES:
+                paginas = self._empalmar(archivos, hashes, previos, pdf_anterior, output_path, grayscale,
+                                         target_dpi, progreso)
+            if paginas is None:
+                ediciones = 0
+                paginas = []
+                if not self._combinar_fitz(archivos, output_path, "completo", grayscale, target_dpi, progreso,
+                                           paginas):
+                    return None, None
+
+            segmentos, inicio = [], 0
+            for archivo, huella, n in zip(archivos, hashes, paginas):
+                segmentos.append({'nombre': nombre_archivo(archivo), 'hash': huella, 'inicio': inicio, 'paginas': n})
+                inicio += n
+            return output_path, {'version': VERSION_MANIFIESTO, 'parametros': parametros, 'ediciones': ediciones,
+                                 'segmentos': segmentos}
+        except Exception as e:
+            print(f"Error en combinar_incremental: {str(e)}")
+            return None, None
+
+    def _empalmar(self, archivos, hashes, previos, pdf_anterior, output_path, grayscale, target_dpi, progreso=None):
+        """Copia el PDF anterior y reemplaza solo los tramos de las entradas que cambiaron
+
+        Devuelve las páginas por entrada, o None si conviene combinar todo de nuevo.
+        """
+        matcher = difflib.SequenceMatcher(None, [s['hash'] for s in previos], hashes, autojunk=False)
+        operaciones = matcher.get_opcodes()
+        cambiadas = sum(j2 - j1 for tag, _, _, j1, j2 in operaciones if tag != 'equal')
+        if cambiadas * 2 > len(archivos):
+            return None
+
+        paginas = [0] * len(archivos)
+        for tag, i1, i2, j1, j2 in operaciones:
+            if tag == 'equal':
+                for k in range(j2 - j1):
+                    paginas[j1 + k] = previos[i1 + k]['paginas']
+                    if progreso:
+                        progreso(archivos[j1 + k], None, None)
+
+        shutil.copyfile(pdf_anterior, output_path)
+        doc = fitz.open(output_path)
+        primer_xref = doc.xref_length()
+        decisiones = {}  # j1 -> decisiones del tramo (páginas numeradas desde 1 dentro del tramo)
+        try:
+            # De atrás hacia adelante, así los tramos anteriores conservan su posición
+            for tag, i1, i2, j1, j2 in reversed(operaciones):
+                if tag == 'equal':
+                    continue
+                inicio = previos[i1]['inicio'] if i1 < len(previos) else doc.page_count
+                fin = previos[i2 - 1]['inicio'] + previos[i2 - 1]['paginas'] if i2 > i1 else inicio
+                if fin > inicio:
+                    doc.delete_pages(inicio, fin - 1)
+                if j2 > j1:
+                    tramo = fitz.open()
+                    try:
+                        nuevas = []
+                        metricas.registrar(self._insertar_archivos(tramo, archivos[j1:j2], progreso, nuevas))
+                        paginas[j1:j2] = nuevas
+                        if tramo.page_count:
+                            decisiones[j1] = []
+                            tramo, _ = self._preparar_documento(tramo, grayscale, target_dpi, decisiones[j1])
+                            doc.insert_pdf(tramo, start_at=inicio)
+                    finally:
+                        tramo.close()
+            if not doc.page_count:
+                raise ValueError("Ningún archivo produjo páginas")
+            # Los tramos nuevos traen su copia de fuentes y logotipos que el PDF ya tiene
+            reutilizar_recursos(doc, primer_xref)
+
+            with metricas.medir("pdf_optimize", paginas=doc.page_count) as span:
+                anterior = os.path.getsize(output_path)
+                doc.save(output_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP, deflate=True)
+                span.bytes_salida = os.path.getsize(output_path) - anterior
+        except Exception:
+            doc.close()
+            self._limpiar_temporales([output_path])
+            raise
+        doc.close()
+        # Solo las páginas reprocesadas, con su número en el PDF final
+        self.reporte_paginas = [dict(d, pagina=d['pagina'] + sum(paginas[:j1]))
+                                for j1 in sorted(decisiones) for d in decisiones[j1]] or None
+        print(f"Combinación incremental: {cambiadas} de {len(archivos)} entradas procesadas")
+        return paginas
+
+    def _notificar_todos(self, progreso, archivos):
+        """Reporta todos los archivos como terminados cuando no hay progreso por archivo"""
+        if progreso:
+            for archivo in archivos:
+                progreso(archivo, None, None)
+
+    def _combinar_y_optimizar(self, archivos, output_path, modo, grayscale, target_dpi, progreso=None):
+        """Genera el resultado con el backend configurado (sin caché)"""
+        if self.backend == "fitz":
+            return self._combinar_fitz(archivos, output_path, modo, grayscale, target_dpi, progreso)
+
+        combined_path = os.path.join(self.temp_dir, f"comb_{os.path.basename(output_path)}")
+        # En esta cadena "merge" incluye la conversión de los XML (también medida en sus spans)
+        with metricas.medir("merge", bytes_entrada=sum(tamano_archivo(f) for f in archivos)) as span:
+            combined = self.combinar_archivos(archivos, combined_path, modo=modo)
+            if combined:
+                span.bytes_salida = os.path.getsize(combined)
+        if not combined:
+            return None
+        try:
+            decisiones = []
+            optimized = optimize_pdf_size(combined, output_dir=self.temp_dir, target_dpi=target_dpi,
+                                          grayscale=grayscale, grayscale_mode=self.grayscale_mode,
+                                          presupuesto=self.presupuesto or "equilibrado", reporte=decisiones,
+                                          workers=self.max_workers)
+            if not optimized:
+                return None
+            self.reporte_paginas = decisiones or None
+            shutil.move(optimized, output_path)
+            self._notificar_todos(progreso, archivos)
+            return output_path
+        finally:
+            self._limpiar_temporales([combined])
+
+    def _limpiar_temporales(self, files):
+        """Limpia archivos temporales de forma segura"""
+        for f in files:
+            try:
+                if os.path.exists(f):
+                    os.remove(f)
+            except Exception as e:
+                print(f"No se pudo eliminar {f}: {str(e)}")
+
+    def procesar_pares(self, grupos, output_dir, grayscale=False, al_terminar=None):
+        """Procesa cada grupo PDF+XML en paralelo y devuelve los resultados en el orden de entrada
+
+        `grupos` es un dict {base_name: [archivos]} o un iterable de pares (base_name, archivos)
+        que puede ir entregando los grupos a medida que están disponibles (p. ej. mientras se
+        suben): cada uno se envía al pool en cuanto llega. Cada resultado es un dict con
+        'nombre', 'pdf' (ruta optimizada o None), 'error', 'segundos' y, si se generó el PDF,
+        'paginas' (ver reporte_paginas). Un fallo en un grupo no afecta a los demás. `al_terminar(resultado)` se llama en cuanto termina cada grupo.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        if not isinstance(grupos, dict):
+            return self._procesar_pares_en_flujo(grupos, output_dir, grayscale, al_terminar)
+        grupos = list(grupos.items())
+        workers = min(self.max_workers, len(grupos))
+        resultados = [None] * len(grupos)
+
+        def _registrar(i, resultado):
+            if self.cache is not None and 'cache' in resultado:
+                self.cache.sumar_contadores(*resultado.pop('cache'))
+            metricas.incorporar(resultado.pop('spans', ()))
+            resultados[i] = resultado
+            if al_terminar:
+                al_terminar(resultado)
+
+        if workers <= 1:
+            for i, (base, archivos) in enumerate(grupos):
+                _registrar(i, _procesar_grupo(base, archivos, output_dir, grayscale,
+                                              self.backend, self.grayscale_mode, self.cache, self.presupuesto))
+            return resultados
+
+        # Cada grupo se optimiza en serie dentro de su proceso (sin pools anidados)
+        futures = {
+            _enviar_a_pool_pares(self.max_workers, _procesar_grupo, base, archivos, output_dir, grayscale,
+                                 self.backend, self.grayscale_mode, self.cache, self.presupuesto): i
+            for i, (base, archivos) in enumerate(grupos)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                resultado = future.result()
+            except Exception as e:
+                # El proceso del pool falló (p. ej. un error nativo); se registra en el grupo
+                resultado = {'nombre': grupos[i][0], 'pdf': None, 'error': str(e), 'segundos': None}
+            _registrar(i, resultado)
+        return resultados
+
+    def _procesar_pares_en_flujo(self, grupos, output_dir, grayscale, al_terminar):
+        """procesar_pares para un iterable de grupos que llegan de a uno: el iterable puede
+        bloquear mientras los workers procesan los grupos ya enviados"""
+        resultados = []
+        lock = threading.Lock()
+
+        def _registrar(i, resultado):
+            if self.cache is not None and 'cache' in resultado:
+                self.cache.sumar_contadores(*resultado.pop('cache'))
+            metricas.incorporar(resultado.pop('spans', ()))
+            with lock:
+                resultados[i] = resultado
+            if al_terminar:
+                al_terminar(resultado)
+
+        if self.max_workers <= 1:
+            for base, archivos in grupos:
+                resultados.append(None)
+                _registrar(len(resultados) - 1, _procesar_grupo(base, archivos, output_dir, grayscale,
+                                                                self.backend, self.grayscale_mode, self.cache, self.presupuesto))
+            return resultados
+
+        registrados = threading.Semaphore(0)
+
+        def _al_completar(i, base, future):
+            try:
+                resultado = future.result()
+            except Exception as e:
+                resultado = {'nombre': base, 'pdf': None, 'error': str(e), 'segundos': None}
+            try:
+                _registrar(i, resultado)
+            finally:
+                registrados.release()
+
+        # Los resultados se registran desde el hilo del pool, sin esperar al siguiente grupo
+        enviados = 0
+        try:
+            for base, archivos in grupos:
+                with lock:
+                    i = len(resultados)
+                    resultados.append(None)
+                future = _enviar_a_pool_pares(self.max_workers, _procesar_grupo, base, archivos, output_dir,
+                                              grayscale, self.backend, self.grayscale_mode, self.cache,
+                                              self.presupuesto)
+                enviados += 1
+                future.add_done_callback(lambda f, i=i, base=base: _al_completar(i, base, f))
+        finally:
+            # El pool es compartido: se espera a que se registren los grupos de este lote
+            for _ in range(enviados):
+                registrados.acquire()
+        return resultados
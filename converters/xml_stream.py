@@ -0,0 +1,203 @@
+from collections import deque
+from xml.parsers import expat
+
+TAM_BLOQUE = 64 * 1024
+
+
+def _escapar(data):
+    """Escapa el texto igual que minidom al serializar"""
+    return data.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+
+class _FormateadorXML:
+    """Reproduce la salida de minidom.toprettyxml() a partir de eventos de expat, sin construir el DOM
+
+    Solo se mantiene la pila de elementos abiertos y, para el elemento actual, el primer
+    hijo mientras no se sabe si el elemento se escribe en una sola línea.
+    """
+
+    def __init__(self, indent):
+        self.indent = indent
+        self.salida = deque()
+        self.pila = []  # [nombre, atributos, abierto, hijo_pendiente]
+        self.texto = []
+        self.cdata = None
+        self.parcial = ""
+
+        self.parser = expat.ParserCreate()
+        self.parser.ordered_attributes = True
+        self.parser.buffer_text = True
+        self.parser.StartElementHandler = self._inicio
+        self.parser.EndElementHandler = self._fin
+        self.parser.CharacterDataHandler = self._caracteres
+        self.parser.StartCdataSectionHandler = self._inicio_cdata
+        self.parser.EndCdataSectionHandler = self._fin_cdata
+        self.parser.CommentHandler = self._comentario
+        self.parser.ProcessingInstructionHandler = self._instruccion
+        self.parser.StartDoctypeDeclHandler = self._inicio_doctype
+        self.parser.EndDoctypeDeclHandler = self._fin_doctype
+        self.doctype = None
+        self.subset = None
+
+        self._emitir('<?xml version="1.0" ?>')
+
+    def _emitir(self, linea, salto=True):
+        """Agrega una línea a la salida; minidom escribe las secciones CDATA sin salto de línea"""
+        linea, self.parcial = self.parcial + linea, ""
+        if salto:
+            self.salida.append(linea)
+        else:
+            self.parcial = linea
+
+    def _sangria(self):
+        return self.indent * len(self.pila)
+
+    def _etiqueta(self, nombre, atributos):
+        # minidom escribe primero las declaraciones xmlns y luego el resto en orden
+        pares = list(zip(atributos[::2], atributos[1::2]))
+        pares.sort(key=lambda par: not (par[0] == "xmlns" or par[0].startswith("xmlns:")))
+        return "<" + nombre + "".join(f' {k}="{_escapar(v)}"' for k, v in pares)
+
+    def _nodo(self, nodo, sangria):
+        tipo, data = nodo
+        if tipo == "texto":
+            return sangria + _escapar(data)
+        if tipo == "cdata":
+            return f"<![CDATA[{data}]]>"
+        return sangria + data
+
+    def _abrir_actual(self):
+        """Escribe la etiqueta de apertura del elemento actual: ya se sabe que tiene varios hijos"""
+        if not self.pila or self.pila[-1][2]:
+            return
+        frame = self.pila[-1]
+        sangria = self.indent * (len(self.pila) - 1)
+        self._emitir(sangria + self._etiqueta(frame[0], frame[1]) + ">")
+        frame[2] = True
+        if frame[3] is not None:
+            self._emitir(self._nodo(frame[3], sangria + self.indent), salto=frame[3][0] != "cdata")
+            frame[3] = None
+
+    def _hijo(self, nodo):
+        """Registra un hijo de texto, CDATA, comentario o instrucción del elemento actual"""
+        if not self.pila:
+            if nodo[0] not in ("texto", "cdata"):
+                self._emitir(self._nodo(nodo, ""))
+            return
+        frame = self.pila[-1]
+        if not frame[2] and frame[3] is None and nodo[0] in ("texto", "cdata"):
+            frame[3] = nodo
+            return
+        self._abrir_actual()
+        self._emitir(self._nodo(nodo, self._sangria()), salto=nodo[0] != "cdata")
+
+    def _vaciar_texto(self):
+        if self.texto:
+            data = "".join(self.texto)
+            self.texto = []
+            self._hijo(("texto", data))
+
+    def _inicio(self, nombre, atributos):
+        self._vaciar_texto()
+        self._abrir_actual()
+        self.pila.append([nombre, atributos, False, None])
+
+    def _fin(self, nombre):
+        self._vaciar_texto()
+        frame = self.pila.pop()
+        sangria = self._sangria()
+        if frame[2]:
+            self._emitir(f"{sangria}</{nombre}>")
+        elif frame[3] is not None:
+            contenido = self._nodo(frame[3], "")
+            self._emitir(sangria + self._etiqueta(nombre, frame[1]) + ">" + contenido + f"</{nombre}>")
+        else:
+            self._emitir(sangria + self._etiqueta(nombre, frame[1]) + "/>")
+
+    def _caracteres(self, data):
+        if self.cdata is not None:
+            self.cdata.append(data)
+        else:
+            self.texto.append(data)
+
+    def _inicio_cdata(self):
+        self._vaciar_texto()
+        self.cdata = []
+
+    def _fin_cdata(self):
+        data, self.cdata = "".join(self.cdata), None
+        self._hijo(("cdata", data))
+
+    def _comentario(self, data):
+        self._vaciar_texto()
+        self._hijo(("comentario", f"<!--{data}-->"))
+
+    def _instruccion(self, destino, data):
+        self._vaciar_texto()
+        self._hijo(("instruccion", f"<?{destino} {data}?>"))
+
+    def _inicio_doctype(self, nombre, system_id, public_id, con_subset):
+        linea = "<!DOCTYPE " + nombre
+        if public_id:
+            linea += f"\n  PUBLIC '{public_id}'\n  '{system_id}'"
+        elif system_id:
+            linea += f"\n  SYSTEM '{system_id}'"
+        self.doctype = linea
+        if con_subset:
+            # Como minidom, el subconjunto interno se copia tal cual, con sus comentarios e
+            # instrucciones. DefaultHandlerExpand no deja de expandir las entidades internas
+            self.subset = []
+            self.parser.CommentHandler = None
+            self.parser.ProcessingInstructionHandler = None
+            self.parser.DefaultHandlerExpand = self.subset.append
+
+    def _fin_doctype(self):
+        linea = self.doctype
+        if self.subset is not None:
+            subset = "".join(self.subset).replace("\r\n", "\n").replace("\r", "\n")
+            linea += f" [{subset}]"
+            self.subset = None
+            self.parser.DefaultHandlerExpand = None
+            self.parser.CommentHandler = self._comentario
+            self.parser.ProcessingInstructionHandler = self._instruccion
+        self._emitir(linea + ">")
+
+    def alimentar(self, bloque, final=False):
+        """Procesa un bloque y devuelve las líneas que ya están completas"""
+        self.parser.Parse(bloque, final)
+        if final and self.parcial:
+            self._emitir("")
+        while self.salida:
+            yield from self.salida.popleft().split("\n")
+
+
+def leer_bloques(ruta, tam_bloque=TAM_BLOQUE):
+    """Lee un archivo en bloques binarios
+
+    `ruta` puede ser una ruta o un archivo en memoria (con getbuffer(), p. ej.
+    ArchivoEnMemoria o BytesIO); en ese caso los bloques son vistas sin copia.
+    """
+    if hasattr(ruta, "getbuffer"):
+        buffer = ruta.getbuffer()
+        for inicio in range(0, len(buffer), tam_bloque):
+            yield buffer[inicio:inicio + tam_bloque]
+        return
+    with open(ruta, "rb") as archivo:
+        while True:
+            bloque = archivo.read(tam_bloque)
+            if not bloque:
+                break
+            yield bloque
+
+
+def iter_pretty_lines(bloques, indent="  "):
+    """Genera las líneas de minidom.toprettyxml(indent) leyendo el XML de forma incremental
+
+    `bloques` es un iterable de bytes o str. La memoria usada no depende del tamaño del
+    documento, solo de la profundidad del árbol. Lanza expat.ExpatError si el XML es inválido;
+    las líneas generadas antes del error ya se habrán entregado.
+    """
+    formateador = _FormateadorXML(indent)
+    for bloque in bloques:
+        yield from formateador.alimentar(bloque)
+    yield from formateador.alimentar(b"", final=True)
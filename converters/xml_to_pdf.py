@@ -1,98 +1,293 @@
-import os
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
-from fpdf import FPDF
-
-class XMLtoPDFConverter:
-    def __init__(self):
-        # Configuración de PDF
-        self.margen = 10
-        self.ancho_util = 210 - 2 * self.margen  # A4 (210mm) - márgenes
-        self.espaciado_lineas = 3
-        self.fuente_cuerpo = "Courier"
-        self.tam_fuente_cuerpo = 6
-        self.fuente_titulo = "Arial"
-        self.tam_fuente_titulo = 14
-
-    def format_xml_text(self, xml_text):
-        """Formatea el XML con indentación (pretty print)"""
-        try:
-            dom = minidom.parseString(xml_text)
-            return [line.strip() for line in dom.toprettyxml(indent='  ').split("\n") if line.strip()]
-        except Exception as e:
-            print(f"Error al formatear XML: {str(e)}")
-            return []
-
-    def convertir_xml_a_txt(self, ruta_xml, ruta_txt):
-        """Convierte XML a TXT con formato legible"""
-        try:
-            # Leer el contenido del XML
-            with open(ruta_xml, 'r', encoding='utf-8') as archivo_xml:
-                xml_content = archivo_xml.read()
-            
-            # Formatear el XML para que sea legible
-            formatted_lines = self.format_xml_text(xml_content)
-            
-            # Escribir las líneas formateadas en el TXT
-            with open(ruta_txt, 'w', encoding='utf-8') as archivo_txt:
-                archivo_txt.write("\n".join(formatted_lines))
-            
-            print(f"XML convertido a TXT legible: {ruta_txt}")
-            return True
-        except Exception as e:
-            print(f"Error al convertir XML a TXT: {str(e)}")
-            return False
-
-    def convertir_txt_a_pdf(self, ruta_txt, ruta_pdf, nombre_xml=None):
-        """Convierte TXT a PDF con formato mejorado"""
-        try:
-            pdf = FPDF()
-            pdf.add_page()
-            pdf.set_margins(left=self.margen, top=self.margen, right=self.margen)
-
-            # Añadir título con nombre del XML
-            nombre_mostrar = nombre_xml if nombre_xml else os.path.splitext(os.path.basename(ruta_txt))[0]
-            pdf.set_font(self.fuente_titulo, "B", self.tam_fuente_titulo)
-            pdf.cell(0, 10, txt=f"Archivo: {nombre_mostrar}", ln=True, align="C")
-            pdf.ln(6)  # Espacio después del título
-
-            # Configurar cuerpo
-            pdf.set_font(self.fuente_cuerpo, size=self.tam_fuente_cuerpo)
-
-            with open(ruta_txt, "r", encoding="utf-8") as txt_file:
-                for linea in txt_file:
-                    linea = linea.strip()
-                    if linea:
-                        pdf.multi_cell(
-                            w=self.ancho_util,
-                            h=self.espaciado_lineas,
-                            txt=linea,
-                            border=0,
-                            align="L",
-                        )
-                        pdf.ln(2)
-
-            pdf.output(ruta_pdf)
-            print(f"PDF generado en: {ruta_pdf}")
-            return True
-        except Exception as e:
-            print(f"Error al convertir TXT a PDF: {str(e)}")
-            return False
-
-    def convert(self, xml_path, output_pdf):
-        """Método unificado para compatibilidad con pdf_processor.py"""
-        temp_txt = os.path.join(os.path.dirname(output_pdf), "temp_xml.txt")
-        
-        if not self.convertir_xml_a_txt(xml_path, temp_txt):
-            return False
-            
-        # Obtener nombre del XML sin extensión
-        nombre_xml = os.path.splitext(os.path.basename(xml_path))[0]
-            
-        if not self.convertir_txt_a_pdf(temp_txt, output_pdf, nombre_xml=nombre_xml):
-            return False
-            
-        # Limpieza
-        if os.path.exists(temp_txt):
-            os.remove(temp_txt)
-        return True
+import os
+import time
+from xml.parsers import expat
+import fpdf
+from fpdf import FPDF
+from converters.xml_stream import iter_pretty_lines, leer_bloques
+from utils.file_utils import nombre_archivo, tamano_archivo
+from utils.metrics import Span, cronometrar, metricas
+
+# _DocumentoPDF y la escritura directa del cuerpo usan detalles internos de fpdf 1.7 (buffer,
+# offsets, pages, current_font); con otra versión se usa multi_cell, más lento pero compatible
+FPDF_17 = str(getattr(fpdf, "FPDF_VERSION", "")).startswith("1.7")
+
+class _DocumentoPDF(FPDF):
+    """FPDF con el búfer de salida en una lista de partes
+
+    FPDF 1.7 concatena cada línea al búfer completo, lo que es cuadrático en documentos de
+    miles de páginas. El contenido generado es idéntico.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._partes = []
+        self._largo = 0
+        super().__init__(*args, **kwargs)
+
+    @property
+    def buffer(self):
+        if len(self._partes) != 1:
+            self._partes = ["".join(self._partes)]
+        return self._partes[0]
+
+    @buffer.setter
+    def buffer(self, valor):
+        self._partes = [valor]
+        self._largo = len(valor)
+
+    def _out(self, s):
+        if self.state == 2:
+            # Contenido de la página actual
+            super()._out(s)
+            return
+        if isinstance(s, bytes):
+            s = s.decode("latin1")
+        elif not isinstance(s, str):
+            s = str(s)
+        self._partes.append(s + "\n")
+        self._largo += len(s) + 1
+
+    def _newobj(self):
+        self.n += 1
+        self.offsets[self.n] = self._largo
+        self._out(str(self.n) + ' 0 obj')
+
+
+def _partir_linea(texto, max_caracteres):
+    """Corta una línea como FPDF.multi_cell con una fuente de ancho fijo: en el último espacio
+    que cabe o, si no hay, en el carácter que desborda"""
+    partes = []
+    inicio = 0
+    while len(texto) - inicio > max_caracteres:
+        desborde = inicio + max_caracteres
+        espacio = texto.rfind(' ', inicio, desborde + 1)
+        if espacio == -1:
+            desborde = max(desborde, inicio + 1)
+            partes.append(texto[inicio:desborde])
+            inicio = desborde
+        else:
+            partes.append(texto[inicio:espacio])
+            inicio = espacio + 1
+    partes.append(texto[inicio:])
+    return partes
+
+
+class XMLtoPDFConverter:
+    # Cambiar cuando el renderizado produzca una salida distinta (invalida la caché)
+    version = 1
+
+    # Métricas de la fuente del cuerpo, compartidas entre documentos del mismo proceso
+    _metricas_fuente = {}
+
+    def __init__(self):
+        # Configuración de PDF
+        self.margen = 10
+        self.ancho_util = 210 - 2 * self.margen  # A4 (210mm) - márgenes
+        self.espaciado_lineas = 3
+        self.fuente_cuerpo = "Courier"
+        self.tam_fuente_cuerpo = 6
+        self.fuente_titulo = "Arial"
+        self.tam_fuente_titulo = 14
+
+    def parametros(self):
+        """Parámetros que determinan el PDF generado (se usan en la clave de la caché)"""
+        return {
+            'version': self.version,
+            'margen': self.margen,
+            'espaciado_lineas': self.espaciado_lineas,
+            'fuente_cuerpo': self.fuente_cuerpo,
+            'tam_fuente_cuerpo': self.tam_fuente_cuerpo,
+            'fuente_titulo': self.fuente_titulo,
+            'tam_fuente_titulo': self.tam_fuente_titulo,
+        }
+
+    def iter_lineas_xml(self, bloques):
+        """Genera las líneas indentadas del XML (pretty print) leyendo por bloques, sin DOM
+
+        Si el XML es inválido se detiene en el error; las líneas anteriores ya se entregaron.
+        """
+        try:
+            yield from iter_pretty_lines(bloques, indent='  ')
+        except expat.ExpatError as e:
+            print(f"Error al formatear XML: {str(e)}")
+
+    def format_xml_text(self, xml_text):
+        """Formatea el XML con indentación (pretty print)"""
+        return [line.strip() for line in self.iter_lineas_xml([xml_text]) if line.strip()]
+
+    def convertir_xml_a_txt(self, ruta_xml, ruta_txt):
+        """Convierte XML a TXT con formato legible"""
+        try:
+            # Formatear el XML por bloques y escribir las líneas a medida que se generan
+            with open(ruta_txt, 'w', encoding='utf-8') as archivo_txt:
+                primera = True
+                for linea in self.iter_lineas_xml(leer_bloques(ruta_xml)):
+                    linea = linea.strip()
+                    if linea:
+                        archivo_txt.write(linea if primera else "\n" + linea)
+                        primera = False
+            
+            print(f"XML convertido a TXT legible: {ruta_txt}")
+            return True
+        except Exception as e:
+            print(f"Error al convertir XML a TXT: {str(e)}")
+            return False
+
+    def _crear_pdf(self, lineas, nombre_mostrar):
+        """Construye el documento FPDF con el título y las líneas del cuerpo"""
+        pdf = _DocumentoPDF() if FPDF_17 else FPDF()
+        pdf.add_page()
+        pdf.set_margins(left=self.margen, top=self.margen, right=self.margen)
+
+        # Añadir título con nombre del XML
+        pdf.set_font(self.fuente_titulo, "B", self.tam_fuente_titulo)
+        pdf.cell(0, 10, txt=f"Archivo: {nombre_mostrar}", ln=True, align="C")
+        pdf.ln(6)  # Espacio después del título
+
+        # Configurar cuerpo
+        pdf.set_font(self.fuente_cuerpo, size=self.tam_fuente_cuerpo)
+
+        metricas = self._metricas_cuerpo(pdf)
+        if metricas is None:
+            for linea in lineas:
+                linea = linea.strip()
+                if linea:
+                    self._linea_multi_cell(pdf, linea)
+        else:
+            self._escribir_cuerpo(pdf, lineas, *metricas)
+        return pdf
+
+    def _linea_multi_cell(self, pdf, linea):
+        pdf.multi_cell(
+            w=self.ancho_util,
+            h=self.espaciado_lineas,
+            txt=linea,
+            border=0,
+            align="L",
+        )
+        pdf.ln(2)
+
+    def _metricas_cuerpo(self, pdf):
+        """(caracteres por línea, caracteres de ancho fijo) si la fuente del cuerpo es
+        monoespaciada, o None para usar multi_cell"""
+        if not FPDF_17:
+            return None
+        clave = (pdf.font_family, pdf.font_size, self.ancho_util, pdf.c_margin)
+        if clave not in self._metricas_fuente:
+            anchos = pdf.current_font['cw']
+            metricas = None
+            if not pdf.unifontsubset and len(set(anchos.values())) == 1:
+                ancho = next(iter(anchos.values()))
+                wmax = (self.ancho_util - 2 * pdf.c_margin) * 1000.0 / pdf.font_size
+                # multi_cell corta cuando la suma de anchos supera wmax
+                maximo = int(wmax // ancho)
+                while (maximo + 1) * ancho <= wmax:
+                    maximo += 1
+                while maximo and maximo * ancho > wmax:
+                    maximo -= 1
+                metricas = (maximo, frozenset(anchos))
+            self._metricas_fuente[clave] = metricas
+        return self._metricas_fuente[clave]
+
+    def _escribir_cuerpo(self, pdf, lineas, max_caracteres, caracteres):
+        """Escribe el cuerpo con el mismo resultado que multi_cell + ln(2) por línea, pero
+        cortando las líneas aritméticamente y agregando el texto de cada página de una vez"""
+        h = self.espaciado_lineas
+        k = pdf.k
+        x_texto = (pdf.x + pdf.c_margin) * k
+        alto_pagina = pdf.h
+        ajuste = .3 * pdf.font_size
+        limite = pdf.page_break_trigger
+        y = pdf.y
+        pendiente = []
+
+        def vaciar():
+            if pendiente:
+                pdf.pages[pdf.page] += "".join(pendiente)
+                pendiente.clear()
+
+        for linea in lineas:
+            linea = linea.strip()
+            if not linea:
+                continue
+            linea = linea.replace("\r", "")
+            if not caracteres.issuperset(linea):
+                # Caracteres sin ancho conocido: se deja a FPDF
+                vaciar()
+                pdf.y = y
+                self._linea_multi_cell(pdf, linea)
+                y = pdf.y
+                continue
+
+            for parte in _partir_linea(linea, max_caracteres):
+                if y + h > limite and pdf.accept_page_break():
+                    # El salto de página lo hace FPDF para conservar el encabezado de página
+                    vaciar()
+                    pdf.y = y
+                    pdf.cell(self.ancho_util, h, parte, 0, 2, "L", 0)
+                    y = pdf.y
+                    continue
+                if parte:
+                    pendiente.append("BT %.2f %.2f Td (%s) Tj ET\n" % (
+                        x_texto, (alto_pagina - (y + .5 * h + ajuste)) * k, parte.replace('\\', '\\\\').replace(')', '\\)').replace('(', '\\(')))
+                y += h
+            y += 2
+
+        vaciar()
+        pdf.y = y
+        pdf.x = pdf.l_margin
+        pdf.lasth = h
+
+    def convertir_txt_a_pdf(self, ruta_txt, ruta_pdf, nombre_xml=None):
+        """Convierte TXT a PDF con formato mejorado"""
+        try:
+            nombre_mostrar = nombre_xml if nombre_xml else os.path.splitext(os.path.basename(ruta_txt))[0]
+
+            with open(ruta_txt, "r", encoding="utf-8") as txt_file:
+                pdf = self._crear_pdf(txt_file, nombre_mostrar)
+
+            pdf.output(ruta_pdf)
+            print(f"PDF generado en: {ruta_pdf}")
+            return True
+        except Exception as e:
+            print(f"Error al convertir TXT a PDF: {str(e)}")
+            return False
+
+    def convert_to_bytes(self, xml_path):
+        """Convierte un XML a PDF en memoria, sin archivos intermedios. Devuelve los bytes o None
+
+        `xml_path` puede ser una ruta o un ArchivoEnMemoria.
+        """
+        try:
+            nombre_xml = os.path.splitext(nombre_archivo(xml_path))[0]
+            inicio = time.perf_counter()
+            # El formateo ocurre a medida que el PDF pide líneas: su tiempo se mide aparte
+            parse = Span("xml_parse", bytes_entrada=tamano_archivo(xml_path))
+            lineas = cronometrar(self.iter_lineas_xml(leer_bloques(xml_path)), parse)
+            pdf = self._crear_pdf(lineas, nombre_xml)
+            data = pdf.output(dest='S')
+            # fpdf 1.x devuelve str (latin-1); fpdf2 devuelve bytearray
+            data = data.encode('latin-1') if isinstance(data, str) else bytes(data)
+
+            render = Span("xml_render", segundos=time.perf_counter() - inicio - parse.segundos,
+                          bytes_salida=len(data), paginas=pdf.page_no())
+            metricas.registrar(parse)
+            metricas.registrar(render)
+            return data
+        except Exception as e:
+            print(f"Error convirtiendo {nombre_archivo(xml_path)}: {str(e)}")
+            return None
+
+    def convert(self, xml_path, output_pdf):
+        """Método unificado para compatibilidad con pdf_processor.py"""
+        try:
+            # Las líneas pasan directo del lector del XML al PDF, sin archivo TXT intermedio
+            data = self.convert_to_bytes(xml_path)
+            if data is None:
+                return False
+            with open(output_pdf, 'wb') as f:
+                f.write(data)
+            print(f"PDF generado en: {output_pdf}")
+            return True
+        except Exception as e:
+            print(f"Error al convertir XML a PDF: {str(e)}")
+            return False
@@ -1,291 +1,721 @@
-import time
-from flask import Flask, render_template, request, jsonify, send_file
-import os
-import tempfile
-import zipfile
-import fitz  # PyMuPDF
-import io
-import shutil
-from PIL import Image, ImageEnhance
-from threading import Timer
-from converters.xml_to_pdf import XMLtoPDFConverter
-from converters.pdf_processor import PDFProcessor
-from utils.file_utils import allowed_file, validate_file_pairs, save_uploaded_files
-
-app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
-app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB
-ALLOWED_EXTENSIONS = {'pdf', 'xml'}
-
-
-@app.route('/health')
-def health_check():
-    return "OK", 200
-
-last_processed_file = None
-
-def cleanup_temp_files(temp_dir):
-    try:
-        shutil.rmtree(temp_dir, ignore_errors=True)
-    except Exception as e:
-        app.logger.error(f"Error al limpiar archivos temporales: {str(e)}")
-
-@app.route('/')
-def index():
-    return render_template('index.html')
-
-@app.route('/upload', methods=['POST'])
-def upload_files():
-    global last_processed_file
-    modo = request.form.get('modo', 'pares')
-    color_mode = request.form.get('color_mode', 'grayscale')
-    if color_mode not in ['grayscale', 'color']:
-        color_mode = 'grayscale'
-    grayscale = color_mode == 'grayscale'
-    custom_name = request.form.get('custom_name', '').strip()
-
-    if 'files' not in request.files:
-        return jsonify({'error': 'No se seleccionaron archivos'}), 400
-
-    files = request.files.getlist('files')
-    files = [f for f in files if f and hasattr(f, 'filename') and f.filename and allowed_file(f.filename)]
-
-    if len(files) < 1:
-        return jsonify({'error': 'Debes subir al menos 1 archivo válido'}), 400
-
-    if modo == 'pares':
-        is_valid, message = validate_file_pairs(files)
-        if not is_valid:
-            return jsonify({'error': message}), 400
-
-    try:
-        temp_dir = tempfile.mkdtemp()
-        saved_files = save_uploaded_files(files, temp_dir)
-
-        processor = PDFProcessor()
-        output_dir = os.path.join(temp_dir, 'output')
-        os.makedirs(output_dir, exist_ok=True)
-
-        combined_pdfs = []
-        
-        if modo == 'pares':
-            file_groups = {}
-            for file_path in saved_files:
-                base_name = os.path.splitext(os.path.basename(file_path))[0]
-                if base_name not in file_groups:
-                    file_groups[base_name] = []
-                file_groups[base_name].append(file_path)
-
-            for base_name, file_group in file_groups.items():
-                try:
-                    output_path = os.path.join(output_dir, f"{base_name}.pdf")
-                    combined_pdf = processor.combinar_archivos(
-                        file_group,
-                        output_path=output_path,  # Cambiado de output_dir/output_name a output_path
-                        modo="pares"
-                    )
-                    if combined_pdf and os.path.exists(combined_pdf):
-                        processed_pdf = optimize_pdf_size(
-                            combined_pdf, 
-                            output_dir=output_dir,
-                            grayscale=grayscale
-                        )
-                        if processed_pdf:
-                            combined_pdfs.append(processed_pdf)
-                except Exception as e:
-                    app.logger.error(f"Error procesando grupo {base_name}: {str(e)}")
-                    continue
-
-            zip_output_name = custom_name if custom_name else "documentos_combinados_por_pares"
-
-        else:
-            output_name = f"{custom_name}.pdf" if custom_name else "documento_completo.pdf"
-            output_path = os.path.join(output_dir, output_name)
-            
-            try:
-                combined_pdf = processor.combinar_archivos(
-                    saved_files,
-                    output_path=output_path,  # Cambiado de output_dir/output_name a output_path
-                    modo="completo"
-                )
-                if combined_pdf and os.path.exists(combined_pdf):
-                    processed_pdf = optimize_pdf_size(
-                        combined_pdf,
-                        output_dir=output_dir,
-                        grayscale=grayscale
-                    )
-                    if processed_pdf:
-                        combined_pdfs.append(processed_pdf)
-                else:
-                    raise Exception("No se pudo crear el PDF combinado")
-                    
-            except Exception as e:
-                app.logger.error(f"Error combinando archivos: {str(e)}")
-                return jsonify({'error': f'Error al combinar archivos: {str(e)}'}), 500
-
-            zip_output_name = custom_name if custom_name else "documento_completo"
-
-        if not combined_pdfs:
-            return jsonify({'error': 'No se pudieron procesar los archivos'}), 500
-
-        zip_filename = f"{zip_output_name}.zip"
-        zip_path = os.path.join(temp_dir, zip_filename)
-
-        with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zipf:
-            for pdf in combined_pdfs:
-                if pdf and os.path.exists(pdf):
-                    arcname = os.path.basename(pdf)
-                    zipf.write(pdf, arcname)
-
-        last_processed_file = zip_path
-        Timer(300, cleanup_temp_files, args=[temp_dir]).start()
-
-        return jsonify({
-            'success': True,
-            'filename': os.path.basename(zip_path),
-            'modo': modo,
-            'custom_name_used': bool(custom_name),
-            'color_mode': color_mode
-        })
-
-    except Exception as e:
-        app.logger.error(f'Error inesperado: {str(e)}')
-        return jsonify({'error': f'Error inesperado: {str(e)}'}), 500
-
-
-@app.route('/download', methods=['GET'])
-def download_file():
-    global last_processed_file
-    
-    if not last_processed_file or not os.path.exists(last_processed_file):
-        return jsonify({'error': 'No hay archivos para descargar'}), 404
-    
-    try:
-        filename = request.args.get('filename', os.path.basename(last_processed_file))
-        return send_file(
-            last_processed_file,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='application/zip'
-        )
-    except Exception as e:
-        app.logger.error(f"Error al descargar archivo: {str(e)}")
-        return jsonify({'error': str(e)}), 500
-
-
-def optimize_pdf_size(input_pdf, output_dir=None, target_dpi=150, grayscale=False):
-    """Optimiza un PDF manteniendo texto vectorial y mejorando la legibilidad."""
-    try:
-        if not os.path.exists(input_pdf):
-            print(f"Archivo no encontrado: {input_pdf}")
-            return None
-        
-        output_dir = output_dir or os.path.dirname(input_pdf)
-        os.makedirs(output_dir, exist_ok=True)
-        
-        output_pdf = os.path.join(output_dir, f"opt_{os.path.basename(input_pdf)}")
-        
-        # Abrimos el documento original y creamos uno nuevo
-        src_doc = fitz.open(input_pdf)
-        dst_doc = fitz.open()
-        
-        for page in src_doc:
-            new_page = dst_doc.new_page(width=page.rect.width, height=page.rect.height)
-
-            if grayscale:
-                # Extraer texto y bloques
-                text_blocks = page.get_text("blocks")
-                images = page.get_images(full=True)
-
-                # Convertir la página completa a escala de grises (sin texto)
-                pix = page.get_pixmap(dpi=max(target_dpi, 150), colorspace=fitz.csGRAY, alpha=False)
-                new_page.insert_image(new_page.rect, pixmap=pix)
-
-                # Reinsertar texto en negro sólido para mayor claridad
-                tw = fitz.TextWriter(new_page.rect)
-                for block in text_blocks:
-                    if block[6]:  # Si el bloque contiene texto
-                        x0, y0, _, _, text, *_ = block
-                        tw.append((x0, y0), text)
-                tw.write_text(new_page, color=(0, 0, 0))  # Texto en negro puro
-                
-                # Procesar imágenes individualmente con mejora de contraste y compresión
-                for img in images:
-                    xref = img[0]
-
-                    try:
-                        # Extraer imagen del PDF
-                        base_image = src_doc.extract_image(xref)
-                        if not base_image or "image" not in base_image:
-                            print(f"Advertencia: Imagen en xref {xref} es nula o no extraíble, saltando...")
-                            continue
-
-                        # Añade esta validación adicional:
-                        if not base_image.get("width", 0) or not base_image.get("height", 0):
-                            print(f"Imagen en xref {xref} tiene dimensiones inválidas, saltando...")
-                            continue
-
-                        # Validar tamaño y formato de la imagen extraída
-                        img_bytes = base_image["image"]
-                        if len(img_bytes) < 100:  # Tamaño mínimo de imagen razonable
-                            print(f"Imagen en xref {xref} es demasiado pequeña, ignorando...")
-                            continue
-
-                        img_pil = Image.open(io.BytesIO(img_bytes))
-
-                        # Verificar si la imagen es un formato soportado
-                        if img_pil.format not in ["JPEG", "PNG", "TIFF"]:
-                            print(f"Formato de imagen en xref {xref} no soportado ({img_pil.format}), ignorando...")
-                            continue
-
-                        if img_pil.mode != "L":
-                            img_pil = img_pil.convert("L")
-                        
-                        # Mejorar contraste para mayor legibilidad
-                        enhancer = ImageEnhance.Contrast(img_pil)
-                        img_pil = enhancer.enhance(1.5)
-
-                        # Convertir a JPEG con compresión optimizada
-                        img_bytes = io.BytesIO()
-                        img_pil.save(img_bytes, format="JPEG", quality=85, optimize=True)
-                        img_bytes.seek(0)
-
-                        # Guardar en archivo temporal con un nombre único
-                        with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as tmp:
-                            tmp.write(img_bytes.read())
-                            img_rect = page.get_image_bbox(xref)
-                            new_page.insert_image(img_rect, filename=tmp.name)
-
-                        os.unlink(tmp.name)  # Eliminar archivo temporal después de usarlo
-                    except Exception as e:
-                        print(f"Error procesando imagen en xref {xref}: {str(e)}")
-            else:
-                # Si no es escala de grises, copiar la página original
-                new_page.show_pdf_page(new_page.rect, src_doc, page.number)
-        
-        # Opciones de guardado optimizadas
-        save_options = {
-            "garbage": 4,
-            "deflate": True,
-            "clean": True
-        }
-        
-        dst_doc.save(output_pdf, **save_options)
-        
-        # Cerrar documentos correctamente
-        src_doc.close()
-        dst_doc.close()
-        
-        print(f"PDF optimizado guardado en: {output_pdf}")
-        return output_pdf
-
-    except Exception as e:
-        print(f"Error al optimizar PDF: {str(e)}")
-    finally:
-        # Asegurar que los documentos se cierran en caso de error
-        if 'src_doc' in locals() and not src_doc.is_closed:
-            src_doc.close()
-        if 'dst_doc' in locals() and not dst_doc.is_closed:
-            dst_doc.close()
-    
-    return None
+import time
+from datetime import datetime, timezone
+from flask import Flask, Response, render_template, request, jsonify
+import json
+import os
+import tempfile
+import shutil
+from converters.pdf_optimizer import PRESUPUESTOS
+from converters.pdf_processor import PDFProcessor, precalentar
+from utils.bundles import BundleStore
+from utils.cfdi import CRITERIOS_ORDEN, leer_encabezado, nombre_desde_plantilla
+from utils.cache import ResultCache
+from utils.jobs import ColaLlenaError, JobManager
+from utils.uploads import ErrorSubida, GestorSubidas
+from werkzeug.http import parse_content_range_header
+from utils.zip_stream import content_disposition, generar_zip
+from utils.file_utils import (IndicePares, allowed_file, en_memoria, nombre_archivo, ordenar_por_cfdi,
+                              tamano_archivo, save_uploaded_files)
+from utils.metrics import metricas
+from utils.previews import CachePrevisualizaciones
+
+app = Flask(__name__)
+app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB
+app.config['MAX_WORKERS'] = int(os.environ.get('MAX_WORKERS', os.cpu_count() or 4))
+app.config['PDF_BACKEND'] = os.environ.get('PDF_BACKEND', 'fitz')  # 'fitz' (una pasada) o 'pypdf2'
+app.config['GRAYSCALE_MODE'] = os.environ.get('GRAYSCALE_MODE', 'vector')  # 'vector' o 'raster'
+# Presupuesto de tamaño por defecto ('calidad', 'equilibrado' o 'tamano'); vacío solo deduplica recursos
+app.config['PDF_BUDGET'] = os.environ.get('PDF_BUDGET', '')
+# Caché de resultados en disco; CACHE_DIR vacío la desactiva
+app.config['CACHE_DIR'] = os.environ.get('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'xml_pdf_cache'))
+app.config['CACHE_MAX_MB'] = int(os.environ.get('CACHE_MAX_MB', 512))
+# Trabajos en segundo plano: ejecución simultánea, cola máxima y vida del resultado (segundos)
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_QUEUE_SIZE'] = int(os.environ.get('JOB_QUEUE_SIZE', 20))
+app.config['JOB_TTL'] = int(os.environ.get('JOB_TTL', 300))
+# Los archivos subidos de hasta este tamaño (bytes) se procesan en memoria sin escribirse a disco; 0 lo desactiva
+app.config['MEMORY_UPLOAD_THRESHOLD'] = int(os.environ.get('MEMORY_UPLOAD_THRESHOLD', 8 * 1024 * 1024))
+# Límite de memoria (MB) para combinar: se combina por bloques que no lo superan; 0 combina todo en memoria
+app.config['MERGE_MEMORY_MB'] = int(os.environ.get('MERGE_MEMORY_MB', 0))
+# Lotes de modo completo guardados para rehacer solo lo que cambia al volver a subirlos; BUNDLE_DIR vacío lo desactiva
+app.config['BUNDLE_DIR'] = os.environ.get('BUNDLE_DIR', os.path.join(tempfile.gettempdir(), 'xml_pdf_bundles'))
+app.config['BUNDLE_MAX'] = int(os.environ.get('BUNDLE_MAX', 100))
+# Subidas por partes (/uploads): tamaño máximo del lote, segundos sin recibir datos antes de expirar
+# y subidas recibiendo archivos a la vez. Cada fragmento sigue limitado por MAX_CONTENT_LENGTH, el lote completo no
+app.config['UPLOAD_MAX_MB'] = int(os.environ.get('UPLOAD_MAX_MB', 2048))
+app.config['UPLOAD_TIMEOUT'] = int(os.environ.get('UPLOAD_TIMEOUT', 600))
+app.config['UPLOAD_MAX_SESSIONS'] = int(os.environ.get('UPLOAD_MAX_SESSIONS', 20))
+# En modo pares, emparejar por el UUID del CFDI los PDF y XML cuyos nombres no coinciden
+app.config['PAIR_BY_UUID'] = os.environ.get('PAIR_BY_UUID', '0').lower() in ('1', 'true')
+# Plantilla por defecto para nombrar los PDF del modo pares con datos del CFDI, p. ej. "{rfc_emisor}_{serie}{folio}";
+# vacía conserva opt_<nombre>.pdf. El formulario la puede cambiar con `plantilla_nombre`
+app.config['NAME_TEMPLATE'] = os.environ.get('NAME_TEMPLATE', '')
+# PyMuPDF, Pillow, fpdf y PyPDF2 se importan en el primer uso para que el servidor arranque rápido.
+# WARMUP=1 los carga al importar la app: con un servidor pre-fork (gunicorn --preload) los workers
+# los heredan ya cargados y la primera solicitud de cada uno no paga la importación
+app.config['WARMUP'] = os.environ.get('WARMUP', '0').lower() in ('1', 'true')
+# Miniaturas de las páginas de los PDF generados (/jobs/<id>/previews): memoria para las ya
+# renderizadas, ancho por defecto y máximo en píxeles
+app.config['PREVIEW_CACHE_MB'] = int(os.environ.get('PREVIEW_CACHE_MB', 64))
+app.config['PREVIEW_WIDTH'] = int(os.environ.get('PREVIEW_WIDTH', 150))
+app.config['PREVIEW_MAX_WIDTH'] = int(os.environ.get('PREVIEW_MAX_WIDTH', 400))
+ALLOWED_EXTENSIONS = {'pdf', 'xml'}
+
+
+@app.route('/health')
+def health_check():
+    return "OK", 200
+
+last_job_id = None
+
+result_cache = None
+if app.config['CACHE_DIR']:
+    result_cache = ResultCache(app.config['CACHE_DIR'], max_bytes=app.config['CACHE_MAX_MB'] * 1024 * 1024)
+
+bundle_store = None
+if app.config['BUNDLE_DIR'] and app.config['PDF_BACKEND'] == 'fitz':
+    bundle_store = BundleStore(app.config['BUNDLE_DIR'], max_bundles=app.config['BUNDLE_MAX'])
+
+gestor_subidas = GestorSubidas(
+    max_bytes=app.config['UPLOAD_MAX_MB'] * 1024 * 1024,
+    timeout=app.config['UPLOAD_TIMEOUT'],
+    max_sesiones=app.config['UPLOAD_MAX_SESSIONS']
+)
+
+previsualizaciones = CachePrevisualizaciones(
+    max_bytes=app.config['PREVIEW_CACHE_MB'] * 1024 * 1024,
+    ancho_max=app.config['PREVIEW_MAX_WIDTH']
+)
+
+if app.config['WARMUP']:
+    print(f"Backends precargados en {precalentar(app.config['PDF_BACKEND']):.2f} s")
+
+job_manager = JobManager(
+    max_workers=app.config['JOB_WORKERS'],
+    max_cola=app.config['JOB_QUEUE_SIZE'],
+    ttl=app.config['JOB_TTL']
+)
+
+
+class ErrorProcesamiento(Exception):
+    """Error de conversión que se devuelve al cliente"""
+
+
+def cleanup_temp_files(temp_dir):
+    try:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    except Exception as e:
+        app.logger.error(f"Error al limpiar archivos temporales: {str(e)}")
+
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+def _leer_opciones(datos):
+    """Modo, color, presupuesto, nombre y lote de un formulario (o del JSON de /uploads)"""
+    modo = datos.get('modo', 'pares')
+    color_mode = datos.get('color_mode', 'grayscale')
+    if color_mode not in ['grayscale', 'color']:
+        color_mode = 'grayscale'
+    custom_name = (datos.get('custom_name') or '').strip()
+    presupuesto = datos.get('presupuesto') or app.config['PDF_BUDGET']
+    if presupuesto not in PRESUPUESTOS:
+        presupuesto = None
+
+    # En modo completo el resultado queda como lote; con el bundle_id de una subida anterior
+    # solo se procesan los archivos que cambiaron
+    bundle_id = None
+    if modo == 'completo' and bundle_store is not None:
+        bundle_id = (datos.get('bundle_id') or '').strip().lower()
+        if not BundleStore.id_valido(bundle_id):
+            bundle_id = BundleStore.nuevo_id()
+
+    # Orden del modo completo por datos del CFDI (fecha, emisor, folio, total); sin él se respeta el de subida
+    orden = datos.get('orden') if modo == 'completo' and datos.get('orden') in CRITERIOS_ORDEN else None
+    plantilla = (datos.get('plantilla_nombre') or app.config['NAME_TEMPLATE']).strip() if modo == 'pares' else ''
+    return {'modo': modo, 'color_mode': color_mode, 'custom_name': custom_name, 'bundle_id': bundle_id,
+            'orden': orden, 'plantilla': plantilla or None, 'presupuesto': presupuesto}
+
+
+def _leer_solicitud():
+    """Valida el formulario y guarda los archivos; devuelve (parametros, None) o (None, respuesta de error)"""
+    parametros = _leer_opciones(request.form)
+
+    if 'files' not in request.files:
+        return None, (jsonify({'error': 'No se seleccionaron archivos'}), 400)
+
+    files = request.files.getlist('files')
+    files = [f for f in files if f and hasattr(f, 'filename') and f.filename and allowed_file(f.filename)]
+
+    if len(files) < 1:
+        return None, (jsonify({'error': 'Debes subir al menos 1 archivo válido'}), 400)
+
+    temp_dir = tempfile.mkdtemp()
+    with metricas.medir("save") as span:
+        saved_files = save_uploaded_files(files, temp_dir, umbral_memoria=app.config['MEMORY_UPLOAD_THRESHOLD'])
+        span.bytes_entrada = sum(tamano_archivo(f) for f in saved_files)
+        # Bytes escritos a disco (los archivos en memoria no cuentan)
+        span.bytes_salida = sum(tamano_archivo(f) for f in saved_files if not en_memoria(f))
+
+    # El índice de pares se arma una vez con los nombres guardados y lo usan la validación,
+    # el progreso y el procesamiento
+    indice = None
+    if parametros['modo'] == 'pares':
+        indice = IndicePares(saved_files)
+        if app.config['PAIR_BY_UUID']:
+            indice.emparejar_por_uuid()
+        is_valid, message = indice.validar()
+        if not is_valid:
+            cleanup_temp_files(temp_dir)
+            return None, (jsonify({'error': message, 'huerfanos': indice.huerfanos()}), 400)
+    return dict(parametros, temp_dir=temp_dir, saved_files=saved_files, indice=indice), None
+
+
+def _nombres_progreso(modo, saved_files, indice=None):
+    """Unidades de progreso de un lote: grupos en modo pares, archivos en modo completo"""
+    if modo == 'pares':
+        return list((indice or IndicePares(saved_files)).completos())
+    return [nombre_archivo(f) for f in saved_files]
+
+
+def _nombre_zip(modo, custom_name):
+    if custom_name:
+        return f"{custom_name}.zip"
+    return "documentos_combinados_por_pares.zip" if modo == 'pares' else "documento_completo.zip"
+
+
+def _metadatos_cfdi(archivos):
+    """Encabezado del CFDI de cada XML: {nombre: metadatos}"""
+    return {nombre_archivo(f): leer_encabezado(f) for f in archivos if nombre_archivo(f).lower().endswith('.xml')}
+
+
+def _entradas_manifiesto(archivos, metadatos):
+    entradas = []
+    for archivo in archivos:
+        entrada = {'nombre': nombre_archivo(archivo)}
+        if metadatos.get(entrada['nombre']):
+            entrada['cfdi'] = metadatos[entrada['nombre']]
+        entradas.append(entrada)
+    return entradas
+
+
+def _documento_manifiesto(archivo, entradas, paginas=None):
+    documento = {'archivo': archivo, 'entradas': entradas}
+    if paginas:
+        documento['paginas'] = paginas
+    return documento
+
+
+def _escribir_manifiesto(output_dir, modo, orden, documentos):
+    """Escribe el manifiesto del ZIP: qué entradas y qué datos del CFDI tiene cada PDF y,
+    si se aplicó la política por página, qué se hizo con cada página"""
+    ruta = os.path.join(output_dir, 'manifiesto.json')
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': 1,
+            'generado': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'modo': modo,
+            'orden': orden,
+            'documentos': [d for d in documentos if d],
+        }, f, ensure_ascii=False, indent=2)
+    return ruta, 'manifiesto.json'
+
+
+def _nombre_unico(nombre, usados):
+    base, ext = os.path.splitext(nombre)
+    n = 2
+    while nombre in usados:
+        nombre = f"{base}_{n}{ext}"
+        n += 1
+    usados.add(nombre)
+    return nombre
+
+
+def procesar_lote(saved_files, temp_dir, modo, grayscale, custom_name, job=None, bundle_id=None, grupos=None,
+                  indice=None, orden=None, plantilla=None, presupuesto=None):
+    """Convierte un lote y devuelve la lista de artefactos generados, pares (ruta, nombre en el ZIP)
+
+    Con `job` se reporta el progreso por archivo y cada PDF se publica en cuanto termina,
+    para que la descarga en streaming pueda empezar antes de que acabe el lote. Con
+    `bundle_id` (modo completo) se parte del resultado guardado de ese lote y el nuevo
+    queda guardado en su lugar. En modo pares los grupos salen de `indice` (un IndicePares
+    del lote) o, con `grupos`, de un iterable que entrega (base, archivos) a medida que se
+    suben; en ese caso se numeran en el orden en que llegan.
+
+    Los datos del CFDI se leen solo del encabezado de cada XML: en modo completo `orden`
+    (un criterio de CRITERIOS_ORDEN) decide el orden de combinación y en modo pares
+    `plantilla` el nombre de cada PDF. `presupuesto` (ver PRESUPUESTOS) define cuánto se
+    reducen las imágenes. El último artefacto es manifiesto.json.
+    """
+    processor = PDFProcessor(
+        temp_dir=os.path.join(temp_dir, 'tmp'),
+        max_workers=app.config['MAX_WORKERS'],
+        backend=app.config['PDF_BACKEND'],
+        grayscale_mode=app.config['GRAYSCALE_MODE'],
+        cache=result_cache,
+        memoria_max_mb=app.config['MERGE_MEMORY_MB'] or None,
+        presupuesto=presupuesto
+    )
+    output_dir = os.path.join(temp_dir, 'output')
+    os.makedirs(output_dir, exist_ok=True)
+
+    combined_pdfs = []
+    
+    if modo == 'pares':
+        if grupos is None:
+            file_groups = (indice or IndicePares(saved_files)).completos()
+            indices = {base_name: i for i, base_name in enumerate(file_groups)}
+            entradas = dict(file_groups)
+        else:
+            indices, entradas = {}, {}
+
+            def numerar(grupos):
+                for base_name, archivos in grupos:
+                    indices[base_name] = len(indices)
+                    entradas[base_name] = archivos
+                    yield base_name, archivos
+
+            file_groups = numerar(grupos)
+
+        documentos, usados = {}, set()
+
+        def al_terminar(resultado):
+            artefacto = None
+            if resultado['pdf']:
+                archivos = entradas[resultado['nombre']]
+                metadatos = _metadatos_cfdi(archivos)
+                nombre = os.path.basename(resultado['pdf'])
+                if plantilla:
+                    cfdi = next((m for m in metadatos.values() if m), {})
+                    nombre = nombre_desde_plantilla(plantilla, dict(cfdi, base=resultado['nombre']),
+                                                    os.path.splitext(nombre)[0]) + '.pdf'
+                artefacto = (resultado['pdf'], _nombre_unico(nombre, usados))
+                resultado['artefacto'] = artefacto
+                documentos[indices[resultado['nombre']]] = _documento_manifiesto(
+                    artefacto[1], _entradas_manifiesto(archivos, metadatos), resultado.get('paginas'))
+            if job:
+                job.registrar_archivo(resultado['nombre'], resultado['segundos'], resultado['error'])
+                job.publicar(indices[resultado['nombre']], artefacto)
+
+        for resultado in processor.procesar_pares(file_groups, output_dir, grayscale=grayscale,
+                                                  al_terminar=al_terminar):
+            if resultado['error']:
+                app.logger.error(f"Error procesando grupo {resultado['nombre']}: {resultado['error']}")
+                continue
+            combined_pdfs.append(resultado['artefacto'])
+        if combined_pdfs:
+            combined_pdfs.append(_escribir_manifiesto(output_dir, modo, None,
+                                                      [documentos.get(i) for i in range(len(indices))]))
+            if job:
+                job.publicar(len(indices), combined_pdfs[-1])
+
+    else:
+        output_name = f"{custom_name}.pdf" if custom_name else "documento_completo.pdf"
+
+        def progreso(archivo, segundos, error):
+            if job:
+                job.registrar_archivo(nombre_archivo(archivo), segundos, error)
+
+        metadatos = _metadatos_cfdi(saved_files)
+        if orden:
+            saved_files = ordenar_por_cfdi(saved_files, orden, metadatos)
+
+        output_path = os.path.join(output_dir, f"opt_{output_name}")
+        if bundle_id:
+            processed_pdf, manifiesto = processor.combinar_incremental(
+                saved_files, output_path, grayscale=grayscale, anterior=bundle_store.obtener(bundle_id),
+                progreso=progreso
+            )
+            if processed_pdf:
+                bundle_store.guardar(bundle_id, processed_pdf, manifiesto)
+        else:
+            processed_pdf = processor.combinar_y_optimizar(
+                saved_files,
+                output_path,
+                modo="completo",
+                grayscale=grayscale,
+                progreso=progreso
+            )
+        if not processed_pdf:
+            app.logger.error("Error combinando archivos: No se pudo crear el PDF combinado")
+            raise ErrorProcesamiento('Error al combinar archivos: No se pudo crear el PDF combinado')
+        combined_pdfs.append((processed_pdf, os.path.basename(processed_pdf)))
+        combined_pdfs.append(_escribir_manifiesto(output_dir, modo, orden, [
+            _documento_manifiesto(combined_pdfs[0][1], _entradas_manifiesto(saved_files, metadatos),
+                                  processor.reporte_paginas)
+        ]))
+        if job:
+            job.publicar(0, combined_pdfs[0])
+            job.publicar(1, combined_pdfs[1])
+
+    if not combined_pdfs:
+        raise ErrorProcesamiento('No se pudieron procesar los archivos')
+
+    return combined_pdfs
+
+
+def _respuesta_job(job, status=200):
+    return jsonify({
+        **job.to_dict(),
+        'status_url': f"/jobs/{job.id}",
+        'download_url': f"/jobs/{job.id}/download",
+        'preview_url': f"/jobs/{job.id}/previews",
+    }), status
+
+
+def _metricas_cache():
+    """Contadores de la caché de resultados y de la de miniaturas en formato Prometheus"""
+    lineas = []
+    caches = [('preview_cache', previsualizaciones.estadisticas(), ('hits', 'misses'))]
+    if result_cache is not None:
+        caches.insert(0, ('cache', result_cache.estadisticas(), ('hits', 'misses', 'evictions')))
+    for prefijo, stats, contadores in caches:
+        for clave in contadores + ('bytes', 'max_bytes'):
+            tipo = 'counter' if clave in contadores else 'gauge'
+            nombre = f"xmlpdf_{prefijo}_{clave}_total" if tipo == 'counter' else f"xmlpdf_{prefijo}_{clave}"
+            lineas.append(f"# TYPE {nombre} {tipo}")
+            lineas.append(f"{nombre} {stats[clave]}")
+    return "\n".join(lineas) + "\n"
+
+
+@app.route('/metrics')
+def metrics():
+    """Histogramas y contadores por etapa (formato de texto de Prometheus), por proceso"""
+    return Response(metricas.exportar() + _metricas_cache(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/upload', methods=['POST'])
+def upload_files():
+    # Con timings=1 (formulario o query string) la respuesta incluye el desglose por etapa
+    with metricas.traza() as traza:
+        inicio = time.perf_counter()
+        respuesta = _upload_files()
+    if request.values.get('timings') in ('1', 'true') and isinstance(respuesta, Response):
+        datos = respuesta.get_json()
+        datos['tiempos'] = {
+            'total_segundos': round(time.perf_counter() - inicio, 4),
+            'etapas': traza.resumen(),
+        }
+        respuesta = jsonify(datos)
+    return respuesta
+
+
+def _upload_files():
+    global last_job_id
+    parametros, error = _leer_solicitud()
+    if error:
+        return error
+
+    modo = parametros['modo']
+    color_mode = parametros['color_mode']
+    custom_name = parametros['custom_name']
+    temp_dir = parametros['temp_dir']
+    bundle_id = parametros['bundle_id']
+
+    try:
+        combined_pdfs = procesar_lote(
+            parametros['saved_files'], temp_dir, modo, color_mode == 'grayscale', custom_name, bundle_id=bundle_id,
+            indice=parametros['indice'], orden=parametros['orden'], plantilla=parametros['plantilla'],
+            presupuesto=parametros['presupuesto']
+        )
+    except ErrorProcesamiento as e:
+        cleanup_temp_files(temp_dir)
+        return jsonify({'error': str(e)}), 500
+    except Exception as e:
+        cleanup_temp_files(temp_dir)
+        app.logger.error(f'Error inesperado: {str(e)}')
+        return jsonify({'error': f'Error inesperado: {str(e)}'}), 500
+
+    # El resultado queda asociado a un trabajo propio; el planificador lo expira
+    filename = _nombre_zip(modo, custom_name)
+    job = job_manager.registrar(temp_dir, combined_pdfs, modo=modo, color_mode=color_mode, filename=filename)
+    last_job_id = job.id
+
+    respuesta = {
+        'success': True,
+        'filename': filename,
+        'modo': modo,
+        'custom_name_used': bool(custom_name),
+        'color_mode': color_mode,
+        'job_id': job.id,
+        'download_url': f"/jobs/{job.id}/download",
+        'preview_url': f"/jobs/{job.id}/previews"
+    }
+    if bundle_id:
+        respuesta['bundle_id'] = bundle_id
+    return jsonify(respuesta)
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    parametros, error = _leer_solicitud()
+    if error:
+        return error
+
+    modo = parametros['modo']
+    color_mode = parametros['color_mode']
+    custom_name = parametros['custom_name']
+    temp_dir = parametros['temp_dir']
+    saved_files = parametros['saved_files']
+    bundle_id = parametros['bundle_id']
+    indice = parametros['indice']
+
+    def tarea(job):
+        return procesar_lote(saved_files, temp_dir, modo, color_mode == 'grayscale', custom_name, job=job,
+                             bundle_id=bundle_id, indice=indice, orden=parametros['orden'],
+                             plantilla=parametros['plantilla'], presupuesto=parametros['presupuesto'])
+
+    info = {'bundle_id': bundle_id} if bundle_id else {}
+    try:
+        job = job_manager.enviar(
+            tarea, temp_dir, _nombres_progreso(modo, saved_files, indice),
+            modo=modo, color_mode=color_mode, custom_name_used=bool(custom_name),
+            filename=_nombre_zip(modo, custom_name), **info
+        )
+    except ColaLlenaError as e:
+        cleanup_temp_files(temp_dir)
+        return jsonify({'error': str(e)}), 503
+
+    return _respuesta_job(job, 202)
+
+
+def _respuesta_subida(sesion, job, status=200):
+    return jsonify({
+        **sesion.to_dict(),
+        'upload_url': f"/uploads/{sesion.id}",
+        'job_id': job.id,
+        'status_url': f"/jobs/{job.id}",
+        'download_url': f"/jobs/{job.id}/download",
+        **({'bundle_id': job.info['bundle_id']} if job.info.get('bundle_id') else {}),
+    }), status
+
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """Inicia una subida por partes
+
+    Recibe JSON con las opciones de /jobs y `archivos`: [{"nombre", "tamano"}, ...]. Cada
+    archivo se envía luego con PUT /uploads/<id>/files/<indice> en uno o más fragmentos
+    (cabecera Content-Range); GET /uploads/<id> indica cuánto se recibió para reanudar.
+    El trabajo asociado empieza a convertir cada par en cuanto sus dos archivos llegan.
+    """
+    datos = request.get_json(silent=True) or {}
+    parametros = _leer_opciones(datos)
+    modo = parametros['modo']
+    archivos = [a for a in datos.get('archivos') or [] if isinstance(a, dict) and allowed_file(a.get('nombre'))]
+    if not archivos:
+        return jsonify({'error': 'Debes subir al menos 1 archivo válido'}), 400
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        sesion = gestor_subidas.crear(temp_dir, modo, [(a['nombre'], a.get('tamano')) for a in archivos])
+    except ErrorSubida as e:
+        cleanup_temp_files(temp_dir)
+        return jsonify({'error': str(e)}), e.status
+    # Con PAIR_BY_UUID los archivos sin par por nombre se emparejan al terminar la subida
+    if modo == 'pares' and not app.config['PAIR_BY_UUID']:
+        is_valid, message = sesion.indice.validar()
+        if not is_valid:
+            sesion.cancelar()
+            cleanup_temp_files(temp_dir)
+            return jsonify({'error': message, 'huerfanos': sesion.indice.huerfanos()}), 400
+
+    grayscale = parametros['color_mode'] == 'grayscale'
+    custom_name = parametros['custom_name']
+    bundle_id = parametros['bundle_id']
+
+    def tarea(job):
+        if modo == 'pares':
+            return procesar_lote(sesion.rutas(), temp_dir, modo, grayscale, custom_name, job=job,
+                                 grupos=sesion.pares(por_uuid=app.config['PAIR_BY_UUID']),
+                                 plantilla=parametros['plantilla'], presupuesto=parametros['presupuesto'])
+        return procesar_lote(sesion.rutas(), temp_dir, modo, grayscale, custom_name, job=job,
+                             bundle_id=bundle_id, orden=parametros['orden'], presupuesto=parametros['presupuesto'])
+
+    # Mientras se espera a la red el trabajo no ocupa un worker del JobManager: en modo pares
+    # se consume la subida en un hilo propio (cada par va al pool de procesos al llegar) y en
+    # modo completo el trabajo entra al pool cuando llegan todos los archivos
+    info = dict(modo=modo, color_mode=parametros['color_mode'], custom_name_used=bool(custom_name),
+                filename=_nombre_zip(modo, custom_name), upload_id=sesion.id)
+    if bundle_id:
+        info['bundle_id'] = bundle_id
+    nombres = _nombres_progreso(modo, sesion.rutas(), sesion.indice)
+    try:
+        if modo == 'pares':
+            job = job_manager.ejecutar_en_hilo(tarea, temp_dir, nombres, **info)
+        else:
+            job = job_manager.enviar(tarea, temp_dir, nombres, esperar=sesion.esperar, **info)
+    except ColaLlenaError as e:
+        sesion.cancelar()
+        cleanup_temp_files(temp_dir)
+        return jsonify({'error': str(e)}), 503
+    sesion.job = job
+    return _respuesta_subida(sesion, job, 201)
+
+
+def _obtener_subida(upload_id):
+    sesion = gestor_subidas.obtener(upload_id)
+    if not sesion:
+        return None, (jsonify({'error': 'Subida no encontrada o expirada'}), 404)
+    return sesion, None
+
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    sesion, error = _obtener_subida(upload_id)
+    if error:
+        return error
+    return _respuesta_subida(sesion, sesion.job)
+
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    """Cancela la subida; el trabajo termina con error y su directorio expira con él"""
+    sesion, error = _obtener_subida(upload_id)
+    if error:
+        return error
+    sesion.cancelar()
+    return _respuesta_subida(sesion, sesion.job)
+
+
+@app.route('/uploads/<upload_id>/files/<int:indice>', methods=['PUT'])
+def upload_chunk(upload_id, indice):
+    """Recibe un fragmento de un archivo; sin Content-Range es el archivo completo desde el byte 0"""
+    sesion, error = _obtener_subida(upload_id)
+    if error:
+        return error
+    inicio = 0
+    if request.headers.get('Content-Range'):
+        rango = parse_content_range_header(request.headers['Content-Range'])
+        if rango is None or rango.units != 'bytes' or rango.start is None:
+            return jsonify({'error': 'Cabecera Content-Range no válida'}), 400
+        inicio = rango.start
+
+    try:
+        with metricas.medir("save") as span:
+            recibidos = sesion.escribir(indice, inicio, request.stream)
+            span.bytes_entrada = span.bytes_salida = recibidos - inicio
+    except ErrorSubida as e:
+        estado = sesion.to_dict()
+        archivo = estado['archivos'][indice] if 0 <= indice < len(estado['archivos']) else None
+        return jsonify({'error': str(e), 'archivo': archivo, 'estado': estado['estado']}), e.status
+    archivo = sesion.to_dict()['archivos'][indice]
+    return jsonify({'archivo': archivo, 'completo': archivo['recibidos'] == archivo['tamano']})
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_manager.obtener(job_id)
+    if not job:
+        return jsonify({'error': 'Trabajo no encontrado o expirado'}), 404
+    return _respuesta_job(job)
+
+
+def _stream_zip(job, filename=None):
+    """Envía el ZIP del trabajo en streaming; si aún está en proceso, cada PDF se
+    agrega al archivo en cuanto termina"""
+    def generar():
+        yield from generar_zip(job.iter_artefactos())
+        if job.estado == 'error':
+            # Cortar la respuesta para que el cliente no reciba un ZIP vacío como válido
+            raise ErrorProcesamiento(job.error)
+
+    return Response(
+        generar(),
+        mimetype='application/zip',
+        headers={'Content-Disposition': content_disposition(filename or job.info.get('filename', 'documentos.zip'))}
+    )
+
+
+@app.route('/jobs/<job_id>/download', methods=['GET'])
+def job_download(job_id):
+    job = job_manager.obtener(job_id)
+    if not job:
+        return jsonify({'error': 'Trabajo no encontrado o expirado'}), 404
+    if job.estado == 'error':
+        return jsonify({'error': job.error}), 500
+    return _stream_zip(job, request.args.get('filename'))
+
+
+def _pdf_del_job(job_id, archivo):
+    """(ruta del PDF generado `archivo` del trabajo, None) o (None, respuesta de error)"""
+    job = job_manager.obtener(job_id)
+    if not job:
+        return None, (jsonify({'error': 'Trabajo no encontrado o expirado'}), 404)
+    ruta = job.artefacto(archivo) if archivo.lower().endswith('.pdf') else None
+    if not ruta or not os.path.isfile(ruta):
+        return None, (jsonify({'error': f'El trabajo no tiene el PDF {archivo}'}), 404)
+    return ruta, None
+
+
+@app.route('/jobs/<job_id>/previews', methods=['GET'])
+def job_previews(job_id):
+    """PDF del trabajo con miniaturas disponibles (los ya terminados si aún está en proceso)"""
+    job = job_manager.obtener(job_id)
+    if not job:
+        return jsonify({'error': 'Trabajo no encontrado o expirado'}), 404
+    return jsonify({
+        'job_id': job.id,
+        'estado': job.estado,
+        'archivos': [{'archivo': nombre, 'url': f"/jobs/{job.id}/previews/{nombre}"}
+                     for nombre in job.nombres_artefactos() if nombre.lower().endswith('.pdf')],
+    })
+
+
+@app.route('/jobs/<job_id>/previews/<archivo>', methods=['GET'])
+def pdf_previews(job_id, archivo):
+    """Número de páginas de un PDF del trabajo y la URL de la miniatura de cada una
+
+    Solo se cuenta las páginas; cada miniatura se renderiza cuando se pide su URL.
+    """
+    ruta, error = _pdf_del_job(job_id, archivo)
+    if error:
+        return error
+    try:
+        paginas = previsualizaciones.paginas(ruta)
+    except Exception as e:
+        return jsonify({'error': f'No se pudo abrir {archivo}: {str(e)}'}), 500
+    ancho = request.args.get('ancho', app.config['PREVIEW_WIDTH'], type=int)
+    sufijo = f"?ancho={ancho}" if 'ancho' in request.args else ''
+    return jsonify({
+        'archivo': archivo,
+        'paginas': paginas,
+        'ancho': previsualizaciones.ancho(ancho),
+        'miniaturas': [f"/jobs/{job_id}/previews/{archivo}/{pagina}.png{sufijo}" for pagina in range(1, paginas + 1)],
+    })
+
+
+@app.route('/jobs/<job_id>/previews/<archivo>/<int:pagina>.png', methods=['GET'])
+def page_preview(job_id, archivo, pagina):
+    """Miniatura PNG de la página `pagina` (desde 1); `ancho` en píxeles (PREVIEW_WIDTH por defecto)
+
+    Responde 304 si el ETag enviado en If-None-Match sigue vigente, sin renderizar.
+    """
+    ruta, error = _pdf_del_job(job_id, archivo)
+    if error:
+        return error
+    ancho = request.args.get('ancho', app.config['PREVIEW_WIDTH'], type=int)
+    # Mientras el trabajo exista el PDF no cambia; el navegador puede reutilizar la imagen
+    cache_control = f"private, max-age={app.config['JOB_TTL']}"
+    try:
+        etag = previsualizaciones.etag(ruta, pagina - 1, ancho)
+        if etag in request.if_none_match:
+            return Response(status=304, headers={'ETag': f'"{etag}"', 'Cache-Control': cache_control})
+        data, etag = previsualizaciones.miniatura(ruta, pagina - 1, ancho)
+    except IndexError as e:
+        return jsonify({'error': f'Página {pagina} no válida: {str(e)}'}), 404
+    except Exception as e:
+        app.logger.error(f'Error generando la miniatura de {archivo}: {str(e)}')
+        return jsonify({'error': f'No se pudo generar la miniatura: {str(e)}'}), 500
+    return Response(data, mimetype='image/png', headers={'ETag': f'"{etag}"', 'Cache-Control': cache_control})
+
+
+@app.route('/download', methods=['GET'])
+def download_file():
+    """Descarga el último resultado; se mantiene por compatibilidad, usar /jobs/<id>/download"""
+    job = job_manager.obtener(last_job_id) if last_job_id else None
+    if not job:
+        return jsonify({'error': 'No hay archivos para descargar'}), 404
+    
+    return _stream_zip(job, request.args.get('filename'))
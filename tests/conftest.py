@@ -0,0 +1,55 @@
+import os
+import sys
+
+import fitz  # PyMuPDF
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# La app se configura al importarse: sin caché ni lotes guardados entre pruebas
+os.environ.setdefault("CACHE_DIR", "")
+os.environ.setdefault("BUNDLE_DIR", "")
+
+
+def escribir_pdf(ruta, paginas=1, texto="Factura"):
+    doc = fitz.open()
+    for p in range(paginas):
+        page = doc.new_page()
+        page.insert_text((50, 60), f"{texto} - página {p + 1}", fontsize=14)
+    doc.save(ruta)
+    doc.close()
+    return ruta
+
+
+def escribir_xml(ruta, folio=1, rfc="AAA010101AAA"):
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<cfdi:Comprobante xmlns:cfdi="http://www.sat.gob.mx/cfd/4" Version="4.0" Serie="A" '
+            f'Folio="{folio}" Fecha="2024-01-{folio:02d}T10:00:00" Total="{folio * 100}.00">\n'
+            f'  <cfdi:Emisor Rfc="{rfc}" Nombre="Emisor"/>\n'
+            '  <cfdi:Receptor Rfc="XAXX010101000" Nombre="Receptor"/>\n'
+            '</cfdi:Comprobante>\n'
+        )
+    return ruta
+
+
+@pytest.fixture
+def lote(tmp_path):
+    """Crea `n` pares factura_XXXXX.pdf + .xml en `directorio` (tmp_path por defecto)"""
+    def crear(n=2, directorio=None, paginas=1):
+        directorio = directorio or tmp_path / "entrada"
+        os.makedirs(directorio, exist_ok=True)
+        rutas = []
+        for i in range(n):
+            base = os.path.join(directorio, f"factura_{i:05d}")
+            rutas.append(escribir_pdf(f"{base}.pdf", paginas=paginas, texto=f"Factura {i}"))
+            rutas.append(escribir_xml(f"{base}.xml", folio=i + 1))
+        return rutas
+    return crear
+
+
+@pytest.fixture
+def cliente():
+    import main
+    return main.app.test_client()
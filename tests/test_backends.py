@@ -0,0 +1,32 @@
+import os
+
+import fitz  # PyMuPDF
+import pytest
+
+from converters.pdf_processor import PDFProcessor
+
+
+def _paginas(ruta):
+    with fitz.open(ruta) as doc:
+        return [" ".join(page.get_text().split()) for page in doc]
+
+
+@pytest.mark.parametrize("modo", ["pares", "completo"])
+@pytest.mark.parametrize("grayscale", [False, True])
+def test_fitz_igual_que_la_cadena_pypdf2(tmp_path, lote, modo, grayscale):
+    archivos = lote(3, paginas=2)
+    salidas = {}
+    for backend in ("fitz", "pypdf2"):
+        processor = PDFProcessor(temp_dir=str(tmp_path / f"tmp_{backend}"), max_workers=1, backend=backend)
+        salidas[backend] = processor.combinar_y_optimizar(archivos, str(tmp_path / f"{backend}.pdf"), modo=modo,
+                                                          grayscale=grayscale)
+        assert salidas[backend]
+    assert _paginas(salidas["fitz"]) == _paginas(salidas["pypdf2"])
+
+
+def test_fitz_no_escribe_intermedios(tmp_path, lote):
+    temp_dir = tmp_path / "tmp"
+    processor = PDFProcessor(temp_dir=str(temp_dir), max_workers=1)
+    assert processor.combinar_y_optimizar(lote(2), str(tmp_path / "salida.pdf"), modo="pares", grayscale=True)
+    # Cada entrada se lee una vez y solo se escribe el resultado final
+    assert not os.path.exists(temp_dir)
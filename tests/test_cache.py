@@ -0,0 +1,45 @@
+import os
+import shutil
+
+from converters.pdf_processor import PDFProcessor
+from utils.cache import ResultCache
+
+
+def test_clave_por_contenido_y_parametros(tmp_path, lote):
+    cache = ResultCache(str(tmp_path / "cache"))
+    xml = lote(1)[1]
+    copia = shutil.copyfile(xml, str(tmp_path / "otro_nombre.xml"))
+
+    assert cache.clave([xml], grayscale=True) == cache.clave([copia], grayscale=True)
+    assert cache.clave([xml], grayscale=True) != cache.clave([xml], grayscale=False)
+    with open(copia, "a", encoding="utf-8") as f:
+        f.write("<!-- cambio -->")
+    assert cache.clave([xml], grayscale=True) != cache.clave([copia], grayscale=True)
+
+
+def test_desaloja_lo_usado_hace_mas_tiempo(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=2500)
+    claves = [f"{i:02d}" + "0" * 62 for i in range(3)]
+    for i, clave in enumerate(claves):
+        ruta = cache.guardar_bytes(clave, b"x" * 1000)
+        os.utime(ruta, (1000 + i, 1000 + i))
+    # Al pasar el límite con la tercera, la más antigua (la primera) sale
+    assert cache.obtener(claves[0]) is None
+    assert cache.leer(claves[1]) == b"x" * 1000
+    assert cache.obtener(claves[2])
+
+    estadisticas = cache.estadisticas()
+    assert estadisticas['evictions'] == 1
+    assert (estadisticas['hits'], estadisticas['misses']) == (2, 1)
+    assert estadisticas['bytes'] <= 2500
+
+
+def test_combinar_archivos_reutiliza_los_xml_convertidos(tmp_path, lote):
+    cache = ResultCache(str(tmp_path / "cache"))
+    archivos = lote(2)
+    processor = PDFProcessor(temp_dir=str(tmp_path / "tmp"), max_workers=1, backend="pypdf2", cache=cache)
+
+    assert processor.combinar_archivos(archivos, str(tmp_path / "uno.pdf"))
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert processor.combinar_archivos(archivos, str(tmp_path / "dos.pdf"))
+    assert (cache.hits, cache.misses) == (2, 2)
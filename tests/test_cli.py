@@ -0,0 +1,56 @@
+import os
+
+import fitz  # PyMuPDF
+
+import cli
+
+
+def test_recursivo_no_mezcla_pares_con_el_mismo_nombre(tmp_path, lote):
+    entrada = tmp_path / "facturas"
+    lote(1, directorio=entrada / "ene", paginas=2)
+    lote(1, directorio=entrada / "feb", paginas=3)
+    salida = tmp_path / "salida"
+
+    assert cli.main([str(entrada), str(salida), "--recursivo", "--workers", "1"]) == 0
+
+    for mes, paginas in (("ene", 2), ("feb", 3)):
+        ruta = salida / mes / "opt_factura_00000.pdf"
+        assert ruta.is_file()
+        with fitz.open(ruta) as doc:
+            # Las páginas del PDF más las del XML convertido (una página)
+            assert doc.page_count == paginas + 1
+    assert not (salida / "opt_factura_00000.pdf").exists()
+
+
+def test_directorio_plano_conserva_la_salida(tmp_path, lote):
+    lote(2)
+    salida = tmp_path / "salida"
+    assert cli.main([str(tmp_path / "entrada"), str(salida), "--workers", "1"]) == 0
+    assert sorted(os.listdir(salida)) == ["opt_factura_00000.pdf", "opt_factura_00001.pdf"]
+
+
+def _paginas(ruta):
+    with fitz.open(ruta) as doc:
+        return doc.page_count
+
+
+def test_completo_se_rehace_al_quitar_una_entrada(tmp_path, lote, capsys):
+    rutas = lote(3)
+    entrada, salida = tmp_path / "entrada", tmp_path / "salida"
+    argumentos = [str(entrada), str(salida), "--modo", "completo", "--workers", "1"]
+    destino = salida / "opt_documento_completo.pdf"
+
+    assert cli.main(argumentos) == 0
+    assert _paginas(destino) == 6
+    assert cli.main(argumentos) == 0
+    assert "ya está al día" in capsys.readouterr().out
+
+    # Quitar un par deja el PDF más nuevo que las entradas restantes: no debe omitirse
+    for ruta in rutas[2:4]:
+        os.remove(ruta)
+    assert cli.main(argumentos) == 0
+    assert "ya está al día" not in capsys.readouterr().out
+    assert _paginas(destino) == 4
+    with fitz.open(destino) as doc:
+        texto = "".join(page.get_text() for page in doc)
+    assert "Factura 1" not in texto and "factura_00001" not in texto
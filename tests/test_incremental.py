@@ -0,0 +1,68 @@
+import os
+
+import fitz  # PyMuPDF
+
+from converters.pdf_optimizer import reutilizar_recursos
+from converters.pdf_processor import PDFProcessor
+from utils.bundles import BundleStore
+from tests.conftest import escribir_pdf
+
+
+def _texto(ruta):
+    with fitz.open(ruta) as doc:
+        return "".join(page.get_text() for page in doc)
+
+
+def test_xml_renombrado_se_regenera(tmp_path, lote):
+    archivos = lote(3)
+    processor = PDFProcessor(temp_dir=str(tmp_path / "tmp"), max_workers=1)
+    primero, manifiesto = processor.combinar_incremental(archivos, str(tmp_path / "v1" / "completo.pdf"))
+    assert primero and "factura_00000" in _texto(primero)
+
+    # Mismo contenido, otro nombre: el tramo del XML debe rehacerse con el nombre nuevo
+    xml = archivos[1]
+    renombrado = os.path.join(os.path.dirname(xml), "renombrada.xml")
+    os.rename(xml, renombrado)
+    archivos[1] = renombrado
+    segundo, manifiesto = processor.combinar_incremental(
+        archivos, str(tmp_path / "v2" / "completo.pdf"), anterior=(primero, manifiesto)
+    )
+    completo = processor.combinar_incremental(archivos, str(tmp_path / "v3" / "completo.pdf"))[0]
+
+    assert "Archivo: renombrada" in _texto(segundo)
+    assert "Archivo: factura_00000" not in _texto(segundo)
+    assert _texto(segundo) == _texto(completo)
+    assert [s['nombre'] for s in manifiesto['segmentos']][1] == "renombrada.xml"
+
+
+def test_paginas_nuevas_reutilizan_las_fuentes(tmp_path):
+    ruta = escribir_pdf(str(tmp_path / "anterior.pdf"), paginas=2)
+    nuevo = escribir_pdf(str(tmp_path / "nuevo.pdf"))
+    with fitz.open(ruta) as doc, fitz.open(nuevo) as tramo:
+        fuente = doc[0].get_fonts()[0][0]
+        primer_xref = doc.xref_length()
+        doc.insert_pdf(tramo)
+        pagina = doc.page_xref(2)
+        # Un string con forma de referencia a la copia no debe cambiar
+        copia = doc[2].get_fonts()[0][0]
+        doc.xref_set_key(pagina, "Nota", f"({copia} 0 R)")
+
+        reutilizados, _ = reutilizar_recursos(doc, primer_xref)
+        assert reutilizados >= 1
+        assert doc[2].get_fonts()[0][0] == fuente
+        assert doc.xref_get_key(pagina, "Nota") == ("string", f"{copia} 0 R")
+        assert "página 1" in doc[2].get_text()
+
+
+def test_bundle_conserva_el_pdf_anterior_hasta_el_siguiente_guardado(tmp_path):
+    store = BundleStore(str(tmp_path / "lotes"))
+    lote = store.nuevo_id()
+    versiones = []
+    for i in range(3):
+        store.guardar(lote, escribir_pdf(str(tmp_path / f"v{i}.pdf"), texto=f"Version {i}"), {'segmentos': []})
+        versiones.append(store.obtener(lote)[0])
+
+    # Quien leyó el manifiesto antes del último guardado aún puede abrir su PDF
+    assert os.path.isfile(versiones[1]) and os.path.isfile(versiones[2])
+    assert not os.path.exists(versiones[0])
+    assert "Version 2" in _texto(versiones[2])
@@ -0,0 +1,86 @@
+import io
+import os
+import threading
+import time
+import zipfile
+
+import pytest
+
+from utils.jobs import ColaLlenaError, JobManager
+
+
+def _esperar(condicion, segundos=10):
+    limite = time.time() + segundos
+    while not condicion() and time.time() < limite:
+        time.sleep(0.02)
+    return condicion()
+
+
+def test_cola_acotada(tmp_path):
+    manager = JobManager(max_workers=1, max_cola=1)
+    liberar = threading.Event()
+    primero = manager.enviar(lambda job: liberar.wait(), str(tmp_path / "a"), ["a.pdf"])
+    segundo = manager.enviar(lambda job: "listo", str(tmp_path / "b"), ["b.pdf"])
+    with pytest.raises(ColaLlenaError):
+        manager.enviar(lambda job: None, str(tmp_path / "c"), ["c.pdf"])
+
+    assert _esperar(lambda: primero.estado == 'procesando')
+    assert segundo.estado == 'en_cola'
+    liberar.set()
+    assert _esperar(lambda: segundo.estado == 'completado')
+    assert segundo.resultado == "listo"
+    assert manager.enviar(lambda job: None, str(tmp_path / "d"), ["d.pdf"])
+
+
+def test_progreso_por_archivo_y_error(tmp_path):
+    manager = JobManager(max_workers=1)
+
+    def tarea(job):
+        job.registrar_archivo("a.pdf", segundos=0.5)
+        raise ValueError("falló b.xml")
+
+    job = manager.enviar(tarea, str(tmp_path), ["a.pdf", "b.xml"], modo="pares")
+    assert _esperar(lambda: job.estado == 'error')
+    estado = job.to_dict()
+    assert estado['progreso'] == {'terminados': 1, 'total': 2}
+    assert estado['archivos']['a.pdf'] == {'estado': 'completado', 'segundos': 0.5, 'error': None}
+    assert estado['error'] == "falló b.xml"
+    assert estado['modo'] == "pares"
+
+
+def test_expiracion_con_un_solo_planificador(tmp_path, monkeypatch):
+    monkeypatch.setattr(threading, "Timer", None)  # Ya no se crea un Timer por trabajo
+    manager = JobManager(max_workers=1, ttl=0.1)
+    directorios = []
+    for i in range(3):
+        directorio = tmp_path / f"job{i}"
+        directorio.mkdir()
+        directorios.append(directorio)
+        manager.registrar(str(directorio), [])
+    assert _esperar(lambda: not any(d.exists() for d in directorios))
+    assert not manager._jobs
+
+
+def test_api_de_trabajos(cliente, lote):
+    rutas = lote(2)
+    handles = [open(ruta, 'rb') for ruta in rutas]
+    try:
+        respuesta = cliente.post('/jobs', data={'modo': 'pares', 'color_mode': 'color',
+                                                'files': [(h, os.path.basename(h.name)) for h in handles]},
+                                 content_type='multipart/form-data')
+    finally:
+        for h in handles:
+            h.close()
+    assert respuesta.status_code == 202
+    datos = respuesta.get_json()
+
+    assert _esperar(lambda: cliente.get(datos['status_url']).get_json()['estado'] == 'completado', 60)
+    estado = cliente.get(datos['status_url']).get_json()
+    assert estado['progreso'] == {'terminados': 2, 'total': 2}
+    assert all(archivo['segundos'] is not None for archivo in estado['archivos'].values())
+
+    descarga = cliente.get(datos['download_url'])
+    assert descarga.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(descarga.data)) as zf:
+        assert sorted(zf.namelist()) == ['manifiesto.json', 'opt_factura_00000.pdf', 'opt_factura_00001.pdf']
+    assert cliente.get('/jobs/no-existe').status_code == 404
@@ -0,0 +1,195 @@
+import io
+import os
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from converters import pdf_optimizer
+from converters.pdf_processor import PDFProcessor
+from tests.conftest import escribir_pdf, escribir_xml
+
+INDICE = [[1, "Inicio", 1], [2, "Mitad", 20], [1, "Final", 40]]
+
+
+def _pdf_con_indice(ruta, paginas=40):
+    escribir_pdf(ruta, paginas=paginas)
+    with fitz.open(ruta) as doc:
+        doc.set_toc(INDICE)
+        doc.saveIncr()
+    return ruta
+
+
+def _combinar(tmp_path, entrada, workers, nombre):
+    processor = PDFProcessor(temp_dir=str(tmp_path / f"tmp_{nombre}"), max_workers=workers)
+    salida = processor.combinar_y_optimizar([entrada], str(tmp_path / f"{nombre}.pdf"), modo="completo",
+                                            grayscale=True)
+    assert salida
+    with fitz.open(salida) as doc:
+        return doc.page_count, [entrada[:3] for entrada in doc.get_toc()], doc[39].get_text()
+
+
+def test_pdf_grande_se_reparte_entre_procesos(tmp_path, monkeypatch):
+    # Con el umbral real, 40 páginas de texto no se reparten
+    monkeypatch.setattr(pdf_optimizer, "PAGINAS_MIN_RANGO", 8)
+    entrada = _pdf_con_indice(str(tmp_path / "grande.pdf"))
+    llamadas = []
+    original = pdf_optimizer._optimizar_en_paralelo
+
+    def registrar(*args):
+        llamadas.append(args[2])
+        return original(*args)
+
+    monkeypatch.setattr(pdf_optimizer, "_optimizar_en_paralelo", registrar)
+    paralelo = _combinar(tmp_path, entrada, 2, "paralelo")
+    assert llamadas == [2]
+
+    serie = _combinar(tmp_path, entrada, 1, "serie")
+    assert llamadas == [2]
+    assert paralelo == serie
+    assert paralelo[0] == 40
+
+
+def test_grises_en_serie_conserva_el_indice(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_optimizer, "PAGINAS_MIN_RANGO", 8)
+    entrada = _pdf_con_indice(str(tmp_path / "grande.pdf"))
+    for workers in (1, 2):
+        salida = pdf_optimizer.optimize_pdf_size(entrada, str(tmp_path / f"w{workers}"), grayscale=True,
+                                                 workers=workers)
+        with fitz.open(salida) as doc:
+            assert [entrada[:3] for entrada in doc.get_toc()] == INDICE
+
+
+def test_reparto_segun_paginas_e_imagenes(tmp_path, monkeypatch):
+    with fitz.open(_pdf_con_indice(str(tmp_path / "texto.pdf"))) as doc:
+        assert pdf_optimizer._reparto(doc, 2)[0] == 1
+
+    doc = fitz.open()
+    for color in ((200, 120, 40), (40, 120, 200)):
+        jpeg = io.BytesIO()
+        Image.new("RGB", (600, 600), color).save(jpeg, "JPEG")
+        doc.new_page().insert_image(fitz.Rect(72, 72, 288, 288), stream=jpeg.getvalue())
+    imagenes = pdf_optimizer.bytes_imagenes(doc)
+    # Dos páginas se reparten solo si sus imágenes alcanzan para dos rangos
+    monkeypatch.setattr(pdf_optimizer, "BYTES_IMAGENES_MIN_RANGO", imagenes // 2)
+    assert pdf_optimizer._reparto(doc, 2) == (2, 2)
+    monkeypatch.setattr(pdf_optimizer, "BYTES_IMAGENES_MIN_RANGO", imagenes // 2 + 1)
+    assert pdf_optimizer._reparto(doc, 2) == (1, 1)
+    doc.close()
+
+
+def _pdf_con_imagen(ruta):
+    """Una página con una foto de 1200x1200 px en 3x3 pulgadas (400 DPI)"""
+    img = Image.new("RGB", (1200, 1200), (200, 120, 40))
+    img.paste((30, 90, 200), (0, 0, 600, 600))
+    jpeg = io.BytesIO()
+    img.save(jpeg, "JPEG", quality=95)
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_image(fitz.Rect(72, 72, 288, 288), stream=jpeg.getvalue())
+    page.insert_text((72, 320), "Factura con logotipo", fontsize=12)
+    doc.save(ruta)
+    doc.close()
+    return ruta
+
+
+def test_presupuesto_reduce_imagenes_en_color(tmp_path):
+    entrada = _pdf_con_imagen(str(tmp_path / "foto.pdf"))
+    tamanos = {}
+    for presupuesto in (None, "tamano"):
+        processor = PDFProcessor(temp_dir=str(tmp_path / f"tmp_{presupuesto}"), max_workers=1,
+                                 presupuesto=presupuesto)
+        salida = processor.combinar_y_optimizar([entrada], str(tmp_path / f"{presupuesto}.pdf"), modo="completo")
+        with fitz.open(salida) as doc:
+            xref = doc[0].get_images()[0][0]
+            tamanos[presupuesto] = (doc.extract_image(xref)["width"], os.path.getsize(salida))
+
+    # Sin presupuesto la imagen se conserva; "tamano" la lleva a 100 DPI (300 px)
+    assert tamanos[None][0] == 1200
+    assert tamanos["tamano"][0] == 300
+    assert tamanos["tamano"][1] < tamanos[None][1]
+
+
+def test_presupuesto_registra_una_decision_por_pagina(tmp_path):
+    entradas = [_pdf_con_imagen(str(tmp_path / f"foto{i}.pdf")) for i in range(2)]
+    entradas.append(escribir_pdf(str(tmp_path / "texto.pdf")))
+    processor = PDFProcessor(temp_dir=str(tmp_path / "tmp"), max_workers=1, presupuesto="tamano")
+    assert processor.combinar_y_optimizar(entradas, str(tmp_path / "salida.pdf"), modo="completo")
+
+    decisiones = processor.reporte_paginas
+    assert [d['pagina'] for d in decisiones] == [1, 2, 3]
+    assert [d['clase'] for d in decisiones] == ["imagenes", "imagenes", "texto"]
+    assert decisiones[0]['accion'] == "reducir_resolucion"
+    assert decisiones[0]['bytes_despues'] < decisiones[0]['bytes_antes']
+    assert decisiones[2]['accion'] == "sin_cambios"
+
+
+def test_manifiesto_incluye_decisiones_por_pagina(tmp_path, cliente):
+    import json
+    import main
+
+    foto = _pdf_con_imagen(str(tmp_path / "factura.pdf"))
+    xml = escribir_xml(str(tmp_path / "factura.xml"))
+    with open(foto, "rb") as pdf, open(xml, "rb") as f_xml:
+        respuesta = cliente.post("/upload", data={"modo": "pares", "color_mode": "color", "presupuesto": "tamano",
+                                                  "files": [(pdf, "factura.pdf"), (f_xml, "factura.xml")]},
+                                 content_type="multipart/form-data")
+    assert respuesta.status_code == 200
+    job = main.job_manager.obtener(respuesta.get_json()["job_id"])
+    with open(job.artefacto("manifiesto.json"), encoding="utf-8") as f:
+        documento = json.load(f)["documentos"][0]
+    # La página de la foto y la del XML convertido
+    assert [d['pagina'] for d in documento["paginas"]] == [1, 2]
+    assert documento["paginas"][0]["accion"] == "reducir_resolucion"
+
+
+def test_deduplicar_recursos_en_sitio(tmp_path):
+    # Un logotipo con transparencia (imagen + máscara) repetido en tres facturas
+    logo = Image.new("RGBA", (200, 100), (200, 30, 30, 255))
+    logo.paste((0, 0, 0, 0), (0, 0, 50, 50))
+    png = io.BytesIO()
+    logo.save(png, "PNG")
+    merged = fitz.open()
+    for _ in range(3):
+        factura = fitz.open()
+        factura.new_page().insert_image(fitz.Rect(72, 72, 272, 172), stream=png.getvalue())
+        merged.insert_pdf(factura)
+        factura.close()
+    xrefs = [page.get_images()[0][0] for page in merged]
+    assert len(set(xrefs)) == 3
+    # Un string que parece referencia a una copia no debe cambiar
+    merged.xref_set_key(merged.page_xref(0), "Nota", f"({xrefs[1]} 0 R)")
+
+    reporte = pdf_optimizer.deduplicar_recursos(merged)
+    # Por cada copia: la imagen, su máscara, su perfil ICC y el contenido de la página
+    assert reporte['duplicados'] == 8
+    assert reporte['bytes_ahorrados'] > 0
+    assert len({page.get_images()[0][0] for page in merged}) == 1
+    assert merged.xref_get_key(merged.page_xref(0), "Nota") == ("string", f"{xrefs[1]} 0 R")
+
+    salida = str(tmp_path / "logos.pdf")
+    merged.save(salida, **pdf_optimizer.SAVE_OPTIONS)
+    merged.close()
+    with fitz.open(salida) as doc:
+        assert all(page.get_pixmap().samples == doc[0].get_pixmap().samples for page in doc)
+        assert sum(doc.xref_is_stream(x) and doc.xref_get_key(x, "Subtype")[1] == "/Image"
+                   for x in range(1, doc.xref_length())) == 2
+
+
+def test_reporte_de_memoria_mide_el_crecimiento_de_la_combinacion(tmp_path, lote):
+    processor = PDFProcessor(temp_dir=str(tmp_path / "tmp"), max_workers=1, memoria_max_mb=1, merge_chunk_size=2)
+    assert processor.combinar_y_optimizar(lote(3), str(tmp_path / "salida.pdf"), modo="completo")
+
+    reporte = processor.reporte_memoria
+    assert reporte['bloques'] == 3
+    # El crecimiento es solo el de la combinación, no el RSS acumulado del proceso
+    assert 0 <= reporte['rss_extra_mb'] < reporte['rss_pico_mb']
+
+
+def test_grises_sin_recolor_usa_rasterizado(tmp_path, monkeypatch):
+    monkeypatch.delattr(fitz.Document, "recolor")
+    with fitz.open(escribir_pdf(str(tmp_path / "texto.pdf"))) as doc:
+        gris = pdf_optimizer.optimizar_documento(doc, grayscale=True, grayscale_mode="vector")
+    # Modo raster: la página completa es una imagen
+    assert gris.page_count == 1
+    assert len(gris[0].get_images()) == 1
+    gris.close()
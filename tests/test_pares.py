@@ -0,0 +1,82 @@
+import os
+
+from tests.conftest import escribir_pdf, escribir_xml
+from utils.cfdi import leer_uuid, uuids_en_pdf
+from utils.file_utils import IndicePares, validate_file_pairs
+
+UUID = "6f1c2b3a-4d5e-4f60-8a7b-9c0d1e2f3a4b"
+
+
+def _escribir_timbrado(ruta, uuid=UUID):
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<cfdi:Comprobante xmlns:cfdi="http://www.sat.gob.mx/cfd/4" '
+            'xmlns:tfd="http://www.sat.gob.mx/TimbreFiscalDigital" Version="4.0" Total="100.00">\n'
+            '  <cfdi:Emisor Rfc="AAA010101AAA"/>\n'
+            '  <cfdi:Complemento>\n'
+            f'    <tfd:TimbreFiscalDigital Version="1.1" UUID="{uuid}"/>\n'
+            '  </cfdi:Complemento>\n'
+            '</cfdi:Comprobante>\n'
+        )
+    return str(ruta)
+
+
+def test_extension_sin_distinguir_mayusculas():
+    indice = IndicePares(["b.xml", "FACTURA.PDF", "factura.xml", "b.Pdf", "notas.txt"])
+    # El nombre base sí distingue mayúsculas: FACTURA.PDF y factura.xml no son par
+    assert list(indice.completos()) == ["b"]
+    assert indice.completos()["b"] == ["b.Pdf", "b.xml"]
+    assert not indice.agregar("notas.txt")
+    assert IndicePares(["factura.PDF", "factura.xml"]).completos() == {"factura": ["factura.PDF", "factura.xml"]}
+
+
+def test_huerfanos_y_orden():
+    indice = IndicePares(["c.xml", "a.pdf", "a.xml", "c.pdf", "solo.pdf", "suelto.xml"])
+    assert indice.huerfanos() == [
+        {'nombre': 'solo', 'falta': 'xml', 'archivos': ['solo.pdf']},
+        {'nombre': 'suelto', 'falta': 'pdf', 'archivos': ['suelto.xml']},
+    ]
+    # Orden de aparición de los grupos; dentro de cada uno, PDF antes que XML
+    assert indice.ordenados() == ["c.pdf", "c.xml", "a.pdf", "a.xml", "solo.pdf", "suelto.xml"]
+    valido, mensaje = indice.validar()
+    assert not valido and "solo" in mensaje
+
+
+def test_validate_file_pairs():
+    assert validate_file_pairs(["x.pdf", "x.XML"]) == (True, "")
+    assert validate_file_pairs([]) == (False, "No se recibieron archivos")
+    valido, mensaje = validate_file_pairs(["x.pdf", "y.xml"])
+    assert not valido and "x" in mensaje
+
+
+def test_raiz_separa_directorios(tmp_path):
+    rutas = []
+    for directorio in ("ene", "feb"):
+        os.makedirs(tmp_path / directorio)
+        rutas += [str(tmp_path / directorio / "factura.pdf"), str(tmp_path / directorio / "factura.xml")]
+    indice = IndicePares(rutas, raiz=str(tmp_path))
+    assert sorted(indice.completos()) == ["ene/factura", "feb/factura"]
+
+
+def test_emparejar_por_uuid(tmp_path):
+    xml = _escribir_timbrado(tmp_path / "timbre.xml")
+    # El UUID aparece solo en el texto del PDF
+    pdf = escribir_pdf(str(tmp_path / "representacion.pdf"), texto=f"Folio fiscal {UUID}")
+    # Por nombre: el PDF lleva el UUID en el nombre
+    otro_uuid = "11111111-2222-3333-4444-555555555555"
+    xml_nombre = _escribir_timbrado(tmp_path / "otro.xml", otro_uuid)
+    pdf_nombre = escribir_pdf(str(tmp_path / f"{otro_uuid}.pdf"))
+    # Sin timbre: no se empareja
+    sin_timbre = escribir_xml(str(tmp_path / "sin_timbre.xml"))
+
+    assert leer_uuid(xml) == UUID.upper()
+    assert leer_uuid(sin_timbre) is None
+    assert uuids_en_pdf(pdf) == {UUID.upper()}
+
+    indice = IndicePares([pdf, xml, pdf_nombre, xml_nombre, sin_timbre])
+    assert indice.emparejar_por_uuid() == 2
+    completos = indice.completos()
+    assert completos["representacion"] == [pdf, xml]
+    assert completos[otro_uuid] == [pdf_nombre, xml_nombre]
+    assert [h['nombre'] for h in indice.huerfanos()] == ["sin_timbre"]
@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+
+from utils.perezoso import ModuloPerezoso
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_modulo_se_importa_en_el_primer_acceso(monkeypatch):
+    monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+    modulo = ModuloPerezoso("colorsys")
+    assert not modulo.cargado and "colorsys" not in sys.modules
+    assert "sin cargar" in repr(modulo)
+    assert modulo.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+    assert modulo.cargado and modulo.cargar() is sys.modules["colorsys"]
+
+
+def test_la_app_arranca_sin_cargar_los_backends():
+    codigo = ("import sys, main; "
+              "print('cargados:', [m for m in ('fitz', 'PyPDF2', 'PIL.Image', 'fpdf') if m in sys.modules])")
+    entorno = dict(os.environ, WARMUP="0", CACHE_DIR="", BUNDLE_DIR="")
+    salida = subprocess.run([sys.executable, "-c", codigo], cwd=RAIZ, env=entorno,
+                            capture_output=True, text=True, timeout=120, check=True)
+    assert "cargados: []" in salida.stdout.splitlines()
+
+
+def test_convertidor_y_procesadores_compartidos(tmp_path, monkeypatch):
+    from converters import pdf_processor
+
+    assert pdf_processor._convertidor_compartido() is pdf_processor._convertidor_compartido()
+
+    # Fuera de un worker cada grupo tiene su procesador
+    fuera = [pdf_processor._procesador_para_grupo(str(tmp_path / "a"), "fitz", "vector", None) for _ in range(2)]
+    assert fuera[0] is not fuera[1]
+
+    # Dentro de un worker se reutiliza uno por configuración y solo cambia el temporal
+    monkeypatch.setattr(pdf_processor, "en_worker", lambda: True)
+    monkeypatch.setattr(pdf_processor, "_procesadores_worker", {})
+    primero = pdf_processor._procesador_para_grupo(str(tmp_path / "a"), "fitz", "vector", None)
+    segundo = pdf_processor._procesador_para_grupo(str(tmp_path / "b"), "fitz", "vector", None)
+    assert primero is segundo and segundo._temp_dir == str(tmp_path / "b")
+    assert pdf_processor._procesador_para_grupo(str(tmp_path / "c"), "fitz", "raster", None) is not primero
+
+
+def test_precalentar(monkeypatch):
+    from converters import pdf_processor
+
+    monkeypatch.setattr(pdf_processor, "_precalentados", set())
+    assert pdf_processor.precalentar("pypdf2") > 0
+    assert pdf_processor.PyPDF2.cargado and pdf_processor.Image.cargado
+    # Una segunda llamada para el mismo backend no repite el trabajo
+    assert pdf_processor.precalentar("pypdf2") == 0.0
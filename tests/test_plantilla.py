@@ -0,0 +1,23 @@
+import pytest
+
+from utils.cfdi import MAX_NOMBRE, nombre_desde_plantilla
+
+METADATOS = {"base": "factura", "rfc_emisor": "AAA010101AAA", "serie": "A", "folio": "10",
+             "fecha": "2024-01-05T10:00:00"}
+
+
+def test_campos_simples():
+    assert nombre_desde_plantilla("{rfc_emisor}_{serie}{folio}", METADATOS, "x") == "AAA010101AAA_A10"
+    assert nombre_desde_plantilla("{dia}_{folio}", METADATOS, "x") == "2024-01-05_10"
+    assert nombre_desde_plantilla("{{lit}}_{base}", METADATOS, "x") == "lit_factura"
+
+
+@pytest.mark.parametrize("plantilla", [
+    "{base:>200000000}", "{base.__class__.__mro__}", "{base[0]}", "{base!r}", "{}", "{0}", "{falta}", "{",
+])
+def test_plantillas_rechazadas(plantilla):
+    assert nombre_desde_plantilla(plantilla, METADATOS, "respaldo") == "respaldo"
+
+
+def test_longitud_maxima():
+    assert len(nombre_desde_plantilla("{base}" * 100, METADATOS, "x")) == MAX_NOMBRE
@@ -0,0 +1,27 @@
+import os
+
+from utils import previews
+from utils.previews import CachePrevisualizaciones
+from tests.conftest import escribir_pdf
+
+
+def _matar_worker():
+    os._exit(1)
+
+
+def test_pool_roto_se_reemplaza(tmp_path):
+    ruta = escribir_pdf(str(tmp_path / "doc.pdf"), paginas=2)
+    cache = CachePrevisualizaciones()
+    try:
+        assert cache.paginas(ruta) == 2
+        roto = cache._pool
+        # Un worker que muere deja el pool inservible
+        try:
+            roto.submit(_matar_worker).result()
+        except previews.BrokenProcessPool:
+            pass
+        data, _ = cache.miniatura(ruta, 1, ancho=50)
+        assert data.startswith(b"\x89PNG")
+        assert cache._pool is not roto
+    finally:
+        cache.cerrar()
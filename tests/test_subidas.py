@@ -0,0 +1,99 @@
+import os
+import time
+
+import main
+
+
+def _esperar_job(cliente, status_url, segundos=60):
+    limite = time.time() + segundos
+    while time.time() < limite:
+        job = cliente.get(status_url).get_json()
+        if job['estado'] in ('completado', 'error'):
+            return job
+        time.sleep(0.1)
+    return job
+
+
+def test_subidas_detenidas_no_bloquean_otros_trabajos(cliente, lote):
+    assert main.job_manager.max_workers <= 2
+    declarados = [{'nombre': 'a.pdf', 'tamano': 100}, {'nombre': 'a.xml', 'tamano': 100}]
+    subidas = []
+    # Tantas subidas sin datos como workers (y una más), en ambos modos
+    for modo in ('pares', 'completo', 'pares'):
+        respuesta = cliente.post('/uploads', json={'modo': modo, 'archivos': declarados})
+        assert respuesta.status_code == 201
+        subidas.append(respuesta.get_json())
+    try:
+        rutas = lote(2)
+        handles = [open(ruta, 'rb') for ruta in rutas]
+        try:
+            respuesta = cliente.post('/jobs', data={'modo': 'pares', 'color_mode': 'color',
+                                                    'files': [(h, os.path.basename(h.name)) for h in handles]},
+                                     content_type='multipart/form-data')
+        finally:
+            for h in handles:
+                h.close()
+        assert respuesta.status_code == 202
+        job = _esperar_job(cliente, respuesta.get_json()['status_url'])
+        assert job['estado'] == 'completado'
+        for subida in subidas:
+            assert cliente.get(subida['status_url']).get_json()['estado'] in ('esperando', 'procesando')
+    finally:
+        for subida in subidas:
+            cliente.delete(subida['upload_url'])
+
+    for subida in subidas:
+        assert _esperar_job(cliente, subida['status_url'])['estado'] == 'error'
+
+
+def test_subidas_cuentan_para_el_limite_de_la_cola(cliente, monkeypatch):
+    monkeypatch.setattr(main.job_manager, 'max_cola', 0)
+    declarados = [{'nombre': 'a.pdf', 'tamano': 100}, {'nombre': 'a.xml', 'tamano': 100}]
+    subidas = []
+    try:
+        # max_workers + max_cola trabajos: las subidas esperando datos ocupan su lugar
+        for modo in ('pares', 'completo')[:main.job_manager.max_workers]:
+            respuesta = cliente.post('/uploads', json={'modo': modo, 'archivos': declarados})
+            assert respuesta.status_code == 201
+            subidas.append(respuesta.get_json())
+        respuesta = cliente.post('/uploads', json={'modo': 'pares', 'archivos': declarados})
+        assert respuesta.status_code == 503
+    finally:
+        for subida in subidas:
+            cliente.delete(subida['upload_url'])
+    for subida in subidas:
+        assert _esperar_job(cliente, subida['status_url'])['estado'] == 'error'
+    # Al terminar liberan su lugar
+    respuesta = cliente.post('/uploads', json={'modo': 'pares', 'archivos': declarados})
+    assert respuesta.status_code == 201
+    cliente.delete(respuesta.get_json()['upload_url'])
+
+
+def test_limite_de_subidas_abiertas(cliente, monkeypatch):
+    monkeypatch.setattr(main.gestor_subidas, 'max_sesiones', 1)
+    declarados = [{'nombre': 'a.pdf', 'tamano': 100}, {'nombre': 'a.xml', 'tamano': 100}]
+    primera = cliente.post('/uploads', json={'modo': 'pares', 'archivos': declarados})
+    assert primera.status_code == 201
+    try:
+        assert cliente.post('/uploads', json={'modo': 'pares', 'archivos': declarados}).status_code == 503
+    finally:
+        cliente.delete(primera.get_json()['upload_url'])
+    # Una subida cancelada ya no cuenta
+    segunda = cliente.post('/uploads', json={'modo': 'pares', 'archivos': declarados})
+    assert segunda.status_code == 201
+    cliente.delete(segunda.get_json()['upload_url'])
+
+
+def test_lotes_en_pares_comparten_el_pool(tmp_path, lote):
+    from converters import pdf_processor
+    from utils.file_utils import IndicePares
+
+    rutas = lote(2)
+    pools = []
+    for n in range(2):
+        processor = pdf_processor.PDFProcessor(temp_dir=str(tmp_path / f"tmp{n}"), max_workers=2)
+        grupos = IndicePares(rutas).completos()
+        resultados = processor.procesar_pares(iter(grupos.items()), str(tmp_path / f"salida{n}"))
+        assert all(r['pdf'] for r in resultados)
+        pools.append(pdf_processor._pool_pares)
+    assert pools[0] is not None and pools[0] is pools[1]
@@ -0,0 +1,32 @@
+from xml.dom import minidom
+
+import pytest
+
+from converters.xml_stream import iter_pretty_lines
+
+CASOS = [
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<cfdi:Comprobante xmlns:cfdi="http://www.sat.gob.mx/cfd/4" Version="4.0" Total="1&amp;2 &lt;3&gt;">\n'
+    '  <cfdi:Emisor Rfc="AAA010101AAA" Nombre="Emisor &quot;S.A.&quot;"/>\n'
+    '  <cfdi:Conceptos><cfdi:Concepto Importe="10.00">texto</cfdi:Concepto></cfdi:Conceptos>\n'
+    '</cfdi:Comprobante>\n',
+    '<a>uno<b>dos</b>tres<!-- nota --><?pi datos?></a>',
+    '<a><![CDATA[<sin> & escapar]]></a>',
+    '<a>antes<![CDATA[x]]>después<b/></a>',
+    '<!-- inicio --><?estilo tipo="x"?><a/><!-- fin -->',
+    '<!DOCTYPE a><a/>',
+    '<!DOCTYPE a SYSTEM "a.dtd"><a><b>t</b></a>',
+    '<!DOCTYPE a PUBLIC "-//SAT//CFDI" "http://x/a.dtd"><a/>',
+    '<!DOCTYPE a []><a/>',
+    '<!DOCTYPE a [\r\n<!ELEMENT a (#PCDATA)>\r\n<!-- comentario --><?pi x?>\r\n<!ENTITY e "valor">\r\n]>'
+    '<a>x &e; &amp; y</a>',
+]
+
+
+@pytest.mark.parametrize("xml", CASOS)
+@pytest.mark.parametrize("tam_bloque", [7, 64 * 1024])
+def test_igual_que_minidom(xml, tam_bloque):
+    data = xml.encode("utf-8")
+    bloques = [data[i:i + tam_bloque] for i in range(0, len(data), tam_bloque)]
+    esperado = minidom.parseString(data).toprettyxml(indent="  ")
+    assert "\n".join(iter_pretty_lines(bloques)) + "\n" == esperado
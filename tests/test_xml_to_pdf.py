@@ -0,0 +1,25 @@
+import fitz  # PyMuPDF
+
+from converters import xml_to_pdf
+from converters.xml_to_pdf import XMLtoPDFConverter
+from tests.conftest import escribir_xml
+
+
+def _texto(data):
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        return [page.get_text() for page in doc]
+
+
+def test_sin_fpdf_17_usa_multi_cell_con_el_mismo_texto(tmp_path, monkeypatch):
+    ruta = escribir_xml(str(tmp_path / "factura.xml"), folio=7)
+    rapido = XMLtoPDFConverter().convert_to_bytes(ruta)
+
+    monkeypatch.setattr(xml_to_pdf, "FPDF_17", False)
+    llamadas = []
+    original = XMLtoPDFConverter._linea_multi_cell
+    monkeypatch.setattr(XMLtoPDFConverter, "_linea_multi_cell",
+                        lambda self, pdf, linea: llamadas.append(linea) or original(self, pdf, linea))
+    compatible = XMLtoPDFConverter().convert_to_bytes(ruta)
+
+    assert llamadas
+    assert _texto(compatible) == _texto(rapido)
@@ -0,0 +1,47 @@
+import io
+import os
+import zipfile
+
+from utils.zip_stream import content_disposition, generar_zip
+
+
+def _escribir(ruta, data):
+    with open(ruta, "wb") as f:
+        f.write(data)
+    return str(ruta)
+
+
+def test_zip_valido_sin_recomprimir_los_pdf(tmp_path):
+    pdf = _escribir(tmp_path / "a.pdf", os.urandom(200 * 1024))
+    manifiesto = _escribir(tmp_path / "m.json", b'{"documentos": []}' * 100)
+    data = b"".join(generar_zip([pdf, (manifiesto, "manifiesto.json")], tam_bloque=16 * 1024))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert zf.getinfo("a.pdf").compress_type == zipfile.ZIP_STORED
+        assert zf.getinfo("manifiesto.json").compress_type == zipfile.ZIP_DEFLATED
+        with open(pdf, "rb") as f:
+            assert zf.read("a.pdf") == f.read()
+
+
+def test_entrega_cada_archivo_en_cuanto_llega(tmp_path):
+    rutas = [_escribir(tmp_path / f"{i}.pdf", os.urandom(100 * 1024)) for i in range(3)]
+    pedidos = []
+
+    def archivos():
+        for ruta in rutas:
+            pedidos.append(ruta)
+            yield ruta
+
+    bloques = generar_zip(archivos(), tam_bloque=8 * 1024)
+    next(bloques)
+    # El primer bloque sale sin esperar al resto del lote
+    assert pedidos == rutas[:1]
+    # Y la memoria es de un bloque por vez, no del archivo entero
+    assert all(len(bloque) <= 8 * 1024 + 1024 for bloque in bloques)
+
+
+def test_content_disposition_utf8():
+    cabecera = content_disposition('facturas "marzo" año.zip')
+    assert 'filename="facturas marzo a_o.zip"' in cabecera
+    assert "filename*=UTF-8''facturas%20%22marzo%22%20a%C3%B1o.zip" in cabecera
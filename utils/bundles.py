@@ -0,0 +1,113 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import uuid
+
+_ID_VALIDO = re.compile(r'^[0-9a-f]{32}$')
+
+MANIFIESTO = 'manifiesto.json'
+
+
+class BundleStore:
+    """Último PDF de cada lote de modo completo con su manifiesto, para rehacer solo los
+    segmentos que cambian cuando el lote se vuelve a subir
+
+    Cada lote vive en <directorio>/<bundle_id>/ con 'manifiesto.json' y el PDF al que apunta.
+    El manifiesto se escribe al final y de forma atómica: es el que confirma cada versión.
+    El PDF de la versión anterior se borra en el guardado siguiente.
+    Se conservan los `max_bundles` usados más recientemente (LRU por mtime del manifiesto).
+    """
+
+    def __init__(self, directorio, max_bundles=100):
+        self.directorio = directorio
+        self.max_bundles = max_bundles
+        os.makedirs(self.directorio, exist_ok=True)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def nuevo_id():
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def id_valido(bundle_id):
+        """Los ids son hexadecimales de 32 caracteres: nunca forman rutas arbitrarias"""
+        return bool(bundle_id) and bool(_ID_VALIDO.match(bundle_id))
+
+    def _dir(self, bundle_id):
+        return os.path.join(self.directorio, bundle_id)
+
+    def obtener(self, bundle_id):
+        """Devuelve (ruta del PDF, manifiesto) del lote o None; un acierto lo marca como usado"""
+        if not self.id_valido(bundle_id):
+            return None
+        ruta_manifiesto = os.path.join(self._dir(bundle_id), MANIFIESTO)
+        try:
+            with open(ruta_manifiesto, encoding='utf-8') as f:
+                manifiesto = json.load(f)
+            os.utime(ruta_manifiesto)
+        except (OSError, ValueError):
+            return None
+        ruta_pdf = os.path.join(self._dir(bundle_id), manifiesto.get('pdf', ''))
+        if not os.path.isfile(ruta_pdf):
+            return None
+        return ruta_pdf, manifiesto
+
+    @staticmethod
+    def _pdf_actual(directorio):
+        """Nombre del PDF al que apunta el manifiesto vigente del lote, o None"""
+        try:
+            with open(os.path.join(directorio, MANIFIESTO), encoding='utf-8') as f:
+                return json.load(f).get('pdf')
+        except (OSError, ValueError):
+            return None
+
+    def guardar(self, bundle_id, pdf, manifiesto):
+        """Guarda una copia de `pdf` y su manifiesto como la versión actual del lote"""
+        if not self.id_valido(bundle_id):
+            raise ValueError(f"Id de lote no válido: {bundle_id}")
+        directorio = self._dir(bundle_id)
+        os.makedirs(directorio, exist_ok=True)
+
+        # Cada versión tiene su propio PDF para no pisar el que otra solicitud pueda estar leyendo
+        nombre = f"documento_{uuid.uuid4().hex[:12]}.pdf"
+        anterior = self._pdf_actual(directorio)
+        fd, tmp = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(pdf, tmp)
+            os.replace(tmp, os.path.join(directorio, nombre))
+            fd, tmp = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(dict(manifiesto, pdf=nombre), f)
+            os.replace(tmp, os.path.join(directorio, MANIFIESTO))
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        # El PDF de la versión anterior se conserva hasta el siguiente guardado: quien leyó
+        # su manifiesto justo antes del cambio aún puede abrirlo
+        for entrada in os.scandir(directorio):
+            if entrada.name.endswith('.pdf') and entrada.name not in (nombre, anterior):
+                try:
+                    os.remove(entrada.path)
+                except OSError:
+                    pass
+        self._desalojar()
+        return bundle_id
+
+    def _desalojar(self):
+        """Elimina los lotes usados hace más tiempo por encima de `max_bundles`"""
+        with self._lock:
+            lotes = []
+            for entrada in os.scandir(self.directorio):
+                try:
+                    lotes.append((os.path.getmtime(os.path.join(entrada.path, MANIFIESTO)), entrada.path))
+                except OSError:
+                    continue
+            lotes.sort()
+            for _, ruta in lotes[:max(0, len(lotes) - self.max_bundles)]:
+                shutil.rmtree(ruta, ignore_errors=True)
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+TAM_BLOQUE = 1024 * 1024
+
+
+def hash_archivo(ruta):
+    """SHA-256 del contenido de un archivo, leído por bloques"""
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(TAM_BLOQUE), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+class ResultCache:
+    """Caché en disco direccionada por contenido para XML renderizados y PDF optimizados
+
+    La clave combina el hash del contenido de las entradas con los parámetros de conversión.
+    Al superar `max_bytes` se eliminan las entradas usadas hace más tiempo (LRU por mtime).
+    Varios procesos pueden compartir el mismo directorio; los contadores son por proceso.
+    """
+
+    def __init__(self, directorio, max_bytes=512 * 1024 * 1024):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        os.makedirs(self.directorio, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._escrituras = 0
+        self._lock = threading.Lock()
+        self._hashes = {}
+        self._total = self._calcular_total()
+
+    def __getstate__(self):
+        estado = self.__dict__.copy()
+        del estado['_lock']
+        return estado
+
+    def __setstate__(self, estado):
+        self.__dict__.update(estado)
+        self._lock = threading.Lock()
+
+    def _hash(self, ruta):
+        """Hash del contenido, recordado mientras el archivo no cambie de tamaño ni de mtime
+
+        Los archivos en memoria (con sha256(), p. ej. ArchivoEnMemoria) calculan el suyo.
+        """
+        if hasattr(ruta, 'sha256'):
+            return ruta.sha256()
+        st = os.stat(ruta)
+        firma = (ruta, st.st_size, st.st_mtime_ns)
+        valor = self._hashes.get(firma)
+        if valor is None:
+            valor = hash_archivo(ruta)
+            if len(self._hashes) > 4096:
+                self._hashes.clear()
+            self._hashes[firma] = valor
+        return valor
+
+    def clave(self, archivos, **parametros):
+        """Calcula la clave para un conjunto ordenado de archivos y parámetros de conversión"""
+        h = hashlib.sha256()
+        for archivo in archivos:
+            h.update(self._hash(archivo).encode())
+        h.update(json.dumps(parametros, sort_keys=True, default=str).encode())
+        return h.hexdigest()
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, clave[:2], f"{clave}.pdf")
+
+    def obtener(self, clave):
+        """Devuelve la ruta del artefacto en caché o None; un acierto lo marca como usado"""
+        ruta = self._ruta(clave)
+        try:
+            os.utime(ruta)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return ruta
+
+    def leer(self, clave):
+        """Devuelve los bytes del artefacto en caché o None"""
+        ruta = self.obtener(clave)
+        if ruta is None:
+            return None
+        try:
+            with open(ruta, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None  # Eliminado por otro proceso entre obtener() y la lectura
+
+    def copiar(self, clave, destino):
+        """Copia el artefacto en caché a `destino`; devuelve destino o None si no está"""
+        ruta = self.obtener(clave)
+        if ruta is None:
+            return None
+        try:
+            shutil.copyfile(ruta, destino)
+            return destino
+        except OSError:
+            return None
+
+    def guardar_bytes(self, clave, data):
+        """Guarda un artefacto de forma atómica"""
+        ruta = self._ruta(clave)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, ruta)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._registrar_escritura(len(data))
+        return ruta
+
+    def guardar_archivo(self, clave, origen):
+        """Guarda una copia de `origen` como artefacto"""
+        with open(origen, 'rb') as f:
+            return self.guardar_bytes(clave, f.read())
+
+    def _registrar_escritura(self, tamano):
+        with self._lock:
+            self._total += tamano
+            self._escrituras += 1
+            # Otros procesos también escriben: se recalcula el total de vez en cuando
+            if self._total <= self.max_bytes and self._escrituras % 64:
+                return
+            self._desalojar()
+
+    def _entradas(self):
+        for sub in os.scandir(self.directorio):
+            if not sub.is_dir():
+                continue
+            for entrada in os.scandir(sub.path):
+                if entrada.name.endswith('.pdf'):
+                    try:
+                        st = entrada.stat()
+                    except OSError:
+                        continue
+                    yield st.st_mtime, st.st_size, entrada.path
+
+    def _calcular_total(self):
+        return sum(tamano for _, tamano, _ in self._entradas())
+
+    def _desalojar(self):
+        """Elimina las entradas menos usadas recientemente hasta quedar bajo el 90% del límite"""
+        entradas = sorted(self._entradas())
+        self._total = sum(tamano for _, tamano, _ in entradas)
+        limite = self.max_bytes * 0.9
+        for _, tamano, ruta in entradas:
+            if self._total <= limite:
+                break
+            try:
+                os.remove(ruta)
+                self._total -= tamano
+                self.evictions += 1
+            except OSError:
+                pass
+
+    def estadisticas(self):
+        """Contadores de aciertos/fallos y ocupación actual"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'bytes': self._total,
+                'max_bytes': self.max_bytes,
+            }
+
+    def sumar_contadores(self, hits=0, misses=0, evictions=0):
+        """Acumula contadores registrados en otro proceso (p. ej. un worker del pool)"""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.evictions += evictions
@@ -0,0 +1,230 @@
+import os
+import re
+import string
+from decimal import Decimal, InvalidOperation
+from xml.parsers import expat
+from werkzeug.utils import secure_filename
+
+TAM_BLOQUE = 64 * 1024
+# El encabezado (Comprobante, Emisor, Receptor) ocupa los primeros KB: se lee en bloques chicos
+TAM_BLOQUE_ENCABEZADO = 4 * 1024
+# El timbre fiscal va al final del comprobante (en el Complemento): se busca primero aquí
+TAM_COLA = 16 * 1024
+
+UUID_RE = re.compile(r'[0-9A-Fa-f]{8}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{12}')
+_TIMBRE = re.compile(
+    rb'<(?:[\w.-]+:)?TimbreFiscalDigital\b[^>]*?\sUUID\s*=\s*["\']([0-9A-Fa-f-]{36})["\']', re.S
+)
+
+
+# Atributos del encabezado que se extraen: elemento -> {atributo: clave}
+CAMPOS_ENCABEZADO = {
+    "Comprobante": {"Serie": "serie", "Folio": "folio", "Fecha": "fecha", "SubTotal": "subtotal",
+                    "Total": "total", "Moneda": "moneda", "TipoDeComprobante": "tipo"},
+    "Emisor": {"Rfc": "rfc_emisor", "Nombre": "nombre_emisor"},
+    "Receptor": {"Rfc": "rfc_receptor", "Nombre": "nombre_receptor"},
+}
+CAMPOS = tuple(clave for atributos in CAMPOS_ENCABEZADO.values() for clave in atributos.values()) + ("uuid",)
+# Elementos del encabezado; el primero que no sea uno de estos (Conceptos) lo termina
+_ENCABEZADO = {"Comprobante", "InformacionGlobal", "CfdiRelacionados", "CfdiRelacionado", "Emisor", "Receptor"}
+
+
+class _Encontrado(Exception):
+    """Detiene expat en cuanto aparece el elemento buscado"""
+
+
+def _bloques(archivo, inicio=0, tam_bloque=TAM_BLOQUE):
+    """Bloques binarios de una ruta o de un archivo en memoria (con getbuffer()) desde `inicio`"""
+    if hasattr(archivo, "getbuffer"):
+        buffer = archivo.getbuffer()
+        for posicion in range(inicio, len(buffer), tam_bloque):
+            yield buffer[posicion:posicion + tam_bloque]
+        return
+    with open(archivo, "rb") as f:
+        f.seek(inicio)
+        for bloque in iter(lambda: f.read(tam_bloque), b""):
+            yield bloque
+
+
+def _tamano(archivo):
+    if hasattr(archivo, "getbuffer"):
+        return len(archivo.getbuffer())
+    return os.path.getsize(archivo)
+
+
+def _uuid_en_xml(archivo):
+    """Recorre el XML con expat y se detiene en el TimbreFiscalDigital, sin construir el árbol"""
+    parser = expat.ParserCreate()
+    raiz = []
+
+    def inicio(nombre, atributos):
+        local = nombre.rsplit(":", 1)[-1]
+        if not raiz:
+            raiz.append(local)
+            if local != "Comprobante":
+                raise _Encontrado(None)  # no es un CFDI
+        if local == "TimbreFiscalDigital":
+            raise _Encontrado(atributos.get("UUID"))
+
+    parser.StartElementHandler = inicio
+    try:
+        for bloque in _bloques(archivo):
+            parser.Parse(bytes(bloque), False)
+        parser.Parse(b"", True)
+    except _Encontrado as e:
+        return e.args[0]
+    return None
+
+
+def leer_uuid(archivo):
+    """UUID (folio fiscal) del timbre de un CFDI en mayúsculas, o None si no tiene o no se puede leer
+
+    Se busca en los últimos TAM_COLA bytes; solo si no está ahí y al final hay una Addenda
+    (que va después del Complemento y puede ser grande) se recorre el XML, deteniéndose en
+    el timbre. Sin timbre ni Addenda al final, el comprobante no está timbrado.
+    """
+    try:
+        tamano = _tamano(archivo)
+        cola = b"".join(bytes(b) for b in _bloques(archivo, max(0, tamano - TAM_COLA)))
+        encontrado = _TIMBRE.search(cola)
+        if encontrado:
+            uuid = encontrado.group(1).decode("ascii")
+        elif tamano > TAM_COLA and b"Addenda" in cola:
+            uuid = _uuid_en_xml(archivo)
+        else:
+            uuid = None
+    except (OSError, expat.ExpatError) as e:
+        print(f"No se pudo leer el UUID de {archivo}: {str(e)}")
+        return None
+    if not uuid or not UUID_RE.fullmatch(uuid):
+        return None
+    return uuid.upper()
+
+
+def uuids_en_pdf(archivo, nombre=None):
+    """UUID que aparecen en el nombre del PDF o en el texto de su primera y última página
+
+    Las representaciones impresas de un CFDI muestran el folio fiscal; el nombre se revisa
+    primero porque no requiere abrir el documento.
+    """
+    uuids = {u.upper() for u in UUID_RE.findall(nombre or os.path.basename(str(archivo)))}
+    if uuids:
+        return uuids
+    import fitz  # PyMuPDF, solo si hace falta leer el texto
+
+    try:
+        if hasattr(archivo, "getbuffer"):
+            doc = fitz.open("pdf", archivo.getbuffer())
+        else:
+            doc = fitz.open(archivo)
+    except Exception as e:
+        print(f"No se pudo abrir {nombre or archivo} para buscar el UUID: {str(e)}")
+        return uuids
+    try:
+        for numero in sorted({0, doc.page_count - 1}):
+            if numero >= 0:
+                uuids.update(u.upper() for u in UUID_RE.findall(doc[numero].get_text()))
+    finally:
+        doc.close()
+    return uuids
+
+
+def leer_encabezado(archivo, campos=CAMPOS):
+    """Metadatos del encabezado de un CFDI sin analizar el documento completo
+
+    Devuelve un dict con las claves de `campos` que se encontraron (ver CAMPOS: serie,
+    folio, fecha, total, rfc_emisor, rfc_receptor, uuid...). El XML se recorre con expat en
+    bloques de TAM_BLOQUE_ENCABEZADO y se detiene en cuanto tiene todos los campos pedidos
+    o termina el encabezado (en el primer elemento que no es del encabezado); el UUID, que está en el timbre del
+    final, se obtiene con leer_uuid. Si el XML no es un CFDI o no se puede leer devuelve {}.
+    """
+    campos = set(campos)
+    buscados = {elemento: {a: c for a, c in atributos.items() if c in campos}
+                for elemento, atributos in CAMPOS_ENCABEZADO.items()}
+    pendientes = {elemento for elemento, atributos in buscados.items() if atributos}
+    datos = {}
+    es_cfdi = []
+
+    def inicio(nombre, atributos):
+        local = nombre.rsplit(":", 1)[-1]
+        if not es_cfdi:
+            es_cfdi.append(local == "Comprobante")
+            if not es_cfdi[0]:
+                raise _Encontrado()
+        if local in pendientes:
+            pendientes.discard(local)
+            for atributo, clave in buscados[local].items():
+                if atributos.get(atributo) is not None:
+                    datos[clave] = atributos[atributo]
+        if not pendientes or local not in _ENCABEZADO:
+            raise _Encontrado()
+
+    if pendientes:
+        parser = expat.ParserCreate()
+        parser.StartElementHandler = inicio
+        try:
+            for bloque in _bloques(archivo, tam_bloque=TAM_BLOQUE_ENCABEZADO):
+                parser.Parse(bytes(bloque), False)
+            parser.Parse(b"", True)
+        except _Encontrado:
+            pass
+        except (OSError, expat.ExpatError) as e:
+            print(f"No se pudo leer el encabezado de {archivo}: {str(e)}")
+            return {}
+    if "uuid" in campos and es_cfdi != [False]:
+        uuid = leer_uuid(archivo)
+        if uuid:
+            datos["uuid"] = uuid
+    return datos
+
+
+def _importe(valor):
+    try:
+        return Decimal(valor)
+    except (InvalidOperation, TypeError):
+        return Decimal(0)
+
+
+def _folio(valor):
+    """Los folios suelen ser numéricos: se comparan como número cuando lo son"""
+    return (0, int(valor), "") if valor and valor.isdigit() else (1, 0, valor or "")
+
+
+# Longitud máxima de un nombre generado con nombre_desde_plantilla (sin extensión)
+MAX_NOMBRE = 120
+_FORMATEADOR = string.Formatter()
+
+
+# Criterios de orden por metadatos: nombre -> clave a partir del dict de leer_encabezado
+CRITERIOS_ORDEN = {
+    "fecha": lambda d: d.get("fecha", ""),
+    "emisor": lambda d: (d.get("rfc_emisor", ""), d.get("fecha", "")),
+    "folio": lambda d: (d.get("serie", ""), _folio(d.get("folio"))),
+    "total": lambda d: _importe(d.get("total")),
+}
+
+
+def nombre_desde_plantilla(plantilla, metadatos, respaldo):
+    """Nombre de archivo (sin extensión) a partir de una plantilla con campos del CFDI
+
+    La plantilla solo admite sustituir campos simples: las claves de leer_encabezado, `base`
+    y `dia` (la fecha sin la hora) entre llaves, p. ej. "{dia}_{rfc_emisor}_{serie}{folio}"
+    ({{ y }} son llaves literales).
+    Viene del cliente, así que se rechazan especificaciones de formato, conversiones y
+    accesos a atributos o índices. Si la plantilla no es válida, falta algún campo o el
+    resultado queda vacío se devuelve `respaldo`; el nombre se recorta a MAX_NOMBRE caracteres.
+    """
+    if metadatos.get("fecha"):
+        metadatos = dict(metadatos, dia=metadatos["fecha"][:10])
+    partes = []
+    try:
+        for literal, campo, formato, conversion in _FORMATEADOR.parse(plantilla):
+            partes.append(literal)
+            if campo is None:
+                continue
+            if formato or conversion or not campo.isidentifier():
+                return respaldo
+            partes.append(str(metadatos[campo]))
+    except (KeyError, ValueError):
+        return respaldo
+    return secure_filename("".join(partes))[:MAX_NOMBRE] or respaldo
@@ -1,52 +1,215 @@
-import os
-from werkzeug.utils import secure_filename
-
-ALLOWED_EXTENSIONS = {'pdf', 'xml'}
-
-def allowed_file(filename):
-    """Check if the file has an allowed extension"""
-    if not filename or not isinstance(filename, str):
-        return False
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-def validate_file_pairs(files):
-    if not files:
-        return False, "No se recibieron archivos"
-    
-    file_groups = {}
-    for file in files:
-        if not file or not file.filename:
-            continue
-            
-        base_name = os.path.splitext(file.filename)[0]
-        ext = os.path.splitext(file.filename)[1][1:].lower()
-        
-        if base_name not in file_groups:
-            file_groups[base_name] = {}
-        file_groups[base_name][ext] = file
-    
-    for base_name, extensions in file_groups.items():
-        if 'pdf' not in extensions or 'xml' not in extensions:
-            return False, f"El archivo {base_name} no tiene su par correspondiente (PDF y XML)"
-    
-    return True, ""
-
-def save_uploaded_files(files, temp_dir):
-    saved_files = []
-    for file in files:
-        if not file or not file.filename:
-            continue
-            
-        filename = secure_filename(file.filename)
-        if not filename:
-            continue
-            
-        file_path = os.path.join(temp_dir, filename)
-        try:
-            file.save(file_path)
-            saved_files.append(file_path)
-        except Exception as e:
-            print(f"Error guardando archivo {filename}: {str(e)}")
-            continue
-            
+import hashlib
+import io
+import os
+import shutil
+from werkzeug.utils import secure_filename
+from utils.cfdi import CRITERIOS_ORDEN, leer_uuid, uuids_en_pdf
+
+ALLOWED_EXTENSIONS = {'pdf', 'xml'}
+
+
+class ArchivoEnMemoria:
+    """Archivo subido que se conserva en memoria en lugar de escribirse a disco
+
+    Se puede usar donde se espera una ruta: los convertidores y el procesador aceptan
+    ambos. Es serializable (pickle), así que también viaja a los procesos del pool.
+    """
+
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.data = bytes(data)
+        self._sha256 = None
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return f"<ArchivoEnMemoria {self.filename} ({len(self.data)} bytes)>"
+
+    def getbuffer(self):
+        """Vista de solo lectura del contenido, sin copiarlo"""
+        return memoryview(self.data)
+
+    def abrir(self):
+        return io.BytesIO(self.data)
+
+    def sha256(self):
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self.data).hexdigest()
+        return self._sha256
+
+
+def en_memoria(archivo):
+    return isinstance(archivo, ArchivoEnMemoria)
+
+
+def nombre_archivo(archivo):
+    """Nombre de archivo (sin directorio) de una ruta o de un ArchivoEnMemoria"""
+    if en_memoria(archivo):
+        return archivo.filename
+    return os.path.basename(archivo)
+
+
+def existe_archivo(archivo):
+    return en_memoria(archivo) or os.path.exists(archivo)
+
+
+def tamano_archivo(archivo):
+    """Tamaño en bytes de una ruta o de un ArchivoEnMemoria"""
+    if en_memoria(archivo):
+        return len(archivo)
+    return os.path.getsize(archivo)
+
+
+def allowed_file(filename):
+    """Check if the file has an allowed extension"""
+    if not filename or not isinstance(filename, str):
+        return False
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+class IndicePares:
+    """Índice de emparejamiento PDF+XML de un lote
+
+    Se construye una vez por lote y lo comparten la validación, el planificador y la
+    combinación. Los archivos se agrupan por nombre base; la extensión no distingue
+    mayúsculas (factura.PDF + factura.xml forman un par). Los grupos conservan el orden
+    de aparición y dentro de cada uno van primero los PDF y luego los XML, por nombre.
+    Los archivos pueden ser rutas, ArchivoEnMemoria o solo nombres.
+
+    Con `raiz` (rutas de varios directorios, p. ej. al recorrer subdirectorios) la clave de
+    cada grupo es el directorio relativo a `raiz` más el nombre base, separados por "/"
+    ("ene/factura_1"): archivos con el mismo nombre en directorios distintos no se mezclan.
+    """
+
+    def __init__(self, archivos=(), raiz=None):
+        self.raiz = raiz
+        self.grupos = {}  # base -> {'pdf': [...], 'xml': [...]}
+        for archivo in archivos:
+            self.agregar(archivo)
+
+    def agregar(self, archivo):
+        """Agrega un archivo a su grupo; devuelve False si no es PDF ni XML"""
+        base, ext = os.path.splitext(nombre_archivo(archivo))
+        ext = ext[1:].lower()
+        if ext not in ALLOWED_EXTENSIONS:
+            return False
+        if self.raiz is not None:
+            directorio = os.path.relpath(os.path.dirname(os.path.abspath(archivo)), self.raiz)
+            if directorio != os.curdir:
+                base = "/".join(directorio.split(os.sep) + [base])
+        self.grupos.setdefault(base, {'pdf': [], 'xml': []})[ext].append(archivo)
+        return True
+
+    @staticmethod
+    def _ordenar(grupo):
+        return sorted(grupo['pdf'], key=nombre_archivo) + sorted(grupo['xml'], key=nombre_archivo)
+
+    def completos(self):
+        """{base: archivos} de los grupos con PDF y XML, cada uno en el orden en que se combina"""
+        return {base: self._ordenar(grupo) for base, grupo in self.grupos.items() if grupo['pdf'] and grupo['xml']}
+
+    def huerfanos(self):
+        """Grupos sin su par: [{'nombre': base, 'falta': 'pdf' o 'xml', 'archivos': [nombres]}]"""
+        return [
+            {'nombre': base, 'falta': 'xml' if grupo['pdf'] else 'pdf',
+             'archivos': [nombre_archivo(f) for f in self._ordenar(grupo)]}
+            for base, grupo in self.grupos.items() if not (grupo['pdf'] and grupo['xml'])
+        ]
+
+    def ordenados(self):
+        """Todos los archivos, también los que no tienen par, en el orden de combinación del modo pares"""
+        return [archivo for grupo in self.grupos.values() for archivo in self._ordenar(grupo)]
+
+    def validar(self):
+        """(True, "") si todos los archivos tienen su par; si no, (False, mensaje del primero que falta)"""
+        if not self.grupos:
+            return False, "No se recibieron archivos"
+        huerfanos = self.huerfanos()
+        if huerfanos:
+            return False, f"El archivo {huerfanos[0]['nombre']} no tiene su par correspondiente (PDF y XML)"
+        return True, ""
+
+    def emparejar_por_uuid(self):
+        """Une los grupos sin par cuyo PDF muestra el UUID del timbre de un XML suelto
+
+        El UUID del XML se lee del timbre sin analizar el documento completo; en el PDF se
+        busca en el nombre y, si no está, en el texto. El par queda con el nombre base del
+        PDF. Solo se leen los archivos sin par. Devuelve cuántos pares se formaron.
+        """
+        xml_sueltos = {}
+        for base, grupo in self.grupos.items():
+            if grupo['xml'] and not grupo['pdf'] and len(grupo['xml']) == 1:
+                uuid = leer_uuid(grupo['xml'][0])
+                if uuid:
+                    xml_sueltos.setdefault(uuid, base)
+        unidos = 0
+        for base, grupo in list(self.grupos.items()):
+            if not xml_sueltos:
+                break
+            if not grupo['pdf'] or grupo['xml'] or len(grupo['pdf']) != 1:
+                continue
+            pdf = grupo['pdf'][0]
+            for uuid in uuids_en_pdf(pdf, nombre_archivo(pdf)):
+                if uuid in xml_sueltos:
+                    grupo['xml'].extend(self.grupos.pop(xml_sueltos.pop(uuid))['xml'])
+                    unidos += 1
+                    break
+        return unidos
+
+
+def ordenar_por_cfdi(archivos, criterio, metadatos):
+    """Ordena un lote por metadatos del CFDI según un criterio de utils.cfdi.CRITERIOS_ORDEN
+
+    `metadatos` es {nombre de archivo: encabezado} de los XML del lote. Cada PDF va junto
+    al XML de su mismo nombre base y se ordena con sus datos; los grupos sin datos van al
+    final en su orden original.
+    """
+    clave = CRITERIOS_ORDEN[criterio]
+    con_datos, sin_datos = [], []
+    for grupo in IndicePares(archivos).grupos.values():
+        datos = next((metadatos[nombre_archivo(x)] for x in grupo['xml'] if metadatos.get(nombre_archivo(x))), None)
+        (con_datos if datos else sin_datos).append((datos, IndicePares._ordenar(grupo)))
+    con_datos.sort(key=lambda par: clave(par[0]))
+    return [archivo for _, grupo in con_datos + sin_datos for archivo in grupo]
+
+
+def validate_file_pairs(files):
+    """Verifica que cada archivo tenga su par; acepta archivos subidos o nombres de archivo"""
+    nombres = [f if isinstance(f, str) else getattr(f, 'filename', None) for f in files or ()]
+    return IndicePares(n for n in nombres if n).validar()
+
+def save_uploaded_files(files, temp_dir, umbral_memoria=0):
+    """Guarda los archivos subidos y devuelve sus rutas
+
+    Los archivos de hasta `umbral_memoria` bytes se devuelven como ArchivoEnMemoria sin
+    escribirse a disco; los mayores (o todos si el umbral es 0) se guardan en temp_dir.
+    """
+    saved_files = []
+    for file in files:
+        if not file or not file.filename:
+            continue
+            
+        filename = secure_filename(file.filename)
+        if not filename:
+            continue
+            
+        file_path = os.path.join(temp_dir, filename)
+        try:
+            if umbral_memoria > 0:
+                # Se lee un byte más que el umbral para saber si el archivo lo supera
+                data = file.stream.read(umbral_memoria + 1)
+                if len(data) <= umbral_memoria:
+                    saved_files.append(ArchivoEnMemoria(filename, data))
+                    continue
+                with open(file_path, 'wb') as f:
+                    f.write(data)
+                    shutil.copyfileobj(file.stream, f)
+            else:
+                file.save(file_path)
+            saved_files.append(file_path)
+        except Exception as e:
+            print(f"Error guardando archivo {filename}: {str(e)}")
+            continue
+            
     return saved_files
\ No newline at end of file
@@ -0,0 +1,230 @@
+import heapq
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ColaLlenaError(Exception):
+    """Se alcanzó el límite de trabajos en cola"""
+
+
+class Job:
+    """Trabajo de conversión en segundo plano con progreso por archivo"""
+
+    def __init__(self, temp_dir, archivos, **info):
+        self.id = uuid.uuid4().hex
+        self.temp_dir = temp_dir
+        self.info = info
+        self.estado = 'en_cola'
+        self.error = None
+        self.resultado = None
+        self.creado = time.time()
+        self.iniciado = None
+        self.terminado = None
+        self._lock = threading.Lock()
+        self.archivos = {nombre: {'estado': 'pendiente', 'segundos': None, 'error': None} for nombre in archivos}
+        # Resultados parciales por posición (ruta o None si esa unidad falló)
+        self._artefactos = {}
+        self._finalizado = False
+        self._cond = threading.Condition()
+
+    def publicar(self, indice, ruta):
+        """Publica el artefacto de la unidad `indice` para que la descarga pueda enviarlo"""
+        with self._cond:
+            self._artefactos[indice] = ruta
+            self._cond.notify_all()
+
+    def finalizar(self):
+        with self._cond:
+            self._finalizado = True
+            self._cond.notify_all()
+
+    def iter_artefactos(self):
+        """Entrega las rutas en orden a medida que se publican; termina cuando el trabajo acaba"""
+        indice = 0
+        while True:
+            with self._cond:
+                while indice not in self._artefactos and not self._finalizado:
+                    self._cond.wait()
+                if indice not in self._artefactos:
+                    return
+                ruta = self._artefactos[indice]
+            indice += 1
+            if ruta:
+                yield ruta
+
+    def artefacto(self, nombre):
+        """Ruta del artefacto ya publicado con ese nombre en el ZIP, o None"""
+        with self._cond:
+            publicados = [self._artefactos[i] for i in sorted(self._artefactos)]
+        return next((ruta for ruta, arcname in filter(None, publicados) if arcname == nombre), None)
+
+    def nombres_artefactos(self):
+        """Nombres (en el ZIP) de los artefactos publicados hasta ahora, en orden"""
+        with self._cond:
+            publicados = [self._artefactos[i] for i in sorted(self._artefactos)]
+        return [arcname for _, arcname in filter(None, publicados)]
+
+    def registrar_archivo(self, nombre, segundos=None, error=None):
+        """Marca un archivo (o grupo) como terminado"""
+        with self._lock:
+            self.archivos[nombre] = {
+                'estado': 'error' if error else 'completado',
+                'segundos': round(segundos, 3) if segundos is not None else None,
+                'error': error,
+            }
+
+    def to_dict(self):
+        with self._lock:
+            archivos = {nombre: dict(datos) for nombre, datos in self.archivos.items()}
+        terminados = sum(1 for datos in archivos.values() if datos['estado'] != 'pendiente')
+        ahora = time.time()
+        return {
+            'job_id': self.id,
+            'estado': self.estado,
+            'error': self.error,
+            'progreso': {'terminados': terminados, 'total': len(archivos)},
+            'archivos': archivos,
+            'tiempos': {
+                'en_cola': round((self.iniciado or ahora) - self.creado, 3),
+                'procesamiento': round((self.terminado or ahora) - self.iniciado, 3) if self.iniciado else None,
+            },
+            **self.info,
+        }
+
+
+class JobManager:
+    """Ejecuta trabajos en un pool acotado y los expira con un único hilo planificador
+
+    `max_cola` limita los trabajos en espera además de los `max_workers` en ejecución; el
+    límite cuenta todos los trabajos sin terminar, también los que esperan datos o corren
+    en un hilo propio. Los trabajos que dependen de una subida por partes esperan los datos
+    fuera del pool (ver `esperar` y ejecutar_en_hilo): una subida detenida no ocupa un
+    worker, pero sí su lugar en la cola. Al expirar un trabajo se borra su directorio temporal.
+    """
+
+    def __init__(self, max_workers=2, max_cola=20, ttl=300):
+        self.max_workers = max_workers
+        self.max_cola = max_cola
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._activos = 0
+        self._lock = threading.Lock()
+        self._expiraciones = []
+        self._cond = threading.Condition()
+        threading.Thread(target=self._planificador, name='job-expiracion', daemon=True).start()
+
+    def enviar(self, funcion, temp_dir, archivos, esperar=None, **info):
+        """Encola `funcion(job)`; su valor de retorno queda como resultado del trabajo
+
+        Con `esperar`, una función que bloquea hasta que el trabajo tiene sus datos (p. ej.
+        SesionSubida.esperar), el trabajo queda 'esperando' en un hilo propio y entra al
+        pool solo cuando `esperar()` termina; si lanza una excepción el trabajo falla.
+        """
+        job = self._registrar_activo(temp_dir, archivos, info)
+        if esperar is None:
+            self._executor.submit(self._ejecutar, job, funcion)
+        else:
+            job.estado = 'esperando'
+            threading.Thread(target=self._esperar_y_enviar, args=(job, funcion, esperar),
+                             name=f'job-espera-{job.id[:8]}', daemon=True).start()
+        return job
+
+    def ejecutar_en_hilo(self, funcion, temp_dir, archivos, **info):
+        """Ejecuta `funcion(job)` en un hilo propio, fuera del pool y de la cola
+
+        Para trabajos que pasan la mayor parte del tiempo esperando datos de la red (como
+        consumir una subida por partes en modo pares, que envía cada par al pool de procesos
+        del PDFProcessor en cuanto llega). Cuenta para el límite de la cola igual que enviar().
+        """
+        job = self._registrar_activo(temp_dir, archivos, info)
+        threading.Thread(target=self._ejecutar, args=(job, funcion),
+                         name=f'job-hilo-{job.id[:8]}', daemon=True).start()
+        return job
+
+    def _registrar_activo(self, temp_dir, archivos, info):
+        """Crea el trabajo si hay lugar; lanza ColaLlenaError si se alcanzó el límite"""
+        with self._lock:
+            if self._activos >= self.max_workers + self.max_cola:
+                raise ColaLlenaError("Hay demasiados trabajos en cola, intenta más tarde")
+            self._activos += 1
+            job = Job(temp_dir, archivos, **info)
+            self._jobs[job.id] = job
+        return job
+
+    def _esperar_y_enviar(self, job, funcion, esperar):
+        try:
+            esperar()
+        except Exception as e:
+            job.error = str(e)
+            job.estado = 'error'
+            job.terminado = time.time()
+            job.finalizar()
+            with self._lock:
+                self._activos -= 1
+            self.programar_expiracion(job)
+            return
+        job.estado = 'en_cola'
+        self._executor.submit(self._ejecutar, job, funcion)
+
+    def registrar(self, temp_dir, resultado, archivos=(), **info):
+        """Registra un resultado ya generado (p. ej. en /upload síncrono) para servirlo y expirarlo
+
+        `resultado` es la lista de artefactos generados.
+        """
+        job = Job(temp_dir, archivos, **info)
+        job.estado = 'completado'
+        job.resultado = resultado
+        job.iniciado = job.terminado = job.creado
+        for indice, ruta in enumerate(resultado):
+            job.publicar(indice, ruta)
+        job.finalizar()
+        with self._lock:
+            self._jobs[job.id] = job
+        self.programar_expiracion(job)
+        return job
+
+    def obtener(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _ejecutar(self, job, funcion):
+        job.iniciado = time.time()
+        job.estado = 'procesando'
+        try:
+            job.resultado = funcion(job)
+            job.estado = 'completado'
+        except Exception as e:
+            job.error = str(e)
+            job.estado = 'error'
+        finally:
+            job.terminado = time.time()
+            job.finalizar()
+            with self._lock:
+                self._activos -= 1
+            self.programar_expiracion(job)
+
+    def programar_expiracion(self, job, ttl=None):
+        with self._cond:
+            heapq.heappush(self._expiraciones, (time.time() + (ttl or self.ttl), job.id))
+            self._cond.notify()
+
+    def _planificador(self):
+        while True:
+            with self._cond:
+                while not self._expiraciones:
+                    self._cond.wait()
+                vence, job_id = self._expiraciones[0]
+                espera = vence - time.time()
+                if espera > 0:
+                    self._cond.wait(espera)
+                    continue
+                heapq.heappop(self._expiraciones)
+
+            with self._lock:
+                job = self._jobs.pop(job_id, None)
+            if job and job.temp_dir:
+                shutil.rmtree(job.temp_dir, ignore_errors=True)
@@ -0,0 +1,185 @@
+import contextvars
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Límites de los buckets del histograma de duración, en segundos
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_traza_actual = contextvars.ContextVar('traza_metricas', default=None)
+
+
+class Span:
+    """Medición de una etapa: duración, bytes de entrada/salida y páginas"""
+
+    __slots__ = ('etapa', 'segundos', 'bytes_entrada', 'bytes_salida', 'paginas')
+
+    def __init__(self, etapa, segundos=0.0, bytes_entrada=0, bytes_salida=0, paginas=0):
+        self.etapa = etapa
+        self.segundos = segundos
+        self.bytes_entrada = bytes_entrada
+        self.bytes_salida = bytes_salida
+        self.paginas = paginas
+
+    def to_dict(self):
+        return {nombre: getattr(self, nombre) for nombre in self.__slots__}
+
+
+def rss_maximo_mb():
+    """RSS máximo del proceso en MB desde que arrancó, o None si la plataforma no lo expone"""
+    if resource is None:
+        return None
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def rss_actual_mb():
+    """RSS actual del proceso en MB (Linux); donde no hay /proc se usa el máximo"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return rss_maximo_mb()
+
+
+def cronometrar(iterable, span):
+    """Recorre `iterable` sumando a span.segundos solo el tiempo que tarda en entregar cada
+    elemento (no el que usa quien lo consume)"""
+    iterador = iter(iterable)
+    while True:
+        inicio = time.perf_counter()
+        try:
+            elemento = next(iterador)
+        except StopIteration:
+            span.segundos += time.perf_counter() - inicio
+            return
+        span.segundos += time.perf_counter() - inicio
+        yield elemento
+
+
+class Traza:
+    """Spans registrados dentro de un bloque `Metricas.traza()` (p. ej. una solicitud)"""
+
+    def __init__(self, capturar=False):
+        self.capturar = capturar
+        self.spans = []
+
+    def resumen(self):
+        """Totales por etapa, en el orden en que aparecieron"""
+        etapas = {}
+        for span in self.spans:
+            total = etapas.setdefault(span.etapa, {
+                'segundos': 0.0, 'llamadas': 0, 'bytes_entrada': 0, 'bytes_salida': 0, 'paginas': 0
+            })
+            total['segundos'] += span.segundos
+            total['llamadas'] += 1
+            total['bytes_entrada'] += span.bytes_entrada
+            total['bytes_salida'] += span.bytes_salida
+            total['paginas'] += span.paginas
+        for total in etapas.values():
+            total['segundos'] = round(total['segundos'], 4)
+        return etapas
+
+
+class Metricas:
+    """Registro en memoria de histogramas y contadores por etapa, exportable a Prometheus
+
+    Los contadores son por proceso. Los spans medidos en los procesos del pool se capturan
+    allí (`traza(capturar=True)`) y se suman en el proceso principal con `incorporar`.
+    """
+
+    def __init__(self, buckets=BUCKETS, prefijo='xmlpdf'):
+        self.buckets = tuple(buckets)
+        self.prefijo = prefijo
+        self._lock = threading.Lock()
+        self._etapas = {}
+
+    def _acumular(self, span):
+        with self._lock:
+            datos = self._etapas.get(span.etapa)
+            if datos is None:
+                datos = self._etapas[span.etapa] = {
+                    'buckets': [0] * len(self.buckets), 'suma': 0.0, 'cuenta': 0,
+                    'bytes_entrada': 0, 'bytes_salida': 0, 'paginas': 0,
+                }
+            for i, limite in enumerate(self.buckets):
+                if span.segundos <= limite:
+                    datos['buckets'][i] += 1
+            datos['suma'] += span.segundos
+            datos['cuenta'] += 1
+            datos['bytes_entrada'] += span.bytes_entrada
+            datos['bytes_salida'] += span.bytes_salida
+            datos['paginas'] += span.paginas
+
+    def registrar(self, span):
+        """Registra un span en la traza activa y, si no se está capturando, en los contadores"""
+        traza = _traza_actual.get()
+        if traza is not None:
+            traza.spans.append(span)
+            if traza.capturar:
+                return
+        self._acumular(span)
+
+    @contextmanager
+    def medir(self, etapa, bytes_entrada=0, bytes_salida=0, paginas=0):
+        """Mide la duración del bloque; el span entregado se puede completar dentro del bloque"""
+        span = Span(etapa, bytes_entrada=bytes_entrada, bytes_salida=bytes_salida, paginas=paginas)
+        inicio = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.segundos = time.perf_counter() - inicio
+            self.registrar(span)
+
+    @contextmanager
+    def traza(self, capturar=False):
+        """Agrupa los spans del bloque; con `capturar` no se suman a los contadores globales"""
+        traza = Traza(capturar)
+        token = _traza_actual.set(traza)
+        try:
+            yield traza
+        finally:
+            _traza_actual.reset(token)
+
+    def incorporar(self, spans):
+        """Registra spans exportados desde otro proceso (lista de dicts de Span.to_dict)"""
+        for datos in spans:
+            self.registrar(Span(**datos))
+
+    def exportar(self):
+        """Texto en el formato de exposición de Prometheus"""
+        with self._lock:
+            etapas = {etapa: dict(datos, buckets=list(datos['buckets'])) for etapa, datos in self._etapas.items()}
+
+        p = self.prefijo
+        lineas = [
+            f"# HELP {p}_etapa_segundos Duración de cada etapa del procesamiento",
+            f"# TYPE {p}_etapa_segundos histogram",
+        ]
+        for etapa, datos in etapas.items():
+            for limite, cuenta in zip(self.buckets, datos['buckets']):
+                lineas.append(f'{p}_etapa_segundos_bucket{{etapa="{etapa}",le="{limite:g}"}} {cuenta}')
+            lineas.append(f'{p}_etapa_segundos_bucket{{etapa="{etapa}",le="+Inf"}} {datos["cuenta"]}')
+            lineas.append(f'{p}_etapa_segundos_sum{{etapa="{etapa}"}} {datos["suma"]:.6f}')
+            lineas.append(f'{p}_etapa_segundos_count{{etapa="{etapa}"}} {datos["cuenta"]}')
+
+        for clave, ayuda in (('bytes_entrada', 'Bytes de entrada procesados'),
+                             ('bytes_salida', 'Bytes de salida generados'),
+                             ('paginas', 'Páginas procesadas')):
+            lineas.append(f"# HELP {p}_etapa_{clave}_total {ayuda} por etapa")
+            lineas.append(f"# TYPE {p}_etapa_{clave}_total counter")
+            for etapa, datos in etapas.items():
+                lineas.append(f'{p}_etapa_{clave}_total{{etapa="{etapa}"}} {datos[clave]}')
+        return "\n".join(lineas) + "\n"
+
+
+# Registro del proceso, compartido por los convertidores y el servidor
+metricas = Metricas()
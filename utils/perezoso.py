@@ -0,0 +1,36 @@
+import importlib
+import threading
+
+
+class ModuloPerezoso:
+    """Módulo que se importa en el primer acceso a uno de sus atributos
+
+    Los backends pesados (PyMuPDF, Pillow) tardan en importarse y ocupan memoria en cada
+    proceso: con esto el servidor arranca sin cargarlos y solo los importa la primera
+    solicitud que los usa, o precalentar() antes de crear los workers del servidor.
+    """
+
+    def __init__(self, nombre):
+        self._nombre = nombre
+        self._modulo = None
+        self._lock = threading.Lock()
+
+    def cargar(self):
+        """Importa el módulo (una sola vez aunque lo pidan varios hilos) y lo devuelve"""
+        if self._modulo is None:
+            with self._lock:
+                if self._modulo is None:
+                    self._modulo = importlib.import_module(self._nombre)
+        return self._modulo
+
+    @property
+    def cargado(self):
+        return self._modulo is not None
+
+    def __getattr__(self, atributo):
+        # Solo se llama para lo que no es atributo propio: se delega en el módulo real
+        return getattr(self.cargar(), atributo)
+
+    def __repr__(self):
+        estado = "cargado" if self.cargado else "sin cargar"
+        return f"<ModuloPerezoso {self._nombre} ({estado})>"
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from converters.pdf_optimizer import contexto_pool
+from utils.metrics import metricas
+from utils.perezoso import ModuloPerezoso
+
+fitz = ModuloPerezoso("fitz")  # PyMuPDF
+
+# Cambiar cuando el renderizado produzca una imagen distinta (invalida los ETag ya entregados)
+VERSION = 1
+
+ANCHO_MIN = 16
+
+
+def _contar_paginas(ruta):
+    doc = fitz.open(ruta)
+    try:
+        return doc.page_count
+    finally:
+        doc.close()
+
+
+def _renderizar_pagina(ruta, pagina, ancho):
+    doc = fitz.open(ruta)
+    try:
+        page = doc.load_page(pagina)
+        escala = ancho / page.rect.width
+        pix = page.get_pixmap(matrix=fitz.Matrix(escala, escala), alpha=False)
+        return pix.tobytes("png")
+    finally:
+        doc.close()
+
+
+class CachePrevisualizaciones:
+    """Miniaturas PNG de páginas de PDF generados, renderizadas con fitz solo cuando se piden
+
+    Se guardan en memoria con un límite de `max_bytes` (LRU). La clave incluye la identidad
+    del archivo (inode, tamaño y mtime), así que un PDF reemplazado nunca sirve miniaturas
+    viejas. El ETag se obtiene de la clave sin renderizar: una revalidación (If-None-Match)
+    se responde sin abrir el PDF.
+
+    PyMuPDF no admite usarse desde varios hilos a la vez y el proceso del servidor ya lo usa
+    en los hilos de los trabajos: las páginas se cuentan y renderizan en `workers` procesos
+    propios (del servidor de procesos de contexto_pool, creados en la primera miniatura que
+    no está en memoria). Si un worker muere el pool se reemplaza.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ancho_max=400, workers=1):
+        self.max_bytes = max_bytes
+        self.ancho_max = ancho_max
+        self._imagenes = OrderedDict()
+        self._paginas = {}
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+        self.workers = workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _identidad(ruta):
+        st = os.stat(ruta)
+        return (ruta, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def ancho(self, ancho):
+        """Ancho en píxeles dentro de [ANCHO_MIN, ancho_max]"""
+        return max(ANCHO_MIN, min(self.ancho_max, ancho))
+
+    def etag(self, ruta, pagina, ancho):
+        identidad = self._identidad(ruta)
+        return hashlib.sha1(repr((VERSION, identidad, pagina, self.ancho(ancho))).encode()).hexdigest()
+
+    def paginas(self, ruta):
+        """Número de páginas del PDF (se abre una sola vez mientras no cambie)"""
+        identidad = self._identidad(ruta)
+        with self._lock:
+            if identidad in self._paginas:
+                return self._paginas[identidad]
+        total = self._en_proceso(_contar_paginas, ruta)
+        with self._lock:
+            if len(self._paginas) > 4096:
+                self._paginas.clear()
+            self._paginas[identidad] = total
+        return total
+
+    def miniatura(self, ruta, pagina, ancho=150):
+        """Devuelve (PNG, etag) de la página `pagina` (desde 0) con `ancho` píxeles
+
+        Lanza IndexError si la página no existe.
+        """
+        total = self.paginas(ruta)
+        if not 0 <= pagina < total:
+            raise IndexError(f"El PDF tiene {total} páginas")
+        ancho = self.ancho(ancho)
+        clave = self.etag(ruta, pagina, ancho)
+        with self._lock:
+            data = self._imagenes.get(clave)
+            if data is not None:
+                self._imagenes.move_to_end(clave)
+                self.hits += 1
+                return data, clave
+            self.misses += 1
+
+        data = self._renderizar(ruta, pagina, ancho)
+        with self._lock:
+            if clave not in self._imagenes and len(data) <= self.max_bytes:
+                self._imagenes[clave] = data
+                self._total += len(data)
+                while self._total > self.max_bytes:
+                    _, desalojada = self._imagenes.popitem(last=False)
+                    self._total -= len(desalojada)
+        return data, clave
+
+    def _en_proceso(self, funcion, *args):
+        for intento in range(2):
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=contexto_pool())
+                pool = self._pool
+            try:
+                return pool.submit(funcion, *args).result()
+            except BrokenProcessPool:
+                # Un worker murió (o no pudo iniciar): el pool ya no sirve, se crea otro
+                with self._lock:
+                    if self._pool is pool:
+                        self._pool = None
+                if intento:
+                    raise
+
+    def _renderizar(self, ruta, pagina, ancho):
+        with metricas.medir("preview_render", paginas=1) as span:
+            data = self._en_proceso(_renderizar_pagina, ruta, pagina, ancho)
+            span.bytes_salida = len(data)
+        return data
+
+    def cerrar(self):
+        """Termina los procesos de renderizado (se vuelven a crear si se pide otra miniatura)"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def estadisticas(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'bytes': self._total,
+                    'max_bytes': self.max_bytes, 'imagenes': len(self._imagenes)}
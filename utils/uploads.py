@@ -0,0 +1,208 @@
+import os
+import threading
+import time
+import uuid
+from werkzeug.utils import secure_filename
+from utils.file_utils import IndicePares
+
+TAM_BLOQUE = 64 * 1024
+
+
+class ErrorSubida(Exception):
+    """Solicitud de subida inválida; `status` es el código HTTP con que se responde"""
+
+    def __init__(self, mensaje, status=400):
+        super().__init__(mensaje)
+        self.status = status
+
+
+class SesionSubida:
+    """Subida por partes de un lote: los archivos se declaran al crearla y luego cada uno
+    se envía en uno o más fragmentos, que se pueden reanudar tras un corte
+
+    Los archivos terminados se entregan a medida que se completan (`pares()` en modo
+    pares, `esperar()` en modo completo) para que la conversión avance durante la subida.
+    Si no llega nada en `timeout` segundos la sesión expira y quien espera recibe ErrorSubida.
+    """
+
+    def __init__(self, temp_dir, modo, archivos, timeout=600):
+        self.id = uuid.uuid4().hex
+        self.temp_dir = temp_dir
+        self.modo = modo
+        self.timeout = timeout
+        self.estado = 'subiendo'
+        self.archivos = []
+        for nombre, tamano in archivos:
+            self.archivos.append({'nombre': nombre, 'tamano': tamano, 'recibidos': 0, 'en_curso': False})
+        # Pares por nombre de los archivos declarados; los que no tienen par quedan en `huerfanos`
+        self.indice = IndicePares(datos['nombre'] for datos in self.archivos)
+        self.huerfanos = self.indice.huerfanos() if modo == 'pares' else []
+        self.ultimo_uso = time.time()
+        self.job = None  # trabajo que convierte lo que llega
+        self._cond = threading.Condition()
+        if all(self._completo(i) for i in range(len(self.archivos))):
+            self.estado = 'completa'  # solo archivos vacíos
+
+    def ruta(self, indice):
+        return os.path.join(self.temp_dir, self.archivos[indice]['nombre'])
+
+    def rutas(self):
+        return [self.ruta(i) for i in range(len(self.archivos))]
+
+    def to_dict(self):
+        with self._cond:
+            archivos = [{clave: datos[clave] for clave in ('nombre', 'tamano', 'recibidos')}
+                        for datos in self.archivos]
+            estado = self.estado
+        return {
+            'upload_id': self.id,
+            'estado': estado,
+            'archivos': archivos,
+            'recibidos': sum(datos['recibidos'] for datos in archivos),
+            'total': sum(datos['tamano'] for datos in archivos),
+            'huerfanos': self.huerfanos,
+        }
+
+    def _completo(self, indice):
+        datos = self.archivos[indice]
+        return datos['recibidos'] >= datos['tamano'] and not datos['en_curso']
+
+    def escribir(self, indice, inicio, stream):
+        """Escribe desde `stream` el fragmento del archivo `indice` que empieza en `inicio`
+
+        Se acepta volver a enviar desde antes de lo ya recibido (p. ej. si se perdió la
+        respuesta); empezar más adelante devuelve 409 con lo recibido para reanudar desde ahí.
+        Devuelve los bytes recibidos del archivo.
+        """
+        if not 0 <= indice < len(self.archivos):
+            raise ErrorSubida("Archivo no declarado en la subida", 404)
+        with self._cond:
+            if self.estado != 'subiendo':
+                raise ErrorSubida(f"La subida ya no acepta archivos ({self.estado})", 409)
+            datos = self.archivos[indice]
+            if datos['en_curso']:
+                raise ErrorSubida("Ya se está recibiendo un fragmento de este archivo", 409)
+            if inicio > datos['recibidos']:
+                raise ErrorSubida(f"Se esperaba el byte {datos['recibidos']}", 409)
+            datos['en_curso'] = True
+            self.ultimo_uso = time.time()
+
+        recibidos = inicio
+        try:
+            with open(self.ruta(indice), 'r+b' if inicio else 'wb') as f:
+                f.seek(inicio)
+                f.truncate()
+                for bloque in iter(lambda: stream.read(TAM_BLOQUE), b''):
+                    if recibidos + len(bloque) > datos['tamano']:
+                        raise ErrorSubida("El fragmento supera el tamaño declarado del archivo")
+                    f.write(bloque)
+                    recibidos += len(bloque)
+        finally:
+            # Lo que se alcanzó a escribir cuenta aunque la conexión se haya cortado
+            with self._cond:
+                datos['recibidos'] = min(recibidos, datos['tamano'])
+                datos['en_curso'] = False
+                self.ultimo_uso = time.time()
+                if all(self._completo(i) for i in range(len(self.archivos))):
+                    self.estado = 'completa'
+                self._cond.notify_all()
+        return datos['recibidos']
+
+    def cancelar(self):
+        with self._cond:
+            if self.estado == 'subiendo':
+                self.estado = 'cancelada'
+            self._cond.notify_all()
+
+    def _esperar_cambio(self):
+        """Espera con el lock tomado; expira la sesión si pasó `timeout` sin actividad"""
+        if self.estado == 'cancelada':
+            raise ErrorSubida("La subida fue cancelada")
+        restante = self.ultimo_uso + self.timeout - time.time()
+        if restante <= 0 and not any(datos['en_curso'] for datos in self.archivos):
+            self.estado = 'expirada'
+            raise ErrorSubida("La subida expiró sin recibir todos los archivos")
+        self._cond.wait(max(restante, 1))
+
+    def esperar(self):
+        """Bloquea hasta que llegan todos los archivos y devuelve sus rutas en orden"""
+        with self._cond:
+            while self.estado != 'completa':
+                self._esperar_cambio()
+        return self.rutas()
+
+    def pares(self, por_uuid=False):
+        """Entrega (base, [rutas]) por cada grupo PDF+XML en cuanto sus archivos están completos
+
+        Con `por_uuid`, al terminar la subida se intenta emparejar por el UUID del CFDI los
+        archivos que no tienen par por nombre; los que sigan sueltos quedan en `huerfanos`.
+        """
+        posiciones = {datos['nombre']: i for i, datos in enumerate(self.archivos)}
+        pendientes = {base: [posiciones[nombre] for nombre in nombres]
+                      for base, nombres in self.indice.completos().items()}
+        while pendientes:
+            with self._cond:
+                listos = [base for base, indices in pendientes.items()
+                          if all(self._completo(i) for i in indices)]
+                if not listos:
+                    self._esperar_cambio()
+                    continue
+            for base in listos:
+                yield base, [self.ruta(i) for i in pendientes.pop(base)]
+
+        if por_uuid and self.huerfanos:
+            self.esperar()
+            sueltos = IndicePares(self.ruta(posiciones[nombre]) for huerfano in self.huerfanos
+                                  for nombre in huerfano['archivos'])
+            sueltos.emparejar_por_uuid()
+            self.huerfanos = sueltos.huerfanos()
+            yield from sueltos.completos().items()
+
+
+class GestorSubidas:
+    """Sesiones de subida activas; una sesión desaparece cuando se borra su directorio
+    (lo hace el JobManager al expirar el trabajo asociado)
+
+    Como mucho `max_sesiones` pueden estar recibiendo archivos a la vez; las terminadas,
+    canceladas o expiradas no cuentan.
+    """
+
+    def __init__(self, max_bytes=2 * 1024 * 1024 * 1024, timeout=600, max_sesiones=20):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.max_sesiones = max_sesiones
+        self._sesiones = {}
+        self._lock = threading.Lock()
+
+    def crear(self, temp_dir, modo, archivos):
+        """Crea una sesión para `archivos`, lista de (nombre, tamaño) declarados por el cliente"""
+        declarados = []
+        for nombre, tamano in archivos:
+            seguro = secure_filename(nombre or '')
+            if not seguro:
+                raise ErrorSubida(f"Nombre de archivo no válido: {nombre}")
+            if not isinstance(tamano, int) or tamano < 0:
+                raise ErrorSubida(f"Tamaño no válido para {nombre}")
+            declarados.append((seguro, tamano))
+        if len({nombre for nombre, _ in declarados}) != len(declarados):
+            raise ErrorSubida("Hay archivos repetidos en la subida")
+        if sum(tamano for _, tamano in declarados) > self.max_bytes:
+            raise ErrorSubida(f"La subida supera el máximo de {self.max_bytes // (1024 * 1024)} MB", 413)
+
+        with self._lock:
+            self._purgar()
+            abiertas = sum(1 for s in self._sesiones.values() if s.estado == 'subiendo')
+            if abiertas >= self.max_sesiones:
+                raise ErrorSubida("Hay demasiadas subidas en curso, intenta más tarde", 503)
+            sesion = SesionSubida(temp_dir, modo, declarados, timeout=self.timeout)
+            self._sesiones[sesion.id] = sesion
+        return sesion
+
+    def obtener(self, upload_id):
+        with self._lock:
+            self._purgar()
+            return self._sesiones.get(upload_id)
+
+    def _purgar(self):
+        for upload_id in [i for i, s in self._sesiones.items() if not os.path.isdir(s.temp_dir)]:
+            del self._sesiones[upload_id]
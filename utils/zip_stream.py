@@ -0,0 +1,78 @@
+import os
+import time
+import zipfile
+from urllib.parse import quote
+from utils.metrics import Span, metricas
+
+TAM_BLOQUE = 64 * 1024
+
+# Formatos que ya vienen comprimidos: se guardan sin volver a comprimir
+EXTENSIONES_COMPRIMIDAS = {'.pdf', '.zip', '.jpg', '.jpeg', '.png'}
+
+
+class _SalidaStream:
+    """Destino no posicionable para zipfile: acumula lo escrito hasta que se drena"""
+
+    def __init__(self):
+        self._partes = []
+
+    def write(self, data):
+        self._partes.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drenar(self):
+        data = b"".join(self._partes)
+        self._partes = []
+        return data
+
+
+def generar_zip(archivos, tam_bloque=TAM_BLOQUE):
+    """Genera un ZIP en bloques a partir de un iterable de rutas (o pares (ruta, arcname))
+
+    Cada archivo se escribe en cuanto el iterable lo entrega, por lo que el iterable puede
+    esperar a que termine el procesamiento. La memoria usada es de un bloque por vez.
+    """
+    salida = _SalidaStream()
+    with zipfile.ZipFile(salida, 'w') as zipf:
+        for archivo in archivos:
+            ruta, arcname = archivo if isinstance(archivo, tuple) else (archivo, os.path.basename(archivo))
+            tamano = os.path.getsize(ruta)
+
+            info = zipfile.ZipInfo(arcname, date_time=time.localtime(os.path.getmtime(ruta))[:6])
+            info.external_attr = 0o644 << 16
+            if os.path.splitext(arcname)[1].lower() in EXTENSIONES_COMPRIMIDAS:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+
+            # Solo se mide el tiempo propio, no la espera del consumidor entre bloques
+            span = Span("zip", bytes_entrada=tamano)
+            inicio = time.perf_counter()
+            with open(ruta, 'rb') as origen, zipf.open(info, 'w', force_zip64=tamano > zipfile.ZIP64_LIMIT) as destino:
+                for bloque in iter(lambda: origen.read(tam_bloque), b''):
+                    destino.write(bloque)
+                    data = salida.drenar()
+                    if data:
+                        span.segundos += time.perf_counter() - inicio
+                        span.bytes_salida += len(data)
+                        yield data
+                        inicio = time.perf_counter()
+            data = salida.drenar()
+            span.segundos += time.perf_counter() - inicio
+            span.bytes_salida += len(data)
+            metricas.registrar(span)
+            if data:
+                yield data
+    # Directorio central
+    data = salida.drenar()
+    if data:
+        yield data
+
+
+def content_disposition(filename):
+    """Cabecera Content-Disposition de descarga con nombre compatible con UTF-8"""
+    ascii_name = filename.encode('ascii', 'replace').decode().replace('"', '').replace('?', '_')
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}"